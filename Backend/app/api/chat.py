@@ -1,105 +1,89 @@
 """
 聊天相关 API 路由
 """
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import threading
+from datetime import datetime
+from fastapi import APIRouter, BackgroundTasks, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 from pymongo.asynchronous.database import AsyncDatabase
-from typing import Optional
+from starlette.concurrency import run_in_threadpool
+from typing import Optional, List, Literal
 
+from app.core.config import settings
 from app.core.database import get_db
 from app.core.dependencies import get_current_user
+from app.core.http_cache import etag_matches, make_etag, not_modified, set_etag
+from app.core.metrics import metrics
+from app.core.serialization import FastJSONResponse
+from app.models.chat import conversation_detail_helper
 from app.schemas.chat import (
     ChatRequest,
     ChatResponse,
     ConversationInfo,
     ConversationDetail,
     ConversationListResponse,
+    BulkConversationRequest,
+    BulkRenameRequest,
+    BulkItemResult,
+    BulkOperationResponse,
+    DeleteAllResponse,
+    ModelInfo,
+    ModelListResponse,
 )
 from app.schemas.user import MessageResponse
 from app.services.chat_service import (
     create_conversation,
     get_conversation_by_id,
+    find_conversation_document,
     get_user_conversations,
     count_user_conversations,
+    get_latest_update,
     add_message_to_conversation,
+    save_assistant_reply,
     update_conversation_title,
     delete_conversation,
     get_conversation_context,
+    context_projection,
+    DETAIL_PROJECTION,
+    conversation_version,
+    get_conversation_version,
+    bulk_delete_conversations,
+    bulk_update_conversation_titles,
+    bulk_archive_conversations,
+    delete_all_user_conversations,
+)
+from app.services.export_service import EXPORT_FORMATS, stream_conversation_export
+from app.services.ai_service import compute_segment_fields, generate_ai_reply
+from app.services.rag_service import augment_messages
+from app.services.load_shedding import load_shedder
+from app.services.idempotency_service import IdempotencyConflict, request_fingerprint, run_idempotent
+from app.services.model_registry import model_registry, get_model_paths, resolve_model_name
+from app.services.summary_service import (
+    needs_summary,
+    record_prompt_savings,
+    update_conversation_summary,
 )
 
-# 导入模型
-from modelscope import AutoTokenizer, AutoModelForCausalLM
-
-# 模型路径 - 建议后续改为配置文件
-MODEL_PATH = r"e:\pythonCode\Model\Qwen\Qwen3-0___6B"
-
-# 延迟加载模型（首次调用时加载）
-_model = None
-_tokenizer = None
-
-
-def get_model():
-    """获取模型实例（延迟加载）"""
-    global _model, _tokenizer
-    if _model is None:
-        print("🤖 正在加载 AI 模型...")
-        _model = AutoModelForCausalLM.from_pretrained(
-            MODEL_PATH,
-            dtype="auto",
-            device_map="auto"
-        )
-        _tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
-        print("✅ AI 模型加载完成")
-    return _model, _tokenizer
-
-
-def generate_ai_response(messages: list) -> str:
-    """
-    调用 AI 模型生成回复
-    
-    Args:
-        messages: 对话历史消息列表
-    
-    Returns:
-        AI 生成的回复文本
-    """
-    model, tokenizer = get_model()
-    
-    # 构建对话输入
-    text = tokenizer.apply_chat_template(
-        messages,
-        tokenize=False,
-        add_generation_prompt=True,
-        enable_thinking=True  # 启用思考模式
-    )
-    
-    model_inputs = tokenizer([text], return_tensors="pt").to(model.device)
-    
-    # 生成回复
-    generated_ids = model.generate(
-        **model_inputs,
-        max_new_tokens=32768,
-    )
-    
-    # 提取生成的部分（排除输入）
-    output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist()
-    
-    # 解析思考内容，找到 </think> 标记 (151668)
-    try:
-        index = len(output_ids) - output_ids[::-1].index(151668)
-    except ValueError:
-        index = 0
-    
-    # 只返回思考后的实际回复内容
-    response = tokenizer.decode(output_ids[index:], skip_special_tokens=True).strip("\n")
-    return response
+router = APIRouter()
 
 
-router = APIRouter()
+async def _watch_disconnect(http_request: Request, cancel_event: threading.Event):
+    """轮询客户端连接状态，断开时设置取消标记，让生成在下一个解码步停止"""
+    while not cancel_event.is_set():
+        if await http_request.is_disconnected():
+            cancel_event.set()
+            return
+        await asyncio.sleep(settings.CANCEL_POLL_INTERVAL)
 
 
 @router.post("/chat", response_model=ChatResponse, summary="发送聊天消息")
 async def chat(
     request: ChatRequest,
+    http_request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    idempotency_key: Optional[str] = Header(default=None, alias="Idempotency-Key", max_length=128),
     current_user: dict = Depends(get_current_user),
     db: AsyncDatabase = Depends(get_db)
 ):
@@ -108,6 +92,8 @@ async def chat(
     
     - **message**: 用户消息内容
     - **conversation_id**: 会话ID（可选，不传则创建新会话）
+    - **model**: 模型名称（可选，不传则使用默认模型）
+    - **Idempotency-Key**: 请求头（可选），重试时携带相同的值不会重复生成和保存消息
     
     返回:
     - **message**: AI 回复内容
@@ -115,8 +101,51 @@ async def chat(
     - **created_at**: 创建时间
     """
     user_id = current_user["id"]
+    if not idempotency_key:
+        return await _process_chat(request, user_id, db, background_tasks, http_request)
+    
+    # 带幂等键的请求：客户端断开后会重试，不因断开而取消生成；
+    # 生成失败时返回 503 而不是保存下来的错误提示，幂等记录随之删除，重试会重新生成
+    async def handler() -> dict:
+        chat_response = await _process_chat(request, user_id, db, background_tasks, fail_on_error=True)
+        return chat_response.model_dump()
+    
+    try:
+        stored, replayed = await run_idempotent(
+            db, user_id, idempotency_key, request_fingerprint(request.model_dump()), handler
+        )
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return ChatResponse(**stored)
+
+
+async def _process_chat(
+    request: ChatRequest,
+    user_id: str,
+    db: AsyncDatabase,
+    background_tasks: BackgroundTasks,
+    http_request: Optional[Request] = None,
+    fail_on_error: bool = False
+) -> ChatResponse:
+    """
+    处理一次聊天：保存用户消息、生成并保存回复
+    
+    传入 http_request 时监听客户端断开并取消生成；
+    fail_on_error 时生成失败在保存错误提示后抛出 503，而不是把错误提示作为回复返回
+    """
     conversation_id = request.conversation_id
     
+    # 校验模型名称
+    try:
+        model_name = resolve_model_name(request.model)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    # 按当前负载决定本次的生成配置（压力大时逐级降级）
+    plan = load_shedder.plan()
+    
     # 如果没有提供会话ID，创建新会话
     if not conversation_id:
         # 使用用户消息的前20个字符作为标题
@@ -125,46 +154,109 @@ async def chat(
         conversation_id = conversation["id"]
         context_messages = []
     else:
-        # 获取现有会话
-        conversation = await get_conversation_by_id(db, conversation_id, user_id)
+        # 获取现有会话（只读取上下文窗口内的消息）
+        conversation = await get_conversation_by_id(db, conversation_id, user_id, context_projection())
         if not conversation:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="会话不存在或无权访问"
             )
-        # 获取历史上下文
-        context_messages = get_conversation_context(conversation)
+        # 获取历史上下文（降级时可能缩短）
+        context_messages = get_conversation_context(conversation, plan.context_messages)
+        if settings.CONTEXT_SUMMARY_ENABLED and conversation.get("summary"):
+            record_prompt_savings(conversation)
     
     # 保存用户消息
     await add_message_to_conversation(
-        db, conversation_id, user_id, "user", request.message
+        db, conversation_id, user_id, "user", request.message,
+        await compute_segment_fields("user", request.message, model_name)
     )
     
     # 构建发送给 AI 的消息列表
     ai_messages = context_messages + [{"role": "user", "content": request.message}]
+    if settings.RAG_ENABLED:
+        ai_messages = await run_in_threadpool(augment_messages, ai_messages, request.message)
     
-    # 生成 AI 回复
+    # 生成 AI 回复（在线程池中运行，同时监听客户端是否断开）
+    cancel_event = threading.Event()
+    watcher = asyncio.create_task(_watch_disconnect(http_request, cancel_event)) if http_request else None
     try:
-        ai_response = generate_ai_response(ai_messages)
+        with load_shedder.track(plan) as sample:
+            result = await run_in_threadpool(
+                generate_ai_reply, ai_messages, model_name=model_name, should_stop=cancel_event.is_set,
+                queued_at=sample.started, **plan.generate_kwargs()
+            )
+            sample.tokens = result.completion_tokens
+        ai_response = result.text
     except Exception as e:
         print(f"AI 生成错误: {e}")
+        result = None
         ai_response = "抱歉，AI 暂时无法响应，请稍后重试。"
+    finally:
+        if watcher:
+            watcher.cancel()
     
-    # 保存 AI 回复
-    await add_message_to_conversation(
-        db, conversation_id, user_id, "assistant", ai_response
-    )
+    # 保存 AI 回复（被取消的回复按配置的策略处理）
+    cancelled = result is not None and result.cancelled
+    extra = await compute_segment_fields("assistant", ai_response, model_name) if result and not cancelled else None
+    if result is not None:
+        # 用量记录（被取消的生成同样消耗了算力）
+        extra = {**(extra or {}), "usage": result.usage(model_name)}
+    if plan.degraded:
+        extra = {**(extra or {}), "degraded": plan.level}
+    saved = await save_assistant_reply(db, conversation_id, user_id, ai_response, cancelled, extra)
+    ai_response = saved if saved is not None else ai_response
+    if result is None and fail_on_error:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="AI 暂时无法响应，请稍后重试"
+        )
+    
+    # 记忆模式：本轮新增的两条消息使更早的消息滑出窗口时，在响应返回后更新摘要
+    if settings.CONTEXT_SUMMARY_ENABLED:
+        message_count = conversation["message_count"] + 2
+        if needs_summary(message_count, conversation.get("summary_until", 0)):
+            background_tasks.add_task(update_conversation_summary, db, conversation_id, model_name)
     
     return ChatResponse(
         message=ai_response,
-        conversation_id=conversation_id
+        conversation_id=conversation_id,
+        cancelled=cancelled,
+        degraded=plan.level
     )
 
 
+@router.get("/models", response_model=ModelListResponse, summary="获取可用模型列表")
+async def list_models(current_user: dict = Depends(get_current_user)):
+    """
+    获取可用模型及其加载状态
+    
+    返回:
+    - **models**: 模型列表
+    """
+    resident = {item["name"]: item for item in model_registry.resident()}
+    if settings.ADAPTERS:
+        from app.services.adapter_manager import adapter_manager
+        resident.update({item["name"]: item for item in adapter_manager.resident()})
+    
+    return ModelListResponse(models=[
+        ModelInfo(
+            name=name,
+            default=name == settings.DEFAULT_MODEL,
+            adapter=name in settings.ADAPTERS,
+            resident=name in resident,
+            in_use=resident.get(name, {}).get("in_use", 0)
+        )
+        for name in [*get_model_paths(), *settings.ADAPTERS]
+    ])
+
+
 @router.get("/conversations", response_model=ConversationListResponse, summary="获取会话列表")
 async def list_conversations(
+    response: Response,
     skip: int = 0,
     limit: int = 20,
+    if_none_match: Optional[str] = Header(default=None),
     current_user: dict = Depends(get_current_user),
     db: AsyncDatabase = Depends(get_db)
 ):
@@ -173,6 +265,7 @@ async def list_conversations(
     
     - **skip**: 跳过数量（分页）
     - **limit**: 获取数量（分页）
+    - **If-None-Match**: 请求头（可选），列表未变化时返回 304
     
     返回:
     - **conversations**: 会话列表
@@ -180,8 +273,18 @@ async def list_conversations(
     """
     user_id = current_user["id"]
     
-    conversations = await get_user_conversations(db, user_id, skip, limit)
+    # 列表版本由会话总数与最近更新时间组成：新建、删除改变总数，
+    # 新消息、改标题都会更新 updated_at。两者都只读取 (user_id, updated_at) 索引，
+    # 总数本身也是响应的一部分，写入路径无需额外维护版本
     total = await count_user_conversations(db, user_id)
+    latest = await get_latest_update(db, user_id)
+    etag = make_etag(user_id, latest, total, skip, limit)
+    if etag_matches(if_none_match, etag):
+        metrics.inc("http_not_modified_total", route="conversations")
+        return not_modified(etag)
+    set_etag(response, etag)
+    
+    conversations = await get_user_conversations(db, user_id, skip, limit)
     
     # 转换为响应格式
     conv_list = [
@@ -198,9 +301,122 @@ async def list_conversations(
     return ConversationListResponse(conversations=conv_list, total=total)
 
 
+@router.get("/conversations/export", summary="导出聊天记录")
+async def export_conversations(
+    export_format: Literal["jsonl", "markdown"] = Query(default="jsonl", alias="format"),
+    ids: Optional[List[str]] = Query(default=None),
+    gzip: bool = False,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db)
+):
+    """
+    流式导出当前用户的聊天记录
+    
+    - **format**: 导出格式，jsonl（每行一个会话）或 markdown
+    - **ids**: 指定导出的会话ID（可多次传入），不传则导出全部
+    - **gzip**: 是否以 gzip 压缩文件形式下载
+    
+    返回:
+    - 分块传输的导出文件
+    """
+    media_type, extension = EXPORT_FORMATS[export_format]
+    filename = f"conversations_{datetime.utcnow():%Y%m%d%H%M%S}.{extension}"
+    if gzip:
+        media_type = "application/gzip"
+        filename += ".gz"
+    
+    return StreamingResponse(
+        stream_conversation_export(db, current_user["id"], export_format, ids, gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+def _bulk_response(conversation_ids: List[str], results: dict) -> BulkOperationResponse:
+    """按请求顺序整理批量操作结果"""
+    items = [
+        BulkItemResult(id=cid, success=results[cid][0], detail=results[cid][1])
+        for cid in dict.fromkeys(conversation_ids)
+    ]
+    succeeded = sum(1 for item in items if item.success)
+    return BulkOperationResponse(results=items, succeeded=succeeded, failed=len(items) - succeeded)
+
+
+@router.post("/conversations/bulk/delete", response_model=BulkOperationResponse, summary="批量删除会话")
+async def bulk_delete(
+    request: BulkConversationRequest,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db)
+):
+    """
+    批量删除会话（一次请求、一次数据库删除）
+    
+    - **ids**: 会话ID列表
+    
+    返回:
+    - 每个会话的处理结果
+    """
+    results = await bulk_delete_conversations(db, request.ids, current_user["id"])
+    return _bulk_response(request.ids, results)
+
+
+@router.post("/conversations/bulk/rename", response_model=BulkOperationResponse, summary="批量重命名会话")
+async def bulk_rename(
+    request: BulkRenameRequest,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db)
+):
+    """
+    批量更新会话标题
+    
+    - **items**: [{id, title}] 列表，同一ID出现多次时以最后一次为准
+    
+    返回:
+    - 每个会话的处理结果
+    """
+    titles = {item.id: item.title for item in request.items}
+    results = await bulk_update_conversation_titles(db, titles, current_user["id"])
+    return _bulk_response(list(titles), results)
+
+
+@router.post("/conversations/bulk/archive", response_model=BulkOperationResponse, summary="批量归档会话")
+async def bulk_archive(
+    request: BulkConversationRequest,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db)
+):
+    """
+    批量将会话移入冷存储，再次访问时自动恢复
+    
+    - **ids**: 会话ID列表
+    
+    返回:
+    - 每个会话的处理结果
+    """
+    results = await bulk_archive_conversations(db, request.ids, current_user["id"])
+    return _bulk_response(request.ids, results)
+
+
+@router.delete("/conversations", response_model=DeleteAllResponse, summary="删除全部会话")
+async def delete_all_conversations(
+    current_user: dict = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db)
+):
+    """
+    删除当前用户的全部会话
+    
+    返回:
+    - **deleted_count**: 删除的会话数量
+    """
+    deleted_count = await delete_all_user_conversations(db, current_user["id"])
+    return DeleteAllResponse(message="会话已全部删除", deleted_count=deleted_count)
+
+
 @router.get("/conversations/{conversation_id}", response_model=ConversationDetail, summary="获取会话详情")
 async def get_conversation(
     conversation_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(default=None),
     current_user: dict = Depends(get_current_user),
     db: AsyncDatabase = Depends(get_db)
 ):
@@ -208,18 +424,41 @@ async def get_conversation(
     获取指定会话的详情（包含所有消息）
     
     - **conversation_id**: 会话ID
+    - **If-None-Match**: 请求头（可选），会话未变化时返回 304
     
     返回:
     - 会话详情，包含消息列表
     """
     user_id = current_user["id"]
     
-    conversation = await get_conversation_by_id(db, conversation_id, user_id)
+    if if_none_match:
+        # 只读取版本字段，未变化时不传输和序列化消息
+        version = await get_conversation_version(db, conversation_id, user_id)
+        if version is not None:
+            etag = make_etag(conversation_id, *version)
+            if etag_matches(if_none_match, etag):
+                metrics.inc("http_not_modified_total", route="conversation_detail")
+                return not_modified(etag)
+    
+    if settings.FAST_JSON_RESPONSES:
+        # 快速路径：直接从驱动返回的文档编码 JSON
+        document = await find_conversation_document(db, conversation_id, user_id, DETAIL_PROJECTION)
+        if not document:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="会话不存在或无权访问"
+            )
+        fast_response = FastJSONResponse(conversation_detail_helper(document))
+        set_etag(fast_response, make_etag(conversation_id, *conversation_version(document)))
+        return fast_response
+    
+    conversation = await get_conversation_by_id(db, conversation_id, user_id, DETAIL_PROJECTION)
     if not conversation:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="会话不存在或无权访问"
         )
+    set_etag(response, make_etag(conversation_id, *conversation_version(conversation)))
     
     return ConversationDetail(
         id=conversation["id"],
@@ -0,0 +1,37 @@
+"""
+用量统计 API 路由
+"""
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query
+from pymongo.asynchronous.database import AsyncDatabase
+
+from app.core.database import get_db
+from app.core.dependencies import get_current_user
+from app.schemas.usage import UsageDay, UsageResponse
+from app.services.usage_service import get_user_usage
+
+router = APIRouter()
+
+DAY_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+
+
+@router.get("/usage", response_model=UsageResponse, summary="获取用量统计")
+async def get_usage(
+    start: Optional[str] = Query(default=None, pattern=DAY_PATTERN),
+    end: Optional[str] = Query(default=None, pattern=DAY_PATTERN),
+    current_user: dict = Depends(get_current_user),
+    db: AsyncDatabase = Depends(get_db)
+):
+    """
+    获取当前用户按天、模型汇总的用量
+
+    - **start**: 开始日期 YYYY-MM-DD（可选，含当天）
+    - **end**: 结束日期 YYYY-MM-DD（可选，含当天）
+
+    返回:
+    - **days**: 每天每个模型的回复条数、token 数与耗时（由后台任务定期汇总，
+      最近 USAGE_ROLLUP_INTERVAL_SECONDS + USAGE_ROLLUP_LAG_SECONDS 内的回复可能尚未计入）
+    """
+    rows = await get_user_usage(db, current_user["id"], start, end)
+    return UsageResponse(days=[UsageDay(**row) for row in rows])
@@ -0,0 +1,333 @@
+"""
+WebSocket 聊天路由
+每个连接只认证一次并缓存会话的最近上下文，同一连接上可以同时进行多个会话的对话，
+回复按 token 流式推送
+
+缓存的上下文每轮都会按消息数量校验一次（只读取版本字段），
+同一会话在其他连接或 HTTP 接口上有新消息或被删除时重新读取
+
+连接: ws://<host>/aifs/ws/chat?token=<JWT>
+
+客户端消息:
+- {"type": "chat", "request_id": "...", "message": "...", "conversation_id": "...", "model": "..."}
+- {"type": "cancel", "request_id": "..."}
+
+服务端消息:
+- {"type": "start", "request_id", "conversation_id"}
+- {"type": "delta", "request_id", "conversation_id", "content"}
+- {"type": "done", "request_id", "conversation_id", "message", "cancelled", "degraded"}
+- {"type": "error", "request_id", "detail"}
+"""
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, Query, WebSocket, WebSocketDisconnect, status
+from pydantic import ValidationError
+from pymongo.asynchronous.database import AsyncDatabase
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.database import get_db
+from app.core.dependencies import authenticate_token
+from app.core.metrics import metrics
+from app.schemas.chat import WsChatRequest
+from app.services.ai_service import compute_segment_fields, stream_ai_reply
+from app.services.chat_service import (
+    create_conversation,
+    get_conversation_by_id,
+    get_conversation_version,
+    add_message_to_conversation,
+    save_assistant_reply,
+    get_conversation_context,
+    context_projection,
+)
+from app.services.load_shedding import GenerationPlan, load_shedder
+from app.services.rag_service import augment_messages
+from app.services.model_registry import resolve_model_name
+from app.services.summary_service import (
+    needs_summary,
+    record_prompt_savings,
+    update_conversation_summary,
+)
+
+router = APIRouter()
+
+
+class ChatSession:
+    """一个 WebSocket 连接上的状态：已认证的用户、会话上下文缓存和进行中的生成"""
+
+    def __init__(self, websocket: WebSocket, db: AsyncDatabase, user: dict):
+        self.websocket = websocket
+        self.db = db
+        self.user_id = user["id"]
+        # 会话ID -> 会话状态（最近的上下文消息、消息总数、摘要），按最近使用排序
+        self.conversations: "OrderedDict[str, dict]" = OrderedDict()
+        # 同一会话的请求按顺序处理，不同会话之间并发；会话ID -> [锁, 持有及等待的请求数]
+        self.locks: Dict[str, List] = {}
+        # 请求ID -> (任务, 取消标记)
+        self.inflight: Dict[str, Tuple[asyncio.Task, threading.Event]] = {}
+        self.background = set()
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, data: dict):
+        """发送消息（多个任务共用一个连接，串行发送；连接已断开时忽略）"""
+        async with self._send_lock:
+            try:
+                await self.websocket.send_json(data)
+            except Exception:
+                pass
+
+    async def error(self, request_id: Optional[str], detail: str):
+        await self.send({"type": "error", "request_id": request_id, "detail": detail})
+
+    def _cache(self, conversation_id: str, state: dict):
+        self.conversations[conversation_id] = state
+        self.conversations.move_to_end(conversation_id)
+        while len(self.conversations) > settings.WS_MAX_CONVERSATIONS:
+            self.conversations.popitem(last=False)
+
+    @asynccontextmanager
+    async def _conversation_lock(self, conversation_id: str) -> AsyncIterator[None]:
+        """同一会话的请求串行执行，没有请求使用时移除锁"""
+        entry = self.locks.setdefault(conversation_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.locks[conversation_id]
+
+    async def _load_state(self, conversation_id: str) -> Optional[dict]:
+        """
+        获取会话状态
+
+        缓存命中时只读取版本字段校验：会话已删除则丢弃缓存，
+        消息数量与缓存不一致（其他连接或 HTTP 接口写入了消息）则重新读取上下文
+        """
+        state = self.conversations.get(conversation_id)
+        if state is not None:
+            version = await get_conversation_version(self.db, conversation_id, self.user_id)
+            if version is not None and version[1] == state["message_count"]:
+                self.conversations.move_to_end(conversation_id)
+                metrics.inc("ws_context_cache_hits_total")
+                return state
+            self.conversations.pop(conversation_id, None)
+            metrics.inc("ws_context_cache_stale_total")
+            if version is None:
+                return None
+        conversation = await get_conversation_by_id(
+            self.db, conversation_id, self.user_id, context_projection()
+        )
+        if conversation is None:
+            return None
+        state = {
+            **conversation,
+            "messages": [
+                {"role": msg["role"], "content": msg["content"]}
+                for msg in conversation["messages"]
+            ],
+        }
+        self._cache(conversation_id, state)
+        return state
+
+    def _append(self, state: dict, role: str, content: str):
+        state["messages"].append({"role": role, "content": content})
+        del state["messages"][:-settings.CONTEXT_MAX_MESSAGES]
+        state["message_count"] += 1
+
+    async def handle_chat(self, request: WsChatRequest, cancel_event: threading.Event):
+        """处理一条聊天消息，失败时向客户端发送错误消息"""
+        try:
+            await self._handle_chat(request, cancel_event)
+        except Exception as e:
+            print(f"WebSocket 聊天处理失败: {e}")
+            metrics.inc("ws_errors_total")
+            await self.error(request.request_id, "消息处理失败，请稍后重试")
+
+    async def _handle_chat(self, request: WsChatRequest, cancel_event: threading.Event):
+        """加载上下文、流式生成并保存"""
+        request_id = request.request_id
+        try:
+            model_name = resolve_model_name(request.model)
+        except ValueError as e:
+            await self.error(request_id, str(e))
+            return
+
+        conversation_id = request.conversation_id
+        if not conversation_id:
+            message = request.message
+            title = message[:20] + "..." if len(message) > 20 else message
+            conversation = await create_conversation(self.db, self.user_id, title)
+            conversation_id = conversation["id"]
+            self._cache(conversation_id, {**conversation, "messages": [], "message_count": 0})
+
+        async with self._conversation_lock(conversation_id):
+            state = await self._load_state(conversation_id)
+            if state is None:
+                await self.error(request_id, "会话不存在或无权访问")
+                return
+            plan = load_shedder.plan()
+            context_messages = get_conversation_context(state, plan.context_messages)
+            if settings.CONTEXT_SUMMARY_ENABLED and state.get("summary"):
+                record_prompt_savings(state)
+
+            if not await add_message_to_conversation(
+                self.db, conversation_id, self.user_id, "user", request.message,
+                await compute_segment_fields("user", request.message, model_name)
+            ):
+                self.conversations.pop(conversation_id, None)
+                await self.error(request_id, "会话不存在或无权访问")
+                return
+            self._append(state, "user", request.message)
+            ai_messages = context_messages + [{"role": "user", "content": request.message}]
+            if settings.RAG_ENABLED:
+                ai_messages = await run_in_threadpool(augment_messages, ai_messages, request.message)
+
+            await self.send({"type": "start", "request_id": request_id, "conversation_id": conversation_id})
+            try:
+                result = await self._stream(request_id, conversation_id, ai_messages, model_name, plan, cancel_event)
+                reply, cancelled = result.text, result.cancelled
+                extra = {"usage": result.usage(model_name)}
+                if not cancelled:
+                    extra.update(await compute_segment_fields("assistant", reply, model_name) or {})
+            except Exception as e:
+                print(f"AI 生成错误: {e}")
+                reply, cancelled = "抱歉，AI 暂时无法响应，请稍后重试。", False
+                extra = {}
+
+            if plan.degraded:
+                extra["degraded"] = plan.level
+            saved = await save_assistant_reply(self.db, conversation_id, self.user_id, reply, cancelled, extra)
+            if saved is not None:
+                reply = saved
+                self._append(state, "assistant", saved)
+            await self.send({
+                "type": "done",
+                "request_id": request_id,
+                "conversation_id": conversation_id,
+                "message": reply,
+                "cancelled": cancelled,
+                "degraded": plan.level,
+            })
+
+            # 摘要在后台更新，更新后需要重新读取上下文，因此丢弃缓存
+            if settings.CONTEXT_SUMMARY_ENABLED and needs_summary(
+                state["message_count"], state.get("summary_until", 0)
+            ):
+                self.conversations.pop(conversation_id, None)
+                task = asyncio.create_task(update_conversation_summary(self.db, conversation_id, model_name))
+                self.background.add(task)
+                task.add_done_callback(self.background.discard)
+
+    async def _stream(
+        self, request_id, conversation_id, ai_messages, model_name, plan: GenerationPlan, cancel_event
+    ):
+        """在线程池中运行流式生成，把文本片段逐个推送给客户端，返回生成结果"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def produce():
+            try:
+                with load_shedder.track(plan) as sample:
+                    stream = stream_ai_reply(
+                        ai_messages, model_name=model_name, should_stop=cancel_event.is_set,
+                        queued_at=sample.started, **plan.generate_kwargs()
+                    )
+                    while True:
+                        try:
+                            chunk = next(stream)
+                        except StopIteration as stop:
+                            sample.tokens = stop.value.completion_tokens
+                            return stop.value
+                        loop.call_soon_threadsafe(queue.put_nowait, chunk)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, None)
+
+        producer = asyncio.ensure_future(run_in_threadpool(produce))
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            await self.send({
+                "type": "delta",
+                "request_id": request_id,
+                "conversation_id": conversation_id,
+                "content": chunk,
+            })
+        return await producer
+
+    def submit(self, request: WsChatRequest):
+        """为聊天消息创建任务，同一连接上的多个请求并发执行"""
+        cancel_event = threading.Event()
+        task = asyncio.create_task(self.handle_chat(request, cancel_event))
+        self.inflight[request.request_id] = (task, cancel_event)
+        task.add_done_callback(lambda _: self.inflight.pop(request.request_id, None))
+
+    def cancel(self, request_id: Optional[str] = None):
+        """取消指定请求，不指定时取消连接上的全部请求"""
+        for rid, (_, cancel_event) in list(self.inflight.items()):
+            if request_id is None or rid == request_id:
+                cancel_event.set()
+
+    async def close(self):
+        """连接断开：取消进行中的生成，并等待已生成的部分按策略保存"""
+        self.cancel()
+        tasks = [task for task, _ in self.inflight.values()]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@router.websocket("/ws/chat")
+async def chat_websocket(
+    websocket: WebSocket,
+    token: str = Query(default=""),
+    db: AsyncDatabase = Depends(get_db)
+):
+    """
+    WebSocket 聊天
+
+    浏览器的 WebSocket 无法设置请求头，token 通过查询参数传递，每个连接只校验一次
+    """
+    user = await authenticate_token(db, token)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason="无效的认证凭证")
+        return
+    await websocket.accept()
+
+    session = ChatSession(websocket, db, user)
+    metrics.inc("ws_connections_total")
+    try:
+        while True:
+            payload = await websocket.receive_json()
+            message_type = payload.get("type") if isinstance(payload, dict) else None
+            if message_type == "cancel":
+                session.cancel(payload.get("request_id"))
+                continue
+            if message_type != "chat":
+                await session.error(None, f"未知的消息类型: {message_type}")
+                continue
+            try:
+                request = WsChatRequest.model_validate(payload)
+            except ValidationError as e:
+                await session.error(payload.get("request_id"), str(e))
+                continue
+            if request.request_id in session.inflight:
+                await session.error(request.request_id, "请求ID重复")
+                continue
+            if len(session.inflight) >= settings.WS_MAX_INFLIGHT:
+                await session.error(request.request_id, "进行中的请求过多，请稍后重试")
+                continue
+            metrics.inc("ws_messages_total")
+            session.submit(request)
+    except WebSocketDisconnect:
+        pass
+    except ValueError:
+        # 客户端发送了无法解析的 JSON
+        await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA)
+    finally:
+        await session.close()
@@ -0,0 +1,262 @@
+"""
+响应压缩中间件（纯 ASGI）
+按 Accept-Encoding 协商 zstd / br / gzip，brotli 与 zstandard 为可选依赖，未安装时只使用 gzip
+
+- 一次性返回的响应：小于 COMPRESSION_MIN_SIZE 的不压缩（登录、注册等小响应）
+- 流式响应（导出等）：逐块压缩并 flush，客户端可以边接收边解压，不会等到流结束
+- 已带 Content-Encoding 的响应（如代理转发的上游响应）和不可压缩的类型（gzip 导出文件等）原样透传
+- CPU 开销由各算法的压缩级别配置限制
+- 压缩后响应体与上游不再逐字节相同，强 ETag 改为弱 ETag（W/），If-None-Match 仍按弱比较命中
+"""
+import zlib
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional
+
+from app.core.metrics import metrics
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - 可选依赖
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - 可选依赖
+    zstandard = None
+
+# 值得压缩的内容类型
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+)
+
+
+class Encoder(ABC):
+    """增量压缩器的统一接口"""
+
+    @abstractmethod
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        """压缩一块数据，flush 为 True 时输出到目前为止可以解压的全部数据"""
+
+    @abstractmethod
+    def finish(self) -> bytes:
+        """结束压缩流"""
+
+
+class GzipEncoder(Encoder):
+    def __init__(self, level: int):
+        # wbits=31 表示输出带 gzip 头的压缩流
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zlib.Z_SYNC_FLUSH) if flush else out
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class BrotliEncoder(Encoder):
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._compressor.process(data)
+        return out + self._compressor.flush() if flush else out
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class ZstdEncoder(Encoder):
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes, flush: bool) -> bytes:
+        out = self._compressor.compress(data)
+        return out + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK) if flush else out
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+def available_encoders(gzip_level: int, brotli_quality: int, zstd_level: int) -> Dict[str, Callable[[], Encoder]]:
+    """当前环境可用的压缩算法 -> 压缩器工厂"""
+    factories: Dict[str, Callable[[], Encoder]] = {"gzip": lambda: GzipEncoder(gzip_level)}
+    if brotli is not None:
+        factories["br"] = lambda: BrotliEncoder(brotli_quality)
+    if zstandard is not None:
+        factories["zstd"] = lambda: ZstdEncoder(zstd_level)
+    return factories
+
+
+def negotiate(accept_encoding: str, preference: List[str]) -> Optional[str]:
+    """
+    按 Accept-Encoding 选择压缩算法：q 值最高者优先，q 值相同时按服务端偏好顺序
+
+    Args:
+        accept_encoding: 请求头原始值，如 "gzip, deflate, br;q=0.9"
+        preference: 服务端支持的算法（按偏好排序）
+
+    Returns:
+        选中的算法，客户端不接受任何一种时返回 None
+    """
+    weights: Dict[str, float] = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name.strip()] = q
+
+    best, best_q = None, 0.0
+    for name in preference:
+        q = weights.get(name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def _header(headers: list, name: bytes) -> Optional[bytes]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _weaken_etag(headers: list) -> list:
+    """把强 ETag 改为弱 ETag：不同编码的响应体不同，不能再声明逐字节相同"""
+    return [
+        (k, b"W/" + v if k.lower() == b"etag" and not v.startswith(b"W/") else v)
+        for k, v in headers
+    ]
+
+
+class CompressionMiddleware:
+    """按需压缩 HTTP 响应体，见模块说明"""
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 1024,
+        algorithms: Optional[List[str]] = None,
+        gzip_level: int = 5,
+        brotli_quality: int = 4,
+        zstd_level: int = 3,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.factories = available_encoders(gzip_level, brotli_quality, zstd_level)
+        self.preference = [name for name in (algorithms or ["zstd", "br", "gzip"]) if name in self.factories]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_headers = dict(scope["headers"])
+        encoding = negotiate(request_headers.get(b"accept-encoding", b"").decode("latin-1"), self.preference)
+        if encoding is None or scope["method"] == "HEAD":
+            await self.app(scope, receive, send)
+            return
+        await _CompressedResponse(self, encoding, send).run(scope, receive)
+
+
+class _CompressedResponse:
+    """单个响应的压缩状态"""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.send = send
+        self.start_message: Optional[dict] = None
+        self.encoder: Optional[Encoder] = None
+        self.passthrough = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    async def run(self, scope, receive):
+        await self.middleware.app(scope, receive, self.wrapped_send)
+
+    def _eligible(self, headers: list, status: int) -> bool:
+        if status < 200 or status in (204, 304):
+            return False
+        if _header(headers, b"content-encoding") is not None:
+            return False
+        content_type = (_header(headers, b"content-type") or b"").decode("latin-1").lower()
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    def _start(self, compressed: bool, length: Optional[int] = None) -> dict:
+        """改写响应头：声明压缩算法、去掉或更新 Content-Length、追加 Vary"""
+        message = self.start_message
+        headers = list(message["headers"])
+        if compressed:
+            headers = [(k, v) for k, v in headers if k.lower() != b"content-length"]
+            headers = _weaken_etag(headers)
+            headers.append((b"content-encoding", self.encoding.encode("latin-1")))
+            if length is not None:
+                headers.append((b"content-length", str(length).encode("latin-1")))
+        vary = _header(headers, b"vary")
+        if vary is None:
+            headers.append((b"vary", b"Accept-Encoding"))
+        elif b"accept-encoding" not in vary.lower():
+            headers = [(k, v) for k, v in headers if k.lower() != b"vary"]
+            headers.append((b"vary", vary + b", Accept-Encoding"))
+        return {**message, "headers": headers}
+
+    async def wrapped_send(self, message: dict):
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            self.passthrough = not self._eligible(message["headers"], message["status"])
+            if message["status"] == 304:
+                # 与压缩后的 200 响应携带相同的（弱）校验器
+                message = {**message, "headers": _weaken_etag(list(message["headers"]))}
+            if self.passthrough:
+                await self.send(message)
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.encoder is None:
+            if not more_body:
+                # 一次性返回的响应
+                if len(body) < self.middleware.minimum_size:
+                    await self.send(self._start(False))
+                    await self.send(message)
+                    return
+                encoder = self.middleware.factories[self.encoding]()
+                compressed = encoder.compress(body, False) + encoder.finish()
+                self._record(len(body), len(compressed))
+                await self.send(self._start(True, len(compressed)))
+                await self.send({"type": "http.response.body", "body": compressed})
+                return
+            # 流式响应：总大小未知，逐块压缩
+            self.encoder = self.middleware.factories[self.encoding]()
+            await self.send(self._start(True))
+
+        if more_body:
+            chunk = self.encoder.compress(body, True) if body else b""
+        else:
+            chunk = self.encoder.compress(body, False) + self.encoder.finish()
+        self.bytes_in += len(body)
+        self.bytes_out += len(chunk)
+        if chunk or not more_body:
+            await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+        if not more_body:
+            self._record(self.bytes_in, self.bytes_out)
+
+    def _record(self, bytes_in: int, bytes_out: int):
+        metrics.inc("http_compressed_responses_total", encoding=self.encoding)
+        metrics.inc("http_compression_input_bytes_total", bytes_in, encoding=self.encoding)
+        metrics.inc("http_compression_output_bytes_total", bytes_out, encoding=self.encoding)
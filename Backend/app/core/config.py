@@ -36,6 +36,133 @@ class Settings(BaseSettings):
     # CORS 配置
     CORS_ORIGINS: list = ["http://localhost:5173", "http://127.0.0.1:5173"]
     
+    # AI 模型配置
+    MODEL_PATH: str = r"e:\pythonCode\Model\Qwen\Qwen3-0___6B"
+    MODEL_DTYPE: str = "auto"       # 加载精度: auto/float32/float16/bfloat16
+    MODEL_CACHE_DIR: str = ""       # 转换后权重的缓存目录，留空则每次直接解析原始检查点
+    
+    # 多模型注册表：名称 -> 检查点路径（JSON），DEFAULT_MODEL 未配置时对应 MODEL_PATH
+    MODELS: dict = {}
+    DEFAULT_MODEL: str = "qwen3-0.6b"
+    MODEL_MEMORY_BUDGET_MB: int = 0  # 常驻模型的内存预算，超出时按 LRU 卸载；0 表示不限制
+    
+    # LoRA 适配器：名称 -> 适配器目录（JSON），共享 ADAPTER_BASE_MODEL（默认 DEFAULT_MODEL）
+    ADAPTERS: dict = {}
+    ADAPTER_BASE_MODEL: str = ""
+    ADAPTER_MAX_RESIDENT: int = 8       # 同时常驻的适配器数量，超出时按 LRU 卸载
+    ADAPTER_BATCH_WINDOW_MS: int = 20   # 合并批次的等待窗口
+    ADAPTER_MAX_BATCH_SIZE: int = 8     # 单个批次的最大请求数
+    
+    # 认证/聊天记录 API 冷启动（导入 app.main）耗时预算，见 benchmarks/bench_startup.py
+    STARTUP_BUDGET_MS: float = 1500
+    
+    # 推理后端: local（本进程加载模型）/ server（提交到共享的模型服务进程）
+    INFERENCE_BACKEND: str = "local"
+    
+    # CPU 推理线程配置（加载模型的进程生效，见 app/services/inference_runtime.py）
+    # 可用 benchmarks/tune_threads.py 扫描并写入 .env
+    INFERENCE_THREADS: int = 0              # intra-op 线程数，0 表示按 worker 数平均分配核心（单 worker 时沿用 torch 默认值）
+    INFERENCE_INTEROP_THREADS: int = 0      # inter-op 线程数，0 表示沿用 torch 默认值
+    INFERENCE_WORKERS: int = 1              # 同一台机器上加载模型的进程数（uvicorn workers 或模型服务数）
+    INFERENCE_CPU_AFFINITY: str = ""        # 核心绑定: 留空不绑定 / auto 按 worker 序号分段 / 显式列表如 "0-7,16-23"
+    INFERENCE_WORKER_INDEX: int = -1        # auto 绑定使用的 worker 序号，-1 表示自动领取
+    
+    # 模型服务配置（INFERENCE_BACKEND=server 时使用）
+    MODEL_SERVER_HOST: str = "127.0.0.1"
+    MODEL_SERVER_PORT: int = 6100
+    MODEL_SERVER_AUTHKEY: str = "change-me-model-server"  # 默认值只允许监听回环地址
+    MODEL_SERVER_CONCURRENCY: int = 1           # 模型服务同时执行的生成任务数
+    MODEL_SERVER_SHM_THRESHOLD: int = 0         # 小于该字节数的 token id 数组随消息发送，其余走共享内存
+    
+    # 客户端断开时的生成取消配置
+    CANCEL_POLL_INTERVAL: float = 0.5           # 检查客户端是否断开的间隔（秒）
+    # 被取消的回复如何保存: partial（保存已生成部分）/ marker（保存取消提示）/ discard（不保存）
+    CANCELLED_MESSAGE_POLICY: str = "partial"
+    
+    # 请求幂等配置（Idempotency-Key 请求头）
+    IDEMPOTENCY_TTL_SECONDS: int = 24 * 3600        # 已完成请求的响应保留时间
+    IDEMPOTENCY_PENDING_TTL_SECONDS: int = 120      # 执行中记录超过该时间没有心跳视为执行者已崩溃，可被接管
+    IDEMPOTENCY_POLL_INTERVAL: float = 0.5          # 等待其他 worker 执行结果的轮询间隔（秒）
+    
+    # 会话亲和路由配置（python -m app.router_main / uvicorn app.router_main:app）
+    ROUTER_NODES: list = []                 # 节点地址列表（JSON），如 ["http://127.0.0.1:8001"]
+    ROUTER_VIRTUAL_NODES: int = 160         # 每个节点在哈希环上的虚拟节点数
+    ROUTER_HEALTH_INTERVAL: float = 5       # 健康检查间隔（秒）
+    ROUTER_HEALTH_TIMEOUT: float = 2
+    ROUTER_UNHEALTHY_AFTER: int = 2         # 连续失败多少次后视为不可用
+    ROUTER_CONNECT_TIMEOUT: float = 2
+    ROUTER_PROXY_TIMEOUT: float = 600       # 转发请求的读取超时（生成可能较慢）
+    ROUTER_ADMIN_TOKEN: str = ""            # 节点加入/离开接口的管理令牌，留空则禁用
+    
+    # WebSocket 聊天配置
+    WS_MAX_INFLIGHT: int = 4            # 单个连接同时进行的生成数
+    WS_MAX_CONVERSATIONS: int = 20      # 单个连接缓存上下文的会话数
+    
+    # prompt 片段缓存：拼接已分词的消息片段，只为新消息分词
+    PROMPT_CACHE_ENABLED: bool = True
+    PROMPT_CACHE_MAX_ENTRIES: int = 20000   # 进程内缓存的消息片段数
+    PROMPT_CACHE_VERIFY_FIRST: int = 20     # 启动后前 N 次编码总是与完整编码对比
+    PROMPT_CACHE_VERIFY_RATE: float = 0.01  # 之后的抽样校验比例
+    PROMPT_CACHE_PERSIST: bool = False      # 把片段与消息一起保存到数据库
+    
+    # 对话上下文配置
+    CONTEXT_MAX_MESSAGES: int = 10          # 发送给模型的最近消息数量
+    CONTEXT_SUMMARY_ENABLED: bool = False   # 记忆模式：为滑出窗口的消息维护滚动摘要
+    SUMMARY_MAX_NEW_TOKENS: int = 512       # 生成摘要的最大 token 数
+    
+    # 自适应降级配置（见 app/services/load_shedding.py），各等级阈值依次对应 1~3 级
+    # 默认关闭：阈值与硬件和模型强相关，需按模块说明中的方法在部署机器上测出基线后再启用
+    LOAD_SHED_ENABLED: bool = False
+    LOAD_SHED_QUEUE_TIERS: list = [4, 8, 16]            # 本进程进行中的生成数
+    LOAD_SHED_LATENCY_TIERS_MS: list = [200, 400, 800]  # 每 token 耗时的滑动平均（毫秒）
+    LOAD_SHED_EWMA_ALPHA: float = 0.2
+    LOAD_SHED_RECOVERY_RATIO: float = 0.7               # 指标低于阈值的该比例才开始恢复
+    LOAD_SHED_RECOVERY_SECONDS: float = 30              # 持续多久后恢复一级
+    LOAD_SHED_MAX_NEW_TOKENS: int = 2048                # 2 级起的最大生成 token 数
+    LOAD_SHED_CONTEXT_MESSAGES: int = 4                 # 3 级的上下文消息数
+    
+    # 本地资料检索（RAG）配置
+    RAG_ENABLED: bool = False
+    RAG_INDEX_DIR: str = "data/rag_index"
+    RAG_INDEX_DTYPE: str = "float32"            # 索引中向量的存储精度（float32/float16，float16 体积减半但查询慢数倍，见 benchmarks/RESULTS.md）
+    RAG_EMBEDDING_MODEL: str = ""               # CPU 嵌入模型路径（如 bge-small-zh-v1.5）
+    RAG_EMBEDDING_POOLING: str = "cls"          # cls / mean
+    RAG_EMBEDDING_MAX_LENGTH: int = 512
+    RAG_EMBED_BATCH_SIZE: int = 32
+    RAG_QUERY_INSTRUCTION: str = ""             # 查询前缀（bge 中文模型建议的检索指令）
+    RAG_CHUNK_SIZE: int = 500                   # 文本块最大字符数
+    RAG_CHUNK_OVERLAP: int = 50
+    RAG_TOP_K: int = 4
+    RAG_MIN_SCORE: float = 0.3                  # 低于该相似度的片段不注入
+    RAG_MAX_CONTEXT_CHARS: int = 2000           # 注入 prompt 的参考资料总字符数上限
+    
+    # 会话详情使用快速序列化路径（跳过逐条消息的 Pydantic 校验）
+    FAST_JSON_RESPONSES: bool = True
+    
+    # 响应压缩配置（br 需要 brotli，zstd 需要 zstandard，未安装时跳过）
+    COMPRESSION_ENABLED: bool = True
+    COMPRESSION_MIN_SIZE: int = 1024                        # 小于该字节数的响应不压缩
+    COMPRESSION_ALGORITHMS: list = ["zstd", "br", "gzip"]   # 按偏好排序
+    COMPRESSION_GZIP_LEVEL: int = 5                         # 1-9
+    COMPRESSION_BROTLI_QUALITY: int = 4                     # 0-11，高于 5 时 CPU 开销明显增加
+    COMPRESSION_ZSTD_LEVEL: int = 3                         # 1-22
+    
+    # 会话冷存储配置
+    ARCHIVE_ENABLED: bool = False           # 是否在应用内运行后台归档任务
+    ARCHIVE_AFTER_DAYS: int = 30            # 超过多少天未更新的会话被归档
+    ARCHIVE_INTERVAL_SECONDS: int = 3600    # 后台归档任务的运行间隔
+    ARCHIVE_BATCH_SIZE: int = 100           # 每轮最多归档的会话数量
+    ARCHIVE_COMPRESSION_LEVEL: int = 6      # zlib 压缩级别 (1-9)
+    
+    # 用量统计配置（python -m app.services.usage_service）
+    USAGE_ROLLUP_ENABLED: bool = True           # 是否在应用内运行后台用量汇总任务
+    USAGE_ROLLUP_INTERVAL_SECONDS: int = 300    # 后台用量汇总任务的运行间隔
+    USAGE_ROLLUP_LAG_SECONDS: int = 60          # 增量汇总只处理该时间之前写入的消息
+    
+    # 聊天记录导出配置
+    EXPORT_BATCH_SIZE: int = 50  # 每批从 MongoDB 拉取的会话数量
+    EXPORT_GZIP_LEVEL: int = 6   # gzip 压缩级别 (1-9)
+    
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
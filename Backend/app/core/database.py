@@ -7,6 +7,7 @@ from pymongo.asynchronous.database import AsyncDatabase
 from typing import Optional
 
 from app.core.config import settings
+from app.core.migrations import warn_pending_migrations
 
 # 全局数据库客户端和数据库实例
 client: Optional[AsyncMongoClient] = None
@@ -23,9 +24,8 @@ async def connect_db():
     client = AsyncMongoClient(settings.MONGO_URL)
     db = client[settings.MONGO_DB]
     
-    # 创建索引（确保唯一性约束）
-    await db.users.create_index("username", unique=True)
-    await db.users.create_index("email", unique=True, sparse=True)  # sparse 允许 null 值
+    # 索引由部署时的迁移创建（python -m app.core.migrations apply），这里只检查版本
+    await warn_pending_migrations(db)
     
     print(f"✅ MongoDB 连接成功，数据库: {settings.MONGO_DB}")
 
@@ -2,6 +2,7 @@
 依赖注入函数
 用于 FastAPI 的 Depends
 """
+from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pymongo.asynchronous.database import AsyncDatabase
@@ -63,3 +64,20 @@ async def get_current_user(
         )
     
     return user
+
+
+async def authenticate_token(db: AsyncDatabase, token: str) -> Optional[dict]:
+    """
+    校验 token 并返回对应用户（用于 WebSocket 等无法使用 HTTPBearer 的场景）
+    
+    Args:
+        db: MongoDB 数据库实例
+        token: JWT token
+    
+    Returns:
+        用户字典，token 无效或用户不存在时返回 None
+    """
+    payload = decode_access_token(token) if token else None
+    if payload is None or payload.get("sub") is None:
+        return None
+    return await get_user_by_id(db, payload["sub"])
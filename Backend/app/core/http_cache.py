@@ -0,0 +1,60 @@
+"""
+HTTP 条件请求（ETag / If-None-Match）工具
+客户端轮询未变化的资源时直接返回 304，不再查询完整数据和序列化响应
+"""
+import hashlib
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi.responses import Response
+
+# 响应只属于当前用户；允许浏览器缓存，但每次使用前都要带 If-None-Match 重新验证
+CACHE_HEADERS = {
+    "Cache-Control": "private, no-cache",
+    "Vary": "Authorization",
+}
+
+
+def make_etag(*parts) -> str:
+    """由若干版本字段生成强校验器（带引号的摘要）"""
+    raw = ":".join(str(part) for part in parts)
+    return '"' + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:24] + '"'
+
+
+def timestamp_ms(value: Optional[datetime]) -> int:
+    """数据库中的 UTC 时间（精确到毫秒）转换为整数，用作版本字段"""
+    if value is None:
+        return 0
+    return int(value.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    判断 If-None-Match 是否命中（RFC 9110：If-None-Match 使用弱比较）
+
+    Args:
+        if_none_match: 请求头原始值，可包含多个以逗号分隔的校验器或 *
+        etag: 资源当前的 ETag
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified(etag: str) -> Response:
+    """304 响应（不带响应体）"""
+    return Response(status_code=304, headers={"ETag": etag, **CACHE_HEADERS})
+
+
+def set_etag(response: Response, etag: str):
+    """为正常响应附加 ETag 与缓存头"""
+    response.headers["ETag"] = etag
+    response.headers.update(CACHE_HEADERS)
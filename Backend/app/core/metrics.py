@@ -0,0 +1,71 @@
+"""
+进程内运行指标
+提供计数器、仪表值和耗时统计，并以 Prometheus 文本格式导出
+"""
+import threading
+from collections import defaultdict
+from typing import Dict, Tuple
+
+# 指标键：(名称, 排序后的标签元组)
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class Metrics:
+    """线程安全的简易指标注册表"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[MetricKey, float] = defaultdict(float)
+        self._gauges: Dict[MetricKey, float] = {}
+        self._summaries: Dict[MetricKey, list] = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> MetricKey:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """计数器累加"""
+        with self._lock:
+            self._counters[self._key(name, labels)] += value
+
+    def set(self, name: str, value: float, **labels):
+        """设置仪表值"""
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        """记录一次观测值（统计次数与总和）"""
+        with self._lock:
+            summary = self._summaries.setdefault(self._key(name, labels), [0, 0.0])
+            summary[0] += 1
+            summary[1] += value
+
+    def get(self, name: str, **labels) -> float:
+        """读取计数器或仪表的当前值"""
+        key = self._key(name, labels)
+        with self._lock:
+            if key in self._gauges:
+                return self._gauges[key]
+            return self._counters.get(key, 0)
+
+    def render(self) -> str:
+        """导出为 Prometheus 文本格式"""
+        def fmt(key: MetricKey, suffix: str = "") -> str:
+            name, labels = key
+            label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+            return f"{name}{suffix}{{{label_str}}}" if label_str else f"{name}{suffix}"
+
+        lines = []
+        with self._lock:
+            for key, value in sorted(self._counters.items()):
+                lines.append(f"{fmt(key)} {value}")
+            for key, value in sorted(self._gauges.items()):
+                lines.append(f"{fmt(key)} {value}")
+            for key, (count, total) in sorted(self._summaries.items()):
+                lines.append(f"{fmt(key, '_count')} {count}")
+                lines.append(f"{fmt(key, '_sum')} {total}")
+        return "\n".join(lines) + "\n"
+
+
+# 创建全局指标实例
+metrics = Metrics()
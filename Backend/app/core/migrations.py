@@ -0,0 +1,336 @@
+"""
+MongoDB 索引与数据迁移管理
+按版本顺序声明每个集合需要的索引（以及必要的数据变更），在部署时执行一次，
+而不是每个 worker 启动时都重复创建
+
+- apply: 执行尚未执行的迁移（create_index 本身是幂等的，重复执行是安全的）
+- status: 列出迁移的执行情况，并检查声明的索引是否都存在
+- check-plans: 对各个服务中的查询执行 explain()，出现全集合扫描（COLLSCAN）或集合不存在（无法验证）时
+  以非零状态退出，可以在 CI 中对执行过 apply 的测试库运行
+
+运行方式（在 Backend 目录下）:
+    python -m app.core.migrations apply
+    python -m app.core.migrations status
+    python -m app.core.migrations check-plans
+"""
+import argparse
+import asyncio
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, AsyncMongoClient, IndexModel
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.errors import OperationFailure
+
+from app.core.config import settings
+
+# 记录已执行迁移的集合
+MIGRATIONS_COLLECTION = "schema_migrations"
+
+
+@dataclass
+class Migration:
+    """一次迁移：需要创建的索引（集合名 -> 索引列表）、需要删除的旧索引（集合名 -> 索引名列表），以及可选的数据变更"""
+    version: int
+    description: str
+    indexes: Dict[str, List[IndexModel]] = field(default_factory=dict)
+    up: Optional[Callable[[AsyncDatabase], Awaitable[None]]] = None
+    drop_indexes: Dict[str, List[str]] = field(default_factory=dict)
+
+
+async def _idempotency_purge_at(db: AsyncDatabase):
+    """已完成的幂等记录沿用原来的过期时间；执行中的记录按创建时间补上清理时间"""
+    await db.idempotency_keys.update_many(
+        {"purge_at": {"$exists": False}, "status": "completed"},
+        [{"$set": {"purge_at": "$expires_at"}}]
+    )
+    await db.idempotency_keys.update_many(
+        {"purge_at": {"$exists": False}},
+        [{"$set": {"purge_at": {"$add": ["$created_at", settings.IDEMPOTENCY_TTL_SECONDS * 1000]}}}]
+    )
+
+
+# 按版本号递增追加，已发布的迁移不要修改
+MIGRATIONS: List[Migration] = [
+    Migration(
+        1,
+        "users 唯一索引",
+        {
+            "users": [
+                IndexModel([("username", ASCENDING)], name="username_1", unique=True),
+                # sparse 允许 null 值
+                IndexModel([("email", ASCENDING)], name="email_1", unique=True, sparse=True),
+            ],
+        },
+    ),
+    Migration(
+        2,
+        "conversations 列表与归档索引",
+        {
+            "conversations": [
+                # 会话列表 / 计数 / 导出：按用户过滤，按更新时间倒序
+                IndexModel([("user_id", ASCENDING), ("updated_at", DESCENDING)], name="user_id_1_updated_at_-1"),
+                # 后台归档：查找长时间未更新的会话
+                IndexModel([("updated_at", ASCENDING)], name="updated_at_1"),
+            ],
+            "conversation_archives": [
+                # 删除用户全部会话时清理冷存储
+                IndexModel([("user_id", ASCENDING)], name="user_id_1"),
+            ],
+        },
+    ),
+    Migration(
+        3,
+        "idempotency_keys 过期索引",
+        {
+            "idempotency_keys": [
+                # 幂等记录到期后自动删除
+                IndexModel([("expires_at", ASCENDING)], name="expires_at_1", expireAfterSeconds=0),
+            ],
+        },
+    ),
+    Migration(
+        4,
+        "usage_daily 用量报表索引",
+        {
+            "usage_daily": [
+                # 单个用户的用量查询
+                IndexModel([("user_id", ASCENDING), ("day", ASCENDING)], name="user_id_1_day_1"),
+                # 全部用户按日期范围的容量报表
+                IndexModel([("day", ASCENDING)], name="day_1"),
+            ],
+        },
+    ),
+    Migration(
+        5,
+        "idempotency_keys 改为按 purge_at 清理",
+        {
+            "idempotency_keys": [
+                # 执行中的记录由心跳不断推迟清理时间，长时间的生成不会被提前删除
+                IndexModel([("purge_at", ASCENDING)], name="purge_at_1", expireAfterSeconds=0),
+            ],
+        },
+        up=_idempotency_purge_at,
+        drop_indexes={"idempotency_keys": ["expires_at_1"]},
+    ),
+]
+
+LATEST_VERSION = max(migration.version for migration in MIGRATIONS)
+
+
+async def applied_versions(db: AsyncDatabase) -> Dict[int, dict]:
+    """已执行的迁移：版本号 -> 执行记录"""
+    return {doc["_id"]: doc async for doc in db[MIGRATIONS_COLLECTION].find()}
+
+
+async def apply_migrations(db: AsyncDatabase) -> List[int]:
+    """
+    按版本顺序执行尚未执行的迁移
+
+    Returns:
+        本次执行的版本号列表
+    """
+    done = await applied_versions(db)
+    executed = []
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        if migration.version in done:
+            continue
+        print(f"⏳ 迁移 {migration.version}: {migration.description}")
+        if migration.up is not None:
+            await migration.up(db)
+        for collection, indexes in migration.indexes.items():
+            await db[collection].create_indexes(indexes)
+        for collection, names in migration.drop_indexes.items():
+            for name in names:
+                try:
+                    await db[collection].drop_index(name)
+                except OperationFailure:
+                    # 索引或集合不存在
+                    pass
+        await db[MIGRATIONS_COLLECTION].insert_one({
+            "_id": migration.version,
+            "description": migration.description,
+            "applied_at": datetime.utcnow(),
+        })
+        executed.append(migration.version)
+    return executed
+
+
+async def missing_indexes(db: AsyncDatabase) -> List[str]:
+    """声明了（且没有被之后的迁移删除）但数据库中不存在的索引（集合.索引名）"""
+    missing = []
+    declared: Dict[str, List[str]] = {}
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        for collection, indexes in migration.indexes.items():
+            declared.setdefault(collection, []).extend(index.document["name"] for index in indexes)
+        for collection, names in migration.drop_indexes.items():
+            declared[collection] = [name for name in declared.get(collection, []) if name not in names]
+    for collection, names in declared.items():
+        existing = set((await db[collection].index_information()).keys())
+        missing.extend(f"{collection}.{name}" for name in names if name not in existing)
+    return missing
+
+
+async def warn_pending_migrations(db: AsyncDatabase):
+    """启动时检查（只读一次迁移记录），有未执行的迁移时打印提示，不在启动路径上建索引"""
+    try:
+        latest = await db[MIGRATIONS_COLLECTION].find_one(sort=[("_id", DESCENDING)])
+    except Exception as e:
+        print(f"⚠️ 无法读取迁移记录: {e}")
+        return
+    current = latest["_id"] if latest else 0
+    if current < LATEST_VERSION:
+        print(
+            f"⚠️ 数据库迁移版本 {current} 落后于 {LATEST_VERSION}，"
+            "请先运行 python -m app.core.migrations apply"
+        )
+
+
+# ========== 查询计划检查 ==========
+
+# 各服务中的查询（explain 命令体），使用占位值，只关心执行计划
+_SAMPLE_USER_ID = "000000000000000000000000"
+_SAMPLE_ID = ObjectId(_SAMPLE_USER_ID)
+
+QUERY_PLANS: Dict[str, dict] = {
+    "user_service: 按用户名查询": {"find": "users", "filter": {"username": "sample"}},
+    "user_service: 按邮箱查询": {"find": "users", "filter": {"email": "sample@example.com"}},
+    "chat_service: 会话详情": {
+        "find": "conversations", "filter": {"_id": _SAMPLE_ID, "user_id": _SAMPLE_USER_ID},
+    },
+    "chat_service: 会话列表": {
+        "find": "conversations", "filter": {"user_id": _SAMPLE_USER_ID},
+        "sort": {"updated_at": -1}, "limit": 20,
+    },
+    "chat_service: 会话计数": {"count": "conversations", "query": {"user_id": _SAMPLE_USER_ID}},
+    "chat_service: 会话最近更新时间": {
+        "find": "conversations", "filter": {"user_id": _SAMPLE_USER_ID},
+        "projection": {"_id": 0, "updated_at": 1}, "sort": {"updated_at": -1}, "limit": 1,
+    },
+    "chat_service: 批量操作归属校验": {
+        "find": "conversations", "filter": {"_id": {"$in": [_SAMPLE_ID]}, "user_id": _SAMPLE_USER_ID},
+    },
+    "chat_service: 删除全部会话": {
+        "delete": "conversations", "deletes": [{"q": {"user_id": _SAMPLE_USER_ID}, "limit": 0}],
+    },
+    "chat_service: 清理全部归档": {
+        "delete": "conversation_archives", "deletes": [{"q": {"user_id": _SAMPLE_USER_ID}, "limit": 0}],
+    },
+    "export_service: 导出全部会话": {
+        "find": "conversations", "filter": {"user_id": _SAMPLE_USER_ID}, "sort": {"updated_at": -1},
+    },
+    "archive_service: 查找不活跃会话": {
+        "find": "conversations",
+        "filter": {
+            "updated_at": {"$lt": datetime(2000, 1, 1)},
+            "archived": {"$ne": True},
+            "restored_at": {"$not": {"$gte": datetime(2000, 1, 1)}},
+        },
+        "limit": 100,
+    },
+    "idempotency_service: 按键查询": {"find": "idempotency_keys", "filter": {"_id": "sample"}},
+    "usage_service: 增量汇总": {
+        "aggregate": "conversations",
+        "pipeline": [{"$match": {"updated_at": {"$gte": datetime(2000, 1, 1)}}}],
+        "cursor": {},
+    },
+    "usage_service: 用户用量": {
+        "find": "usage_daily", "filter": {"user_id": _SAMPLE_USER_ID, "day": {"$gte": "2000-01-01"}},
+        "sort": {"day": 1, "model": 1},
+    },
+    "usage_service: 用量报表": {
+        "aggregate": "usage_daily",
+        "pipeline": [{"$match": {"day": {"$gte": "2000-01-01"}}}],
+        "cursor": {},
+    },
+}
+
+
+def _stages(plan: dict) -> List[str]:
+    """递归收集执行计划中的全部 stage"""
+    stages = [plan["stage"]] if "stage" in plan else []
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages.extend(_stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_stages(child))
+    return stages
+
+
+def _winning_plan(explain: dict) -> dict:
+    """取出 explain 结果中的最优计划（聚合管道的计划在第一个 $cursor 阶段中）"""
+    if "queryPlanner" in explain:
+        return explain["queryPlanner"]["winningPlan"]
+    for stage in explain.get("stages", []):
+        if "$cursor" in stage:
+            return stage["$cursor"]["queryPlanner"]["winningPlan"]
+    return {}
+
+
+async def check_query_plans(db: AsyncDatabase) -> List[str]:
+    """
+    对 QUERY_PLANS 中的每个查询执行 explain
+
+    集合不存在时 explain 只返回 EOF，无法判断是否会使用索引，同样视为失败
+    （apply 创建索引时会一并创建集合，应先执行 apply）
+
+    Returns:
+        出现 COLLSCAN 或未能验证的查询名称列表
+    """
+    failures = []
+    for name, command in QUERY_PLANS.items():
+        result = await db.command("explain", command, verbosity="queryPlanner")
+        stages = _stages(_winning_plan(result))
+        if "COLLSCAN" in stages:
+            failures.append(name)
+            verdict = "❌ COLLSCAN"
+        elif not stages or stages == ["EOF"]:
+            failures.append(name)
+            verdict = "❌ 集合不存在（未验证，请先执行 apply）"
+        else:
+            verdict = "✅"
+        print(f"{verdict} {name}: {' <- '.join(stages)}")
+    return failures
+
+
+async def run_command(command: str) -> int:
+    """执行 apply / status / check-plans，返回进程退出码"""
+    client = AsyncMongoClient(settings.MONGO_URL)
+    db = client[settings.MONGO_DB]
+    try:
+        if command == "apply":
+            executed = await apply_migrations(db)
+            print(f"✅ 已执行 {len(executed)} 个迁移，当前版本 {LATEST_VERSION}")
+            return 0
+        if command == "status":
+            done = await applied_versions(db)
+            for migration in MIGRATIONS:
+                record = done.get(migration.version)
+                state = f"已执行 {record['applied_at']:%Y-%m-%d %H:%M:%S}" if record else "未执行"
+                print(f"{migration.version:>4}  {state:<24} {migration.description}")
+            missing = await missing_indexes(db)
+            if missing:
+                print(f"⚠️ 缺少索引: {', '.join(missing)}")
+                return 1
+            return 0
+        failures = await check_query_plans(db)
+        if failures:
+            print(f"❌ {len(failures)} 个查询使用了全集合扫描或未能验证")
+            return 1
+        return 0
+    finally:
+        await client.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="MongoDB 索引与迁移管理")
+    parser.add_argument("command", choices=["apply", "status", "check-plans"])
+    args = parser.parse_args()
+    return asyncio.run(run_command(args.command))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
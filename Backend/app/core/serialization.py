@@ -0,0 +1,46 @@
+"""
+快速 JSON 序列化工具
+优先使用 orjson（可选依赖），未安装时回退到标准库 json
+"""
+import json
+from datetime import datetime
+from typing import Any
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 可选依赖
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    """标准库 json 无法处理的类型（与 Pydantic 的输出格式保持一致）"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(data: Any) -> bytes:
+    """
+    将对象编码为 JSON 字节串
+
+    Args:
+        data: 待编码对象（dict/list，支持 datetime）
+
+    Returns:
+        UTF-8 编码的 JSON 字节串
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=str)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    """跳过 jsonable_encoder 和 response_model 校验，直接编码的 JSON 响应"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
@@ -0,0 +1,106 @@
+"""
+启动耗时分析工具
+在全新的子进程中导入目标模块，统计导入耗时并列出最慢的模块，
+同时检查重量级的推理依赖是否被提前导入
+
+运行方式（在 Backend 目录下）:
+    python -m app.core.startup_profile
+    python -m app.core.startup_profile --module app.main --top 30
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# 只在真正推理时才允许导入的模块
+HEAVY_MODULES = ("torch", "transformers", "modelscope", "numpy", "safetensors", "peft")
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _run_python(code: str, *flags: str) -> subprocess.CompletedProcess:
+    """在 Backend 目录下启动一个全新的解释器执行代码"""
+    return subprocess.run(
+        [sys.executable, *flags, "-c", code],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def profile_imports(module: str = "app.main") -> List[Tuple[str, int, int]]:
+    """
+    使用 -X importtime 分析导入耗时
+
+    Args:
+        module: 要导入的模块
+
+    Returns:
+        [(模块名, 自身耗时 us, 累计耗时 us)]，按累计耗时降序
+    """
+    result = _run_python(f"import {module}", "-X", "importtime")
+    records = []
+    for line in result.stderr.splitlines():
+        # 格式: import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        records.append((name.strip(), int(self_us), int(cumulative_us)))
+    records.sort(key=lambda record: record[2], reverse=True)
+    return records
+
+
+def measure_startup(module: str = "app.main") -> Dict[str, object]:
+    """
+    测量一次冷启动导入耗时和内存，并检查已导入的重量级模块
+
+    Args:
+        module: 要导入的模块
+
+    Returns:
+        {"import_ms": 导入耗时, "max_rss_mb": 峰值内存, "heavy_modules": 被导入的重量级模块}
+    """
+    code = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "elapsed = (time.perf_counter() - start) * 1000\n"
+        "try:\n"
+        "    import resource\n"
+        "    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+        "    rss = rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024\n"
+        "except ImportError:\n"
+        "    rss = 0\n"
+        f"heavy = [m for m in {HEAVY_MODULES!r} if m in sys.modules]\n"
+        "print(elapsed, rss, ','.join(heavy))\n"
+    )
+    import_ms, rss_mb, *heavy = _run_python(code).stdout.split()
+    return {
+        "import_ms": float(import_ms),
+        "max_rss_mb": float(rss_mb),
+        "heavy_modules": heavy[0].split(",") if heavy else [],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="应用启动耗时分析")
+    parser.add_argument("--module", default="app.main", help="要分析的模块")
+    parser.add_argument("--top", type=int, default=20, help="显示最慢的前 N 个模块")
+    args = parser.parse_args()
+
+    records = profile_imports(args.module)
+    print(f"{'累计(ms)':>10} {'自身(ms)':>10}  模块")
+    for name, self_us, cumulative_us in records[:args.top]:
+        print(f"{cumulative_us / 1000:10.1f} {self_us / 1000:10.1f}  {name}")
+
+    startup = measure_startup(args.module)
+    print()
+    print(f"导入 {args.module}: {startup['import_ms']:.1f} ms，峰值内存 {startup['max_rss_mb']:.1f} MB")
+    if startup["heavy_modules"]:
+        print(f"⚠️ 启动时导入了重量级模块: {', '.join(startup['heavy_modules'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,19 @@
 """
 FastAPI 应用主入口
 """
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.core.compression import CompressionMiddleware
 from app.core.config import settings
-from app.core.database import connect_db, close_db
-from app.api import login, register, chat
+from app.core.database import connect_db, close_db, get_db
+from app.core.metrics import metrics
+from app.services.archive_service import run_archive_loop
+from app.services.usage_service import run_usage_rollup_loop
+from app.api import login, register, chat, ws_chat, usage
 
 # 下面的生命周期函数在app = FastAPI(...)中使用，当执行到注册fastapi时会调用，并且执行到
 # yield时会暂停，然后回到fastapi的正常运行，当fastapi关闭时会继续执行yield后面的代码
@@ -19,7 +25,16 @@ async def lifespan(app: FastAPI):
     # 启动时连接数据库
     print("🚀 正在启动应用...")
     await connect_db()
+    # 启动后台归档任务（可选）
+    archive_task = asyncio.create_task(run_archive_loop(get_db())) if settings.ARCHIVE_ENABLED else None
+    # 启动后台用量汇总任务（可选，也可以只用命令行定期汇总）
+    rollup_task = asyncio.create_task(run_usage_rollup_loop(get_db())) if settings.USAGE_ROLLUP_ENABLED else None
     yield
+    for task in (archive_task, rollup_task):
+        if task:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
     # 关闭时断开连接
     await close_db()
     print("👋 应用已关闭")
@@ -42,13 +57,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],      # 允许所有 HTTP 方法
     allow_headers=["*"],      # 允许所有请求头
+    expose_headers=["ETag"],  # 前端可以读取 ETag 自行发起条件请求
 )
 
+# 响应压缩（在 CORS 之内，只处理 HTTP 响应，不影响 WebSocket）
+if settings.COMPRESSION_ENABLED:
+    app.add_middleware(
+        CompressionMiddleware,
+        minimum_size=settings.COMPRESSION_MIN_SIZE,
+        algorithms=settings.COMPRESSION_ALGORITHMS,
+        gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+        brotli_quality=settings.COMPRESSION_BROTLI_QUALITY,
+        zstd_level=settings.COMPRESSION_ZSTD_LEVEL,
+    )
+
 # 注册路由
 # 前缀 /aifs 与前端 API 调用路径对应
 app.include_router(login.router, prefix=settings.API_PREFIX, tags=["认证"])
 app.include_router(register.router, prefix=settings.API_PREFIX, tags=["注册"])
 app.include_router(chat.router, prefix=settings.API_PREFIX, tags=["聊天"])
+app.include_router(ws_chat.router, prefix=settings.API_PREFIX, tags=["聊天"])
+app.include_router(usage.router, prefix=settings.API_PREFIX, tags=["用量"])
 
 
 @app.get("/", tags=["根路径"])
@@ -62,6 +91,12 @@ async def root():
     }
 
 
+@app.get("/metrics", tags=["根路径"], response_class=PlainTextResponse)
+async def get_metrics():
+    """运行指标（Prometheus 文本格式）"""
+    return metrics.render()
+
+
 # 用于直接运行: python -m app.main
 if __name__ == "__main__":
     import uvicorn
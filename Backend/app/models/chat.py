@@ -14,6 +14,7 @@ class MessageInDB(BaseModel):
     role: Literal["user", "assistant", "system"]
     content: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    status: Optional[str] = None  # cancelled 表示生成被取消
 
 
 class ConversationInDB(BaseModel):
@@ -25,6 +26,10 @@ class ConversationInDB(BaseModel):
     user_id: str = Field(..., description="用户ID")
     title: str = Field(default="新对话", max_length=100, description="会话标题")
     messages: List[MessageInDB] = Field(default=[], description="消息列表")
+    summary: str = Field(default="", description="滑出上下文窗口的历史消息摘要")
+    summary_until: int = Field(default=0, description="摘要已覆盖的消息数量（从头计）")
+    summary_source_tokens: int = Field(default=0, description="被摘要消息的 token 数")
+    summary_tokens: int = Field(default=0, description="摘要本身的 token 数")
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -48,6 +53,47 @@ def conversation_helper(conversation: dict) -> dict:
         "user_id": conversation["user_id"],
         "title": conversation.get("title", "新对话"),
         "messages": conversation.get("messages", []),
+        # 只读取了部分消息（$slice）时由数据库计算的消息总数
+        "message_count": conversation.get("message_count", len(conversation.get("messages", []))),
         "created_at": conversation.get("created_at"),
         "updated_at": conversation.get("updated_at"),
+        # 滚动摘要（记忆模式）
+        "summary": conversation.get("summary", ""),
+        "summary_until": conversation.get("summary_until", 0),
+        "summary_source_tokens": conversation.get("summary_source_tokens", 0),
+        "summary_tokens": conversation.get("summary_tokens", 0),
     }
+
+
+
+def conversation_detail_helper(conversation: dict) -> dict:
+    """
+    将 MongoDB 文档直接转换为会话详情响应结构（快速路径）
+    
+    消息由服务端自己写入，结构已知，因此不再逐条经过 Pydantic 校验，
+    只挑选对外暴露的字段
+    
+    Args:
+        conversation: MongoDB 文档
+    
+    Returns:
+        与 ConversationDetail 结构一致的字典
+    """
+    messages = conversation.get("messages", [])
+    return {
+        "id": str(conversation["_id"]),
+        "title": conversation.get("title", "新对话"),
+        "created_at": conversation.get("created_at"),
+        "updated_at": conversation.get("updated_at"),
+        "message_count": len(messages),
+        "messages": [
+            {
+                "role": msg["role"],
+                "content": msg["content"],
+                "created_at": msg.get("created_at"),
+                "status": msg.get("status"),
+                "degraded": msg.get("degraded"),
+            }
+            for msg in messages
+        ],
+    }
\ No newline at end of file
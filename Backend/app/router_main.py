@@ -0,0 +1,262 @@
+"""
+会话亲和路由入口（可选部署模式）
+作为反向代理运行在多个 API/推理节点（app.main）之前，按会话把请求转发到固定节点
+
+路由键:
+- /aifs/conversations/{id}...: 路径中的会话ID
+- /aifs/chat: 请求体中的 conversation_id；新会话没有ID时使用 Idempotency-Key，保证重试落在同一节点
+- /aifs/ws/chat（WebSocket）: 查询参数中的 token（一个连接上有多个会话，按用户集中在同一节点）
+- 其他请求: Authorization 头（同一用户的请求集中在同一节点）
+
+只在连接失败（请求未发出）时切换到下一个节点，已发出的请求不会被重复执行；
+WebSocket 同样只在握手连接失败时切换，连接建立后双向转发消息，任一端关闭时关闭另一端
+
+在一台机器上启动 3 个节点和路由（在 Backend 目录下）:
+    python -m app.router_main --spawn 3 --port 8000
+或分别启动节点后:
+    ROUTER_NODES='["http://127.0.0.1:8001", "http://127.0.0.1:8002"]' uvicorn app.router_main:app --port 8000
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import subprocess
+import sys
+from contextlib import asynccontextmanager, suppress
+from typing import Optional
+
+import httpx
+from fastapi import FastAPI, Header, HTTPException, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+from websockets.asyncio.client import connect as ws_connect
+from websockets.exceptions import ConnectionClosed, InvalidHandshake, InvalidStatus
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.routing_service import node_pool
+
+# 不转发的逐跳请求头/响应头
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailers", "transfer-encoding", "upgrade", "host",
+}
+
+CONVERSATION_PATH = re.compile(rf"^{re.escape(settings.API_PREFIX)}/conversations/([0-9a-fA-F]{{24}})")
+
+client: Optional[httpx.AsyncClient] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """创建转发客户端并启动健康检查"""
+    global client
+    client = httpx.AsyncClient(timeout=httpx.Timeout(settings.ROUTER_PROXY_TIMEOUT, connect=settings.ROUTER_CONNECT_TIMEOUT))
+    health_task = asyncio.create_task(node_pool.run_health_loop(client))
+    print(f"🔀 路由已启动，节点: {[node['url'] for node in node_pool.status()]}")
+    yield
+    health_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await health_task
+    await client.aclose()
+
+
+app = FastAPI(title=f"{settings.APP_NAME} Router", docs_url=None, redoc_url=None, lifespan=lifespan)
+
+
+class NodeRequest(BaseModel):
+    """节点加入/离开请求"""
+    url: str = Field(..., description="节点地址，如 http://127.0.0.1:8001")
+
+
+def _check_admin(token: Optional[str]):
+    if not settings.ROUTER_ADMIN_TOKEN or token != settings.ROUTER_ADMIN_TOKEN:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="无权管理路由节点")
+
+
+@app.get("/router/nodes", tags=["路由"])
+async def list_nodes():
+    """节点状态及其在哈希环上的占比"""
+    return {"nodes": node_pool.status()}
+
+
+@app.post("/router/nodes", tags=["路由"])
+async def join_node(body: NodeRequest, x_router_token: Optional[str] = Header(default=None)):
+    """节点加入，只有约 1/N 的会话会迁移到新节点"""
+    _check_admin(x_router_token)
+    node_pool.add(body.url)
+    await node_pool.check_health(client)
+    return {"nodes": node_pool.status()}
+
+
+@app.delete("/router/nodes", tags=["路由"])
+async def leave_node(body: NodeRequest, x_router_token: Optional[str] = Header(default=None)):
+    """节点离开，其会话顺延到环上的下一个节点"""
+    _check_admin(x_router_token)
+    node_pool.remove(body.url)
+    return {"nodes": node_pool.status()}
+
+
+@app.get("/router/metrics", tags=["路由"], response_class=PlainTextResponse)
+async def router_metrics():
+    """路由自身的运行指标（Prometheus 文本格式）"""
+    return metrics.render()
+
+
+def routing_key(request: Request, body: bytes) -> str:
+    """提取路由键，见模块说明"""
+    match = CONVERSATION_PATH.match(request.url.path)
+    if match:
+        return match.group(1)
+    if request.url.path == f"{settings.API_PREFIX}/chat" and body:
+        try:
+            conversation_id = json.loads(body).get("conversation_id")
+        except (ValueError, AttributeError):
+            conversation_id = None
+        if conversation_id:
+            return str(conversation_id)
+        if request.headers.get("idempotency-key"):
+            return request.headers["idempotency-key"]
+    return request.headers.get("authorization", "")
+
+
+@app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "HEAD"])
+async def proxy(path: str, request: Request):
+    """按路由键转发到节点，流式返回响应（支持导出等流式接口）"""
+    body = await request.body()
+    headers = [(k, v) for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS]
+    candidates = node_pool.candidates(routing_key(request, body))
+    if not candidates:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="没有可用的节点")
+
+    for i, node in enumerate(candidates):
+        upstream_request = client.build_request(
+            request.method,
+            f"{node}{request.url.path}",
+            params=request.query_params,
+            headers=headers,
+            content=body,
+        )
+        try:
+            upstream = await client.send(upstream_request, stream=True)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            # 请求没有发出，可以安全地换下一个节点
+            node_pool.mark(node, False)
+            metrics.inc("router_failovers_total", node=node)
+            continue
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"节点请求失败: {e}")
+
+        metrics.inc("router_requests_total", node=node, primary=str(i == 0).lower())
+        response_headers = {
+            k: v for k, v in upstream.headers.items() if k.lower() not in HOP_BY_HOP_HEADERS
+        }
+        response_headers["X-Routed-Node"] = node
+        return StreamingResponse(
+            upstream.aiter_raw(),
+            status_code=upstream.status_code,
+            headers=response_headers,
+            background=BackgroundTask(upstream.aclose),
+        )
+
+    raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="所有节点均不可用")
+
+
+@app.websocket("/{path:path}")
+async def proxy_websocket(websocket: WebSocket, path: str):
+    """按 token 把 WebSocket 连接转发到节点，双向转发消息直到任一端关闭"""
+    key = websocket.query_params.get("token") or websocket.headers.get("authorization", "")
+    headers = [
+        (k, v) for k, v in websocket.headers.items()
+        if k.lower() not in HOP_BY_HOP_HEADERS and not k.lower().startswith("sec-websocket-")
+    ]
+    query = f"?{websocket.url.query}" if websocket.url.query else ""
+
+    for i, node in enumerate(node_pool.candidates(key)):
+        url = "ws" + node[len("http"):] + websocket.url.path + query
+        try:
+            upstream = await ws_connect(
+                url, additional_headers=headers, user_agent_header=None, proxy=None,
+                open_timeout=settings.ROUTER_CONNECT_TIMEOUT, max_size=None,
+            )
+        except (OSError, asyncio.TimeoutError):
+            # 握手没有完成，可以安全地换下一个节点
+            node_pool.mark(node, False)
+            metrics.inc("router_failovers_total", node=node)
+            continue
+        except InvalidStatus:
+            # 节点拒绝了握手（认证失败等）
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        except InvalidHandshake as e:
+            print(f"WebSocket 转发握手失败: {node}: {e}")
+            await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+            return
+
+        metrics.inc("router_ws_connections_total", node=node, primary=str(i == 0).lower())
+        await websocket.accept()
+        async with upstream:
+            await _relay(websocket, upstream)
+        return
+
+    await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+
+
+async def _relay(websocket: WebSocket, upstream):
+    """双向转发，任一方向结束后关闭另一端"""
+    async def client_to_node():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            await upstream.send(message["text"] if message.get("text") is not None else message["bytes"])
+
+    async def node_to_client():
+        async for message in upstream:
+            if isinstance(message, str):
+                await websocket.send_text(message)
+            else:
+                await websocket.send_bytes(message)
+
+    tasks = [asyncio.ensure_future(client_to_node()), asyncio.ensure_future(node_to_client())]
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+        with suppress(asyncio.CancelledError, ConnectionClosed, WebSocketDisconnect):
+            await task
+    for task in done:
+        with suppress(ConnectionClosed, WebSocketDisconnect, RuntimeError):
+            task.result()
+    if tasks[0] in done:
+        await upstream.close()
+    else:
+        with suppress(RuntimeError):
+            await websocket.close(code=upstream.close_code or status.WS_1000_NORMAL_CLOSURE)
+
+
+def spawn_local(count: int, port: int):
+    """在本机启动 count 个节点（端口 port+1 起）和路由，用于本地验证"""
+    nodes = [f"http://127.0.0.1:{port + i}" for i in range(1, count + 1)]
+    processes = [
+        subprocess.Popen([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port + i)])
+        for i in range(1, count + 1)
+    ]
+    env = {**os.environ, "ROUTER_NODES": json.dumps(nodes)}
+    try:
+        subprocess.run(
+            [sys.executable, "-m", "uvicorn", "app.router_main:app", "--port", str(port)],
+            env=env,
+        )
+    finally:
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="会话亲和路由")
+    parser.add_argument("--spawn", type=int, default=2, help="在本机启动的节点数量")
+    parser.add_argument("--port", type=int, default=8000, help="路由端口，节点使用其后的端口")
+    args = parser.parse_args()
+    spawn_local(args.spawn, args.port)
@@ -18,6 +18,8 @@ class MessageBase(BaseModel):
 class ChatMessage(MessageBase):
     """完整的聊天消息（包含时间戳）"""
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    status: Optional[str] = Field(default=None, description="消息状态，cancelled 表示生成被取消")
+    degraded: Optional[int] = Field(default=None, description="生成时的降级等级，未降级时为空")
 
 
 # ==================== 请求 Schema ====================
@@ -26,6 +28,33 @@ class ChatRequest(BaseModel):
     """聊天请求"""
     message: str = Field(..., min_length=1, description="用户消息内容")
     conversation_id: Optional[str] = Field(default=None, description="会话ID，不传则创建新会话")
+    model: Optional[str] = Field(default=None, description="模型名称，不传则使用默认模型")
+
+
+class WsChatRequest(ChatRequest):
+    """WebSocket 聊天请求（同一连接上的多个请求以 request_id 区分）"""
+    type: Literal["chat"] = "chat"
+    request_id: str = Field(..., min_length=1, max_length=64, description="客户端生成的请求ID")
+
+
+# 单次批量操作的最大条目数
+BULK_MAX_ITEMS = 500
+
+
+class BulkConversationRequest(BaseModel):
+    """批量会话操作请求（删除/归档）"""
+    ids: List[str] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS, description="会话ID列表")
+
+
+class TitleUpdateItem(BaseModel):
+    """单个会话的标题更新"""
+    id: str = Field(..., description="会话ID")
+    title: str = Field(..., min_length=1, max_length=100, description="新标题")
+
+
+class BulkRenameRequest(BaseModel):
+    """批量重命名请求"""
+    items: List[TitleUpdateItem] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
 
 
 # ==================== 响应 Schema ====================
@@ -35,6 +64,8 @@ class ChatResponse(BaseModel):
     message: str = Field(..., description="AI回复内容")
     conversation_id: str = Field(..., description="会话ID")
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    cancelled: bool = Field(default=False, description="生成是否因客户端断开而取消")
+    degraded: int = Field(default=0, description="负载降级等级，0 表示未降级")
 
 
 class ConversationInfo(BaseModel):
@@ -55,3 +86,39 @@ class ConversationListResponse(BaseModel):
     """会话列表响应"""
     conversations: List[ConversationInfo]
     total: int
+
+
+
+class BulkItemResult(BaseModel):
+    """批量操作中单个会话的处理结果"""
+    id: str = Field(..., description="会话ID")
+    success: bool
+    detail: Optional[str] = Field(default=None, description="失败原因或附加说明")
+
+
+class BulkOperationResponse(BaseModel):
+    """批量操作响应"""
+    results: List[BulkItemResult]
+    succeeded: int
+    failed: int
+
+
+class DeleteAllResponse(BaseModel):
+    """删除全部会话响应"""
+    message: str
+    deleted_count: int
+
+
+
+class ModelInfo(BaseModel):
+    """可用模型信息"""
+    name: str
+    default: bool = False
+    adapter: bool = Field(default=False, description="是否为共享基座模型的 LoRA 适配器")
+    resident: bool = Field(default=False, description="是否已加载到内存")
+    in_use: int = Field(default=0, description="正在使用该模型的生成任务数")
+
+
+class ModelListResponse(BaseModel):
+    """可用模型列表"""
+    models: List[ModelInfo]
@@ -0,0 +1,22 @@
+"""
+用量统计相关的 Pydantic Schema
+"""
+from typing import List
+from pydantic import BaseModel, Field
+
+
+class UsageDay(BaseModel):
+    """某天某个模型的用量汇总"""
+    day: str = Field(..., description="日期（UTC，YYYY-MM-DD）")
+    model: str = Field(..., description="模型名称")
+    messages: int = Field(default=0, description="生成的回复条数")
+    prompt_tokens: int = Field(default=0, description="prompt token 数")
+    completion_tokens: int = Field(default=0, description="生成的 token 数（含思考部分）")
+    thinking_tokens: int = Field(default=0, description="思考部分的 token 数")
+    queue_wait_ms: float = Field(default=0, description="排队等待总耗时（毫秒）")
+    generation_ms: float = Field(default=0, description="生成总耗时（毫秒）")
+
+
+class UsageResponse(BaseModel):
+    """用量查询响应"""
+    days: List[UsageDay] = Field(default=[], description="按天、模型汇总的用量")
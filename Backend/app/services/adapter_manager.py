@@ -0,0 +1,354 @@
+"""
+LoRA 适配器复用服务
+多个微调适配器共享同一个常驻基座模型：适配器按请求选择、独立加载与淘汰，
+同一基座上的并发请求（即使使用不同适配器）在短时间窗口内合并为一个批次生成
+
+依赖 peft 的混合适配器批量推理（generate 的 adapter_names 参数），
+每一行独立指定适配器，无需在请求之间切换全局激活的适配器
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from queue import Empty, Queue
+from typing import Callable, Dict, List, Optional
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.model_registry import model_registry
+
+# peft 中表示"不使用适配器"的名称
+BASE_ADAPTER = "__base__"
+
+
+class _Request:
+    """等待批量生成的一条请求"""
+
+    def __init__(
+        self,
+        input_ids: List[int],
+        max_new_tokens: int,
+        adapter_name: str,
+        should_stop: Optional[Callable[[], bool]] = None
+    ):
+        self.input_ids = list(input_ids)
+        self.max_new_tokens = max_new_tokens
+        self.adapter_name = adapter_name
+        self.should_stop = should_stop
+        self.future: Future = Future()
+
+
+class _Batcher:
+    """
+    基座模型的批量生成线程
+    收集 ADAPTER_BATCH_WINDOW_MS 内到达的请求，左填充后一次生成
+
+    注入或删除 LoRA 层会修改模型结构，必须通过 exclusive() 在两个批次之间进行
+    """
+
+    def __init__(self, base_name: str, peft_model):
+        self.base_name = base_name
+        self.peft_model = peft_model
+        self.queue: "Queue[_Request]" = Queue()
+        self._state = threading.Condition()
+        self._busy = False      # 正在生成批次或修改模型结构
+        self._modifiers = 0     # 等待修改模型结构的数量（优先于下一个批次）
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, request: _Request) -> Future:
+        self.queue.put(request)
+        return request.future
+
+    def stop(self):
+        """基座被卸载时结束线程（已提交的请求会先处理完）"""
+        self.queue.put(None)
+
+    @contextmanager
+    def exclusive(self):
+        """独占模型：等待进行中的批次结束，期间不开始新的批次"""
+        with self._state:
+            self._modifiers += 1
+            while self._busy:
+                self._state.wait()
+            self._modifiers -= 1
+            self._busy = True
+        try:
+            yield
+        finally:
+            with self._state:
+                self._busy = False
+                self._state.notify_all()
+
+    def _collect(self) -> List[Optional[_Request]]:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + settings.ADAPTER_BATCH_WINDOW_MS / 1000
+        while batch[-1] is not None and len(batch) < settings.ADAPTER_MAX_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            stopping = batch[-1] is None
+            batch = [request for request in batch if request is not None]
+            if batch:
+                self._run_batch(batch)
+            if stopping:
+                return
+
+    def _run_batch(self, batch: List[_Request]):
+        with self._state:
+            while self._busy or self._modifiers:
+                self._state.wait()
+            self._busy = True
+        try:
+            outputs = self._generate(batch)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        finally:
+            with self._state:
+                self._busy = False
+                self._state.notify_all()
+        for request, output_ids in zip(batch, outputs):
+            request.future.set_result(output_ids)
+
+    def _generate(self, batch: List[_Request]) -> List[List[int]]:
+        from app.services.ai_service import generate_batch_with_model, stop_fired
+        from app.services.cancellation import build_stopping_criteria
+
+        model = self.peft_model
+        config = model.generation_config
+        pad_id = config.pad_token_id
+        if pad_id is None:
+            pad_id = config.eos_token_id[0] if isinstance(config.eos_token_id, list) else config.eos_token_id
+
+        metrics.observe("adapter_batch_size", len(batch), base=self.base_name)
+        outputs = generate_batch_with_model(
+            model,
+            [request.input_ids for request in batch],
+            [request.max_new_tokens for request in batch],
+            adapter_names=[request.adapter_name for request in batch],
+            # 每一行独立取消，被取消的行不影响同批次其他请求
+            stopping_criteria=build_stopping_criteria([request.should_stop for request in batch]),
+        )
+        for request, row in zip(batch, outputs):
+            # 被取消的行之后填充的都是 pad
+            if stop_fired(request.should_stop):
+                while row and row[-1] == pad_id:
+                    row.pop()
+        return outputs
+
+
+class _AdapterEntry:
+    """一个已加载的适配器"""
+
+    def __init__(self, base_name: str):
+        self.base_name = base_name
+        self.refs = 0
+        self.last_used = time.time()
+
+
+class AdapterManager:
+    """在基座模型上按 LRU 管理常驻的 LoRA 适配器"""
+
+    def __init__(self, max_resident: int):
+        self.max_resident = max_resident
+        self._wrappers: Dict[str, object] = {}       # 基座名称 -> PeftModel
+        self._bases: Dict[str, object] = {}          # 基座名称 -> 被包装的基座模型
+        self._batchers: Dict[str, _Batcher] = {}
+        self._adapters: "OrderedDict[str, _AdapterEntry]" = OrderedDict()
+        self._loading = set()
+        self._unloading = set()     # 已移出常驻表、LoRA 层尚未删除的适配器
+        # 尚未注入 LoRA 层的基座上正在进行的普通生成数量；注入会替换模型中的层，
+        # 必须等这些生成结束，注入期间新的普通生成也要等待
+        self._plain_inflight: Dict[str, int] = {}
+        # 正在加载适配器（修改模型结构）的基座，同一基座上的加载串行进行
+        self._modifying = set()
+        self._cond = threading.Condition()
+        model_registry.add_evict_listener(self.forget_base)
+
+    def forget_base(self, base_name: str):
+        """基座模型被注册表卸载时，丢弃其上的适配器"""
+        with self._cond:
+            self._forget_base(base_name)
+
+    def _forget_base(self, base_name: str):
+        self._wrappers.pop(base_name, None)
+        self._bases.pop(base_name, None)
+        batcher = self._batchers.pop(base_name, None)
+        if batcher is not None:
+            batcher.stop()
+        for name in [n for n, e in self._adapters.items() if e.base_name == base_name]:
+            del self._adapters[name]
+        self._update_gauges()
+
+    def _update_gauges(self):
+        metrics.set("adapter_resident_count", len(self._adapters))
+
+    def _pick_victims(self) -> List[tuple]:
+        """
+        选出最近最少使用且没有在用的适配器并移出常驻表（需持有锁）
+
+        Returns:
+            [(适配器名称, 批量生成线程)]，由 _unload 在锁外删除其 LoRA 层
+        """
+        victims = []
+        for name in list(self._adapters):
+            if len(self._adapters) <= self.max_resident:
+                break
+            entry = self._adapters[name]
+            if entry.refs == 0:
+                del self._adapters[name]
+                self._unloading.add(name)
+                victims.append((name, self._batchers.get(entry.base_name)))
+        self._update_gauges()
+        return victims
+
+    def _unload(self, victims: List[tuple]):
+        """删除被淘汰适配器的 LoRA 层（等待进行中的批次结束，不持有管理器的锁）"""
+        for name, batcher in victims:
+            try:
+                if batcher is not None:
+                    with batcher.exclusive():
+                        batcher.peft_model.delete_adapter(name)
+                metrics.inc("adapter_evictions_total", adapter=name)
+            finally:
+                with self._cond:
+                    self._unloading.discard(name)
+                    self._cond.notify_all()
+
+    def _wrapper_for(self, base_name: str, base_model):
+        """获取基座对应的 PeftModel，基座被重新加载过则丢弃旧的包装（需持有锁）"""
+        if base_name in self._bases and self._bases[base_name] is not base_model:
+            self._forget_base(base_name)
+        return self._wrappers.get(base_name)
+
+    def _acquire(self, base_name: str, base_model, adapter_name: str):
+        """确保适配器已加载并增加引用计数，返回 PeftModel"""
+        from peft import PeftModel
+
+        with self._cond:
+            while True:
+                wrapper = self._wrapper_for(base_name, base_model)
+                entry = self._adapters.get(adapter_name)
+                if entry is not None and wrapper is not None:
+                    entry.refs += 1
+                    entry.last_used = time.time()
+                    self._adapters.move_to_end(adapter_name)
+                    return wrapper
+                if (
+                    adapter_name not in self._loading
+                    and adapter_name not in self._unloading
+                    and base_name not in self._modifying
+                ):
+                    break
+                self._cond.wait()
+            self._loading.add(adapter_name)
+            self._modifying.add(base_name)
+            if wrapper is None:
+                while self._plain_inflight.get(base_name, 0):
+                    self._cond.wait()
+
+            batcher = self._batchers.get(base_name)
+
+        # 加载（换入）适配器，记录换入耗时
+        start = time.perf_counter()
+        victims: List[tuple] = []
+        try:
+            path = settings.ADAPTERS[adapter_name]
+            if wrapper is None:
+                wrapper = PeftModel.from_pretrained(base_model, path, adapter_name=adapter_name)
+                wrapper.eval()
+            else:
+                # 注入新的 LoRA 层前等待基座上进行中的批次结束
+                with batcher.exclusive():
+                    wrapper.load_adapter(path, adapter_name=adapter_name)
+            with self._cond:
+                if base_name not in self._wrappers:
+                    self._wrappers[base_name] = wrapper
+                    self._bases[base_name] = base_model
+                    self._batchers[base_name] = _Batcher(base_name, wrapper)
+                entry = _AdapterEntry(base_name)
+                entry.refs = 1
+                self._adapters[adapter_name] = entry
+                victims = self._pick_victims()
+        finally:
+            with self._cond:
+                self._loading.discard(adapter_name)
+                self._modifying.discard(base_name)
+                self._cond.notify_all()
+        self._unload(victims)
+        metrics.observe("adapter_swap_seconds", time.perf_counter() - start, adapter=adapter_name)
+        return wrapper
+
+    def _release(self, adapter_name: str):
+        with self._cond:
+            entry = self._adapters.get(adapter_name)
+            if entry is not None:
+                entry.refs -= 1
+            victims = self._pick_victims()
+        self._unload(victims)
+
+    def generate(
+        self,
+        base_name: str,
+        adapter_name: Optional[str],
+        input_ids: List[int],
+        max_new_tokens: int,
+        should_stop: Optional[Callable[[], bool]] = None
+    ) -> List[int]:
+        """
+        在基座模型上使用指定适配器生成（adapter_name 为 None 表示只用基座）
+
+        Returns:
+            新生成部分的 token id 列表
+        """
+        from app.services.ai_service import generate_with_model
+
+        with model_registry.lease(base_name) as base_model:
+            if adapter_name is None:
+                with self._cond:
+                    while base_name in self._modifying:
+                        self._cond.wait()
+                    wrapper = self._wrapper_for(base_name, base_model)
+                    if wrapper is None:
+                        self._plain_inflight[base_name] = self._plain_inflight.get(base_name, 0) + 1
+                if wrapper is None:
+                    # 基座上还没有注入任何适配器，直接生成
+                    try:
+                        return generate_with_model(base_model, input_ids, max_new_tokens, should_stop)
+                    finally:
+                        with self._cond:
+                            self._plain_inflight[base_name] -= 1
+                            self._cond.notify_all()
+                request = _Request(input_ids, max_new_tokens, BASE_ADAPTER, should_stop)
+                return self._batchers[base_name].submit(request).result()
+
+            self._acquire(base_name, base_model, adapter_name)
+            try:
+                request = _Request(input_ids, max_new_tokens, adapter_name, should_stop)
+                return self._batchers[base_name].submit(request).result()
+            finally:
+                self._release(adapter_name)
+
+    def resident(self) -> List[dict]:
+        """当前常驻适配器的状态"""
+        with self._cond:
+            return [
+                {"name": name, "base": entry.base_name, "in_use": entry.refs, "last_used": entry.last_used}
+                for name, entry in self._adapters.items()
+            ]
+
+
+# 创建全局适配器管理器
+adapter_manager = AdapterManager(settings.ADAPTER_MAX_RESIDENT)
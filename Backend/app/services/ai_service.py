@@ -0,0 +1,532 @@
+"""
+AI 模型推理服务
+负责模型的加载与文本生成
+
+推理后端由 INFERENCE_BACKEND 决定：
+- local: 当前进程加载模型并推理
+- server: 当前进程只加载分词器，生成任务提交给共享的模型服务进程（见 model_server）
+"""
+import time
+from dataclasses import dataclass
+from typing import Callable, Generator, List, Optional
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.model_registry import model_registry, get_model_paths, get_base_model_name
+
+# modelscope / transformers / torch 导入耗时数秒、占用数百 MB 内存，
+# 统一在真正需要推理时才在函数内导入，保证只用到认证和聊天记录的进程启动迅速
+
+# Qwen3 思考结束标记 </think> 的 token id
+THINK_END_TOKEN_ID = 151668
+
+
+class StopFlag:
+    """
+    包装取消检查函数，记录生成是否真的因取消而停止
+
+    只在解码过程中由停止条件调用；生成自然结束（结束符或达到上限）之后客户端才断开的，
+    不会被记为取消
+    """
+
+    def __init__(self, check: Callable[[], bool]):
+        self.check = check
+        self.fired = False
+
+    def __call__(self) -> bool:
+        if not self.fired and self.check():
+            self.fired = True
+        return self.fired
+
+
+def stop_fired(should_stop: Optional[Callable[[], bool]]) -> bool:
+    """生成结束后判断是否因取消而停止（不再调用检查函数）"""
+    return bool(getattr(should_stop, "fired", False))
+
+
+def thinking_length(output_ids: List[int]) -> int:
+    """思考部分的 token 数：到最后一个 </think> 为止（含该标记），没有 </think> 时为 0"""
+    try:
+        return len(output_ids) - output_ids[::-1].index(THINK_END_TOKEN_ID)
+    except ValueError:
+        return 0
+
+
+@dataclass
+class GenerationResult:
+    """一次生成的结果"""
+    text: str                   # 思考之后的实际回复内容
+    completion_tokens: int      # 生成的 token 数（含思考部分）
+    max_new_tokens: int         # 本次生成的 token 上限
+    cancelled: bool = False     # 是否因取消而提前结束
+    prompt_tokens: int = 0      # prompt 的 token 数
+    thinking_tokens: int = 0    # 思考部分（含 </think>）的 token 数
+    queue_wait_seconds: float = 0.0     # 从提交到开始处理的等待时间
+    generation_seconds: float = 0.0     # 分词、等待模型与生成的耗时
+
+    def usage(self, model_name: str) -> dict:
+        """随助手消息保存的用量记录"""
+        return {
+            "model": model_name,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "thinking_tokens": self.thinking_tokens,
+            "queue_wait_ms": round(self.queue_wait_seconds * 1000, 1),
+            "generation_ms": round(self.generation_seconds * 1000, 1),
+        }
+
+
+# 分词器体积小，按模型名称常驻缓存；模型权重由 model_registry 按内存预算管理
+_tokenizers = {}
+# prompt 片段缓存，按基座模型名称区分
+_prompt_encoders = {}
+
+
+def get_tokenizer(model_name: Optional[str] = None):
+    """获取分词器（延迟加载，不加载模型权重；适配器使用其基座模型的分词器）"""
+    name = get_base_model_name(model_name)
+    if name not in _tokenizers:
+        from modelscope import AutoTokenizer
+        _tokenizers[name] = AutoTokenizer.from_pretrained(get_model_paths()[name])
+    return _tokenizers[name]
+
+
+def get_prompt_encoder(model_name: Optional[str] = None):
+    """获取模型分词器对应的 prompt 片段缓存编码器"""
+    from app.services.prompt_cache import PromptEncoder
+
+    name = get_base_model_name(model_name)
+    if name not in _prompt_encoders:
+        _prompt_encoders[name] = PromptEncoder(get_tokenizer(name), settings.PROMPT_CACHE_MAX_ENTRIES)
+    return _prompt_encoders[name]
+
+
+def message_segment_fields(message: dict, model_name: Optional[str] = None, enable_thinking: bool = True) -> dict:
+    """
+    计算与消息一起持久化的 token id 片段（PROMPT_CACHE_PERSIST 开启时保存）
+
+    Returns:
+        {"segment_key", "segment_ids"}，缓存不可用时返回空字典
+    """
+    if not (settings.PROMPT_CACHE_ENABLED and settings.PROMPT_CACHE_PERSIST):
+        return {}
+    from app.services.prompt_cache import SegmentationError
+
+    encoder = get_prompt_encoder(model_name)
+    if encoder.disabled:
+        return {}
+    try:
+        ids = encoder.segment_ids(message, False, enable_thinking)
+    except SegmentationError:
+        return {}
+    return {"segment_key": encoder.segment_key(enable_thinking), "segment_ids": list(ids)}
+
+
+async def compute_segment_fields(role: str, content: str, model_name: Optional[str] = None) -> Optional[dict]:
+    """
+    在线程池中计算随消息保存的 token id 片段（HTTP 与 WebSocket 聊天共用）
+
+    Returns:
+        片段字段，未开启 PROMPT_CACHE_PERSIST 或计算失败时返回 None
+    """
+    if not (settings.PROMPT_CACHE_ENABLED and settings.PROMPT_CACHE_PERSIST):
+        return None
+    from starlette.concurrency import run_in_threadpool
+
+    try:
+        return await run_in_threadpool(message_segment_fields, {"role": role, "content": content}, model_name)
+    except Exception as e:
+        print(f"prompt 片段计算失败: {e}")
+        return None
+
+
+def get_model(model_name: Optional[str] = None):
+    """
+    获取模型实例（延迟加载）
+
+    只用于预热等不需要持有租约的场景，生成时请使用 model_registry.lease
+    """
+    with model_registry.lease(model_name) as model:
+        return model, get_tokenizer(model_name)
+
+
+def build_prompt_ids(
+    messages: list,
+    enable_thinking: bool = True,
+    model_name: Optional[str] = None
+) -> List[int]:
+    """
+    套用对话模板并分词
+
+    开启 PROMPT_CACHE_ENABLED 时拼接缓存的消息片段，只为新消息分词；
+    抽样与完整编码对比，不一致时停用缓存并使用完整编码的结果
+
+    Args:
+        messages: 对话历史消息列表
+        enable_thinking: 是否启用思考模式
+        model_name: 模型名称，默认使用 DEFAULT_MODEL
+
+    Returns:
+        prompt 的 token id 列表
+    """
+    if settings.PROMPT_CACHE_ENABLED:
+        from app.services.prompt_cache import SegmentationError
+
+        encoder = get_prompt_encoder(model_name)
+        if not encoder.disabled:
+            if encoder.should_verify():
+                expected = encoder.verify(messages, enable_thinking)
+                if expected is not None:
+                    return expected
+            try:
+                return encoder.encode(messages, enable_thinking)
+            except SegmentationError:
+                encoder.disabled = True
+
+    tokenizer = get_tokenizer(model_name)
+    text = tokenizer.apply_chat_template(
+        messages,
+        tokenize=False,
+        add_generation_prompt=True,
+        enable_thinking=enable_thinking
+    )
+    return tokenizer([text]).input_ids[0]
+
+
+def generate_with_model(
+    model,
+    input_ids: List[int],
+    max_new_tokens: int = 32768,
+    should_stop: Optional[Callable[[], bool]] = None,
+    streamer=None
+) -> List[int]:
+    """
+    用给定的模型实例生成
+
+    Args:
+        model: 模型实例
+        input_ids: prompt 的 token id 列表
+        max_new_tokens: 最大生成 token 数
+        should_stop: 取消检查函数，返回 True 时在下一个解码步停止
+        streamer: transformers 的 streamer，每个解码步接收新生成的 token
+
+    Returns:
+        新生成部分的 token id 列表（不含输入；取消时为已生成的部分）
+    """
+    import torch
+    from app.services.cancellation import build_stopping_criteria
+
+    input_tensor = torch.tensor([list(input_ids)], device=model.device)
+    generated_ids = model.generate(
+        input_ids=input_tensor,
+        attention_mask=torch.ones_like(input_tensor),
+        max_new_tokens=max_new_tokens,
+        stopping_criteria=build_stopping_criteria([should_stop]),
+        streamer=streamer,
+    )
+    # 提取生成的部分（排除输入）
+    return generated_ids[0][len(input_ids):].tolist()
+
+
+def generate_batch_with_model(
+    model,
+    batch_input_ids: List[List[int]],
+    max_new_tokens: List[int],
+    **generate_kwargs
+) -> List[List[int]]:
+    """
+    左填充后批量生成
+
+    Args:
+        model: 模型实例
+        batch_input_ids: 每行 prompt 的 token id 列表
+        max_new_tokens: 每行的最大生成 token 数（整批按最大值生成，结果按各自上限截断）
+        generate_kwargs: 传给 model.generate 的其他参数（如 adapter_names、stopping_criteria）
+
+    Returns:
+        每行新生成部分的 token id（在结束符处截断，保留结束符本身，与单条生成一致）
+    """
+    import torch
+
+    config = model.generation_config
+    eos_ids = config.eos_token_id if isinstance(config.eos_token_id, list) else [config.eos_token_id]
+    pad_id = config.pad_token_id if config.pad_token_id is not None else eos_ids[0]
+
+    max_len = max(len(ids) for ids in batch_input_ids)
+    input_ids = [[pad_id] * (max_len - len(ids)) + list(ids) for ids in batch_input_ids]
+    attention_mask = [[0] * (max_len - len(ids)) + [1] * len(ids) for ids in batch_input_ids]
+    generated = model.generate(
+        input_ids=torch.tensor(input_ids, device=model.device),
+        attention_mask=torch.tensor(attention_mask, device=model.device),
+        max_new_tokens=max(max_new_tokens),
+        pad_token_id=pad_id,
+        **generate_kwargs,
+    )
+
+    outputs = []
+    for limit, row in zip(max_new_tokens, generated[:, max_len:].tolist()):
+        row = row[:limit]
+        for i, token_id in enumerate(row):
+            if token_id in eos_ids:
+                row = row[:i + 1]
+                break
+        outputs.append(row)
+    return outputs
+
+
+def generate_ids_local(
+    input_ids: List[int],
+    max_new_tokens: int = 32768,
+    model_name: Optional[str] = None,
+    should_stop: Optional[Callable[[], bool]] = None
+) -> List[int]:
+    """
+    在当前进程中生成（输入输出均为 token id）
+
+    配置了 LoRA 适配器时由 adapter_manager 在共享基座上批量生成，
+    否则直接使用注册表中的完整模型
+
+    Args:
+        input_ids: prompt 的 token id 列表
+        max_new_tokens: 最大生成 token 数
+        model_name: 模型或适配器名称，默认使用 DEFAULT_MODEL
+        should_stop: 取消检查函数
+
+    Returns:
+        新生成部分的 token id 列表（不含输入）
+    """
+    if settings.ADAPTERS:
+        from app.services.adapter_manager import adapter_manager
+        adapter_name = model_name if model_name in settings.ADAPTERS else None
+        return adapter_manager.generate(
+            get_base_model_name(model_name), adapter_name, input_ids, max_new_tokens, should_stop
+        )
+
+    # 生成期间持有租约，模型不会被淘汰
+    with model_registry.lease(model_name) as model:
+        return generate_with_model(model, input_ids, max_new_tokens, should_stop)
+
+
+def parse_output(output_ids: List[int], model_name: Optional[str] = None) -> str:
+    """
+    解析生成结果，去掉思考内容
+
+    Args:
+        output_ids: 新生成部分的 token id 列表
+        model_name: 模型名称，默认使用 DEFAULT_MODEL
+
+    Returns:
+        思考之后的实际回复内容
+    """
+    index = thinking_length(output_ids)
+    return get_tokenizer(model_name).decode(output_ids[index:], skip_special_tokens=True).strip("\n")
+
+
+def generate_ai_reply(
+    messages: list,
+    enable_thinking: bool = True,
+    max_new_tokens: int = 32768,
+    model_name: Optional[str] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+    queued_at: Optional[float] = None
+) -> GenerationResult:
+    """
+    调用 AI 模型生成回复，返回包含统计信息的结果
+
+    Args:
+        messages: 对话历史消息列表
+        enable_thinking: 是否启用思考模式
+        max_new_tokens: 最大生成 token 数
+        model_name: 模型或适配器名称，默认使用 DEFAULT_MODEL
+        should_stop: 取消检查函数（如客户端断开），返回 True 时尽快停止生成
+        queued_at: 请求提交的时间（time.perf_counter()），用于统计排队等待
+
+    Returns:
+        生成结果
+    """
+    started = time.perf_counter()
+    input_ids = build_prompt_ids(messages, enable_thinking, model_name)
+    should_stop = StopFlag(should_stop) if should_stop else None
+
+    if settings.INFERENCE_BACKEND == "server":
+        from app.services.model_server import get_model_client
+        output_ids = get_model_client().generate_ids(input_ids, max_new_tokens, model_name, should_stop)
+    else:
+        output_ids = generate_ids_local(input_ids, max_new_tokens, model_name, should_stop)
+
+    return _build_result(
+        output_ids, enable_thinking, max_new_tokens, model_name, should_stop,
+        len(input_ids), started, queued_at
+    )
+
+
+def _ends_with_eos(output_ids: List[int], model_name: Optional[str]) -> bool:
+    """
+    是否以结束符结尾（停止条件在生成结束符的同一步也会被调用，
+    此时回复已经完整，即使检查函数返回了 True 也不算取消）
+    """
+    if not output_ids:
+        return False
+    tokenizer = get_tokenizer(model_name)
+    return output_ids[-1] in (tokenizer.eos_token_id, tokenizer.pad_token_id)
+
+
+def _build_result(
+    output_ids: List[int],
+    enable_thinking: bool,
+    max_new_tokens: int,
+    model_name: Optional[str],
+    should_stop: Optional[Callable[[], bool]],
+    prompt_tokens: int = 0,
+    started: Optional[float] = None,
+    queued_at: Optional[float] = None
+) -> GenerationResult:
+    """
+    由生成的 token 构建结果，并记录取消相关的指标
+
+    是否取消取自生成过程中停止条件记录的结果（StopFlag.fired），不在生成结束后重新检查
+    """
+    finished = time.perf_counter()
+    cancelled = stop_fired(should_stop) and len(output_ids) < max_new_tokens and not _ends_with_eos(output_ids, model_name)
+    # 与 parse_output 使用同一个分界（最后一个 </think>），用量与保存的回复内容一致
+    thinking_tokens = thinking_length(output_ids)
+    if not thinking_tokens and enable_thinking:
+        # 还没结束思考就停止了（取消或达到上限）
+        thinking_tokens = len(output_ids)
+    if cancelled and enable_thinking and THINK_END_TOKEN_ID not in output_ids:
+        # 在思考阶段被取消，还没有任何实际回复内容
+        text = ""
+    else:
+        text = parse_output(output_ids, model_name)
+    if cancelled:
+        # 节省量按剩余的生成上限计（上限估计）
+        metrics.inc("generation_cancelled_total")
+        metrics.inc("generation_cancel_tokens_saved_total", max_new_tokens - len(output_ids))
+    return GenerationResult(
+        text=text,
+        completion_tokens=len(output_ids),
+        max_new_tokens=max_new_tokens,
+        cancelled=cancelled,
+        prompt_tokens=prompt_tokens,
+        thinking_tokens=thinking_tokens,
+        queue_wait_seconds=max(started - queued_at, 0.0) if started is not None and queued_at is not None else 0.0,
+        generation_seconds=finished - started if started is not None else 0.0
+    )
+
+
+def stream_ai_reply(
+    messages: list,
+    enable_thinking: bool = True,
+    max_new_tokens: int = 32768,
+    model_name: Optional[str] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+    queued_at: Optional[float] = None
+) -> Generator[str, None, GenerationResult]:
+    """
+    流式生成回复：逐段产出回复文本（不含思考内容），结束时返回完整结果
+
+    共享模型服务和适配器批量生成不支持逐 token 返回，此时整段回复作为一个片段产出
+
+    Args:
+        messages: 对话历史消息列表
+        enable_thinking: 是否启用思考模式
+        max_new_tokens: 最大生成 token 数
+        model_name: 模型或适配器名称，默认使用 DEFAULT_MODEL
+        should_stop: 取消检查函数
+        queued_at: 请求提交的时间（time.perf_counter()），用于统计排队等待
+
+    Yields:
+        新增的回复文本片段
+
+    Returns:
+        生成结果（与 generate_ai_reply 相同，text 为完整回复）
+    """
+    if settings.INFERENCE_BACKEND == "server" or settings.ADAPTERS:
+        result = generate_ai_reply(messages, enable_thinking, max_new_tokens, model_name, should_stop, queued_at)
+        if result.text:
+            yield result.text
+        return result
+
+    import threading
+    from app.services.streaming import IncrementalDecoder, TokenQueueStreamer
+
+    started = time.perf_counter()
+    input_ids = build_prompt_ids(messages, enable_thinking, model_name)
+    should_stop = StopFlag(should_stop) if should_stop else None
+    decoder = IncrementalDecoder(get_tokenizer(model_name))
+    streamer = TokenQueueStreamer()
+    errors = []
+    output_ids = []
+
+    with model_registry.lease(model_name) as model:
+        def run():
+            try:
+                generate_with_model(model, input_ids, max_new_tokens, should_stop, streamer)
+            except BaseException as e:
+                errors.append(e)
+                streamer.end()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            # 思考内容不输出，直到出现 </think>
+            in_reply = not enable_thinking
+            for token_id in streamer:
+                output_ids.append(token_id)
+                if not in_reply:
+                    in_reply = token_id == THINK_END_TOKEN_ID
+                    continue
+                delta = decoder.feed(token_id)
+                if delta:
+                    yield delta
+        finally:
+            # 生成结束前不释放租约
+            thread.join()
+    if errors:
+        raise errors[0]
+    return _build_result(
+        output_ids, enable_thinking, max_new_tokens, model_name, should_stop,
+        len(input_ids), started, queued_at
+    )
+
+
+def generate_ai_response(
+    messages: list,
+    enable_thinking: bool = True,
+    max_new_tokens: int = 32768,
+    model_name: Optional[str] = None
+) -> str:
+    """
+    调用 AI 模型生成回复
+
+    Args:
+        messages: 对话历史消息列表
+        enable_thinking: 是否启用思考模式
+        max_new_tokens: 最大生成 token 数
+        model_name: 模型或适配器名称，默认使用 DEFAULT_MODEL
+
+    Returns:
+        AI 生成的回复文本
+    """
+    return generate_ai_reply(messages, enable_thinking, max_new_tokens, model_name).text
+
+
+def count_prompt_tokens(messages: List[dict], model_name: Optional[str] = None) -> int:
+    """
+    统计消息列表经过对话模板后的 token 数量
+
+    先渲染为文本再分词（与 build_prompt_ids 一致）：新版 transformers 中
+    apply_chat_template(tokenize=True) 默认返回 BatchEncoding，不能直接取长度
+
+    Args:
+        messages: 消息列表（role/content）
+        model_name: 模型或适配器名称，按其（基座模型的）分词器统计，默认使用 DEFAULT_MODEL
+
+    Returns:
+        token 数量
+    """
+    if not messages:
+        return 0
+    tokenizer = get_tokenizer(model_name)
+    text = tokenizer.apply_chat_template(messages, tokenize=False)
+    return len(tokenizer([text]).input_ids[0])
@@ -0,0 +1,226 @@
+"""
+会话冷存储服务
+将长期未更新的会话消息压缩后移入归档集合，热集合中只保留不含消息的存根；
+访问时透明地恢复到热集合
+
+运行一次归档（可配合 cron 使用，在 Backend 目录下）:
+    python -m app.services.archive_service
+"""
+import asyncio
+import zlib
+from datetime import datetime, timedelta
+from typing import List, Optional, Set
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.asynchronous.database import AsyncDatabase
+from bson import BSON, Binary, ObjectId
+
+from app.core.config import settings
+
+
+def compress_messages(messages: List[dict]) -> Binary:
+    """将消息列表编码为 BSON 并压缩"""
+    raw = BSON.encode({"messages": messages})
+    return Binary(zlib.compress(raw, settings.ARCHIVE_COMPRESSION_LEVEL))
+
+
+def decompress_messages(blob: bytes) -> List[dict]:
+    """解压归档数据，还原消息列表"""
+    return BSON(zlib.decompress(blob)).decode()["messages"]
+
+
+async def archive_conversations(db: AsyncDatabase, conversations: List[dict]) -> Set[ObjectId]:
+    """
+    批量归档会话
+
+    先用一次 bulk_write 写入归档集合，再用一次 bulk_write 以 updated_at 作为
+    乐观锁把热集合中的文档替换为存根；期间有新消息写入的会话放弃归档
+
+    Args:
+        db: MongoDB 数据库实例
+        conversations: 完整的会话文档列表
+
+    Returns:
+        成功归档的会话 ObjectId 集合
+    """
+    if not conversations:
+        return set()
+
+    now = datetime.utcnow()
+    await db.conversation_archives.bulk_write([
+        ReplaceOne(
+            {"_id": conv["_id"]},
+            {
+                "_id": conv["_id"],
+                "user_id": conv["user_id"],
+                "blob": compress_messages(conv.get("messages", [])),
+                "message_count": len(conv.get("messages", [])),
+                "archived_at": now,
+            },
+            upsert=True
+        )
+        for conv in conversations
+    ], ordered=False)
+
+    await db.conversations.bulk_write([
+        UpdateOne(
+            {
+                "_id": conv["_id"],
+                "updated_at": conv.get("updated_at"),
+                "archived": {"$ne": True},
+            },
+            {
+                "$set": {
+                    "messages": [],
+                    "message_count": len(conv.get("messages", [])),
+                    "archived": True,
+                }
+            }
+        )
+        for conv in conversations
+    ], ordered=False)
+
+    # bulk_write 只返回计数，回查哪些会话真正变成了存根
+    ids = [conv["_id"] for conv in conversations]
+    archived = {
+        doc["_id"]
+        async for doc in db.conversations.find({"_id": {"$in": ids}, "archived": True}, {"_id": 1})
+    }
+    failed = [cid for cid in ids if cid not in archived]
+    if failed:
+        await db.conversation_archives.delete_many({"_id": {"$in": failed}})
+    return archived
+
+
+async def archive_conversation(db: AsyncDatabase, conversation: dict) -> bool:
+    """
+    归档单个会话
+
+    Args:
+        db: MongoDB 数据库实例
+        conversation: 完整的会话文档
+
+    Returns:
+        是否归档成功
+    """
+    return conversation["_id"] in await archive_conversations(db, [conversation])
+
+
+async def load_archived_messages(db: AsyncDatabase, conversation_id: ObjectId) -> List[dict]:
+    """
+    读取归档的消息列表（不恢复到热集合）
+
+    Args:
+        db: MongoDB 数据库实例
+        conversation_id: 会话 ObjectId
+
+    Returns:
+        消息列表，归档不存在时返回空列表
+    """
+    archive = await db.conversation_archives.find_one({"_id": conversation_id})
+    if not archive:
+        return []
+    return decompress_messages(archive["blob"])
+
+
+async def restore_conversation(db: AsyncDatabase, conversation_id: ObjectId) -> bool:
+    """
+    将归档会话恢复到热集合
+
+    归档消息插入到消息列表最前面，不影响恢复前并发追加的消息。
+    恢复时记录 restored_at（不修改 updated_at，会话列表的顺序不变），
+    ARCHIVE_AFTER_DAYS 内不会再次被归档
+
+    Args:
+        db: MongoDB 数据库实例
+        conversation_id: 会话 ObjectId
+
+    Returns:
+        是否恢复成功
+    """
+    archive = await db.conversation_archives.find_one({"_id": conversation_id})
+    if not archive:
+        # 归档记录丢失时只清除存根标记，避免反复尝试恢复
+        await db.conversations.update_one(
+            {"_id": conversation_id},
+            {"$unset": {"archived": "", "message_count": ""}}
+        )
+        return False
+
+    result = await db.conversations.update_one(
+        {"_id": conversation_id, "archived": True},
+        {
+            "$push": {"messages": {"$each": decompress_messages(archive["blob"]), "$position": 0}},
+            "$set": {"restored_at": datetime.utcnow()},
+            "$unset": {"archived": "", "message_count": ""},
+        }
+    )
+    if result.modified_count > 0:
+        # 只删除本次读取的归档：期间会话若已被再次归档，新的归档记录必须保留
+        await db.conversation_archives.delete_one({"_id": conversation_id, "archived_at": archive["archived_at"]})
+    return True
+
+
+async def archive_inactive_conversations(
+    db: AsyncDatabase,
+    inactive_days: Optional[int] = None,
+    limit: Optional[int] = None
+) -> int:
+    """
+    归档超过指定天数未更新的会话
+
+    Args:
+        db: MongoDB 数据库实例
+        inactive_days: 未更新天数阈值，默认取配置
+        limit: 本次最多归档的会话数量，默认取配置
+
+    Returns:
+        成功归档的会话数量
+    """
+    cutoff = datetime.utcnow() - timedelta(days=inactive_days or settings.ARCHIVE_AFTER_DAYS)
+    cursor = db.conversations.find({
+        "updated_at": {"$lt": cutoff},
+        "archived": {"$ne": True},
+        # 最近被访问恢复的会话同样视为活跃，避免反复归档与恢复
+        "restored_at": {"$not": {"$gte": cutoff}},
+    }).limit(limit or settings.ARCHIVE_BATCH_SIZE)
+
+    conversations = await cursor.to_list()
+    return len(await archive_conversations(db, conversations))
+
+
+async def run_archive_loop(db: AsyncDatabase):
+    """
+    后台归档任务
+    在应用生命周期内周期性运行，直到被取消
+    """
+    while True:
+        try:
+            count = await archive_inactive_conversations(db)
+            if count:
+                print(f"🗄️ 已归档 {count} 个不活跃会话")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"归档任务出错: {e}")
+        await asyncio.sleep(settings.ARCHIVE_INTERVAL_SECONDS)
+
+
+async def main():
+    """命令行入口：执行一次归档"""
+    from pymongo import AsyncMongoClient
+
+    client = AsyncMongoClient(settings.MONGO_URL)
+    try:
+        total = 0
+        while True:
+            count = await archive_inactive_conversations(client[settings.MONGO_DB])
+            if not count:
+                break
+            total += count
+        print(f"✅ 本次归档 {total} 个会话")
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
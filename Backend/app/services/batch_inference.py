@@ -0,0 +1,222 @@
+"""
+离线批量推理
+从 JSONL 文件流式读取大量 prompt（评测集、预生成 FAQ 回答等），按长度分桶后左填充批量生成，
+使用与 generate_ai_response 相同的对话模板和 </think> 解析，结果逐批追加写入输出文件
+
+输入每行一个 JSON 对象:
+    {"id": "q1", "prompt": "..."}                       # 单轮提问
+    {"id": "q2", "messages": [{"role": "user", "content": "..."}]}
+    可选字段: enable_thinking（默认 true）、max_new_tokens
+
+输出每行一个 JSON 对象:
+    {"id", "content", "prompt_tokens", "completion_tokens"}（--keep-thinking 时附带 thinking）
+
+中断后使用相同的参数重新运行即可继续，输出文件中已有的 id 会被跳过，末尾写了一半的行会被截掉
+
+运行方式（在 Backend 目录下）:
+    python -m app.services.batch_inference prompts.jsonl answers.jsonl --batch-size 16
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Iterator, List, Optional, Set
+
+from app.core.config import settings
+
+
+def load_completed_ids(output_path: str) -> Set[str]:
+    """读取输出文件中已完成的 id（忽略中断时写了一半的最后一行）"""
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                completed.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError):
+                continue
+    return completed
+
+
+def drop_partial_line(output_path: str, block_size: int = 65536):
+    """
+    截掉输出文件末尾中断时写了一半的行
+
+    输出以追加方式打开，不截掉的话续跑写入的第一条结果会接在半行后面，两条都无法解析
+    """
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - block_size)
+            f.seek(start)
+            index = f.read(position - start).rfind(b"\n")
+            if index >= 0:
+                position = start + index + 1
+                break
+            position = start
+        if position < end:
+            f.truncate(position)
+            print(f"⚠️ 输出文件末尾有不完整的行（{end - position} 字节），已截掉")
+
+
+def iter_items(input_path: str, completed: Set[str]) -> Iterator[dict]:
+    """流式读取输入，补全 id（缺省为行号）并跳过已完成的条目"""
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            item["id"] = str(item.get("id", line_no))
+            if item["id"] in completed:
+                continue
+            if "messages" not in item:
+                item["messages"] = [{"role": "user", "content": item["prompt"]}]
+            yield item
+
+
+def iter_batches(items: Iterator[dict], window: int, batch_size: int, max_batch_tokens: int) -> Iterator[List[dict]]:
+    """
+    每读入 window 条按 prompt 长度排序后切分批次，长度相近的 prompt 在同一批中，减少填充
+
+    批次大小同时受 batch_size 和填充后的总 token 数 max_batch_tokens 限制
+    """
+    def split(bucket: List[dict]) -> Iterator[List[dict]]:
+        bucket.sort(key=lambda item: len(item["input_ids"]))
+        batch: List[dict] = []
+        for item in bucket:
+            # 已按长度升序排列，加入后整批按当前条目的长度填充
+            padded = (len(batch) + 1) * len(item["input_ids"])
+            if batch and (len(batch) >= batch_size or padded > max_batch_tokens):
+                yield batch
+                batch = []
+            batch.append(item)
+        if batch:
+            yield batch
+
+    bucket: List[dict] = []
+    for item in items:
+        bucket.append(item)
+        if len(bucket) >= window:
+            yield from split(bucket)
+            bucket = []
+    if bucket:
+        yield from split(bucket)
+
+
+def split_thinking(output_ids: List[int], model_name: Optional[str]) -> str:
+    """解析思考内容（最后一个 </think> 之前的部分）"""
+    from app.services.ai_service import get_tokenizer, thinking_length
+
+    index = thinking_length(output_ids)
+    if not index:
+        return ""
+    return get_tokenizer(model_name).decode(output_ids[:index], skip_special_tokens=True).strip("\n")
+
+
+def run(
+    input_path: str,
+    output_path: str,
+    model_name: Optional[str] = None,
+    batch_size: int = 8,
+    max_batch_tokens: int = 16384,
+    window: int = 512,
+    max_new_tokens: int = 2048,
+    keep_thinking: bool = False
+) -> dict:
+    """
+    执行批量推理
+
+    Returns:
+        统计信息（条目数、token 数、耗时、吞吐）
+    """
+    from app.services.ai_service import build_prompt_ids, generate_batch_with_model, parse_output
+    from app.services.model_registry import model_registry
+
+    if model_name in settings.ADAPTERS:
+        raise SystemExit("批量推理只支持完整模型，不支持 LoRA 适配器")
+
+    drop_partial_line(output_path)
+    completed = load_completed_ids(output_path)
+    if completed:
+        print(f"⏩ 输出文件中已有 {len(completed)} 条结果，将跳过")
+
+    def prepared() -> Iterator[dict]:
+        for item in iter_items(input_path, completed):
+            item["input_ids"] = build_prompt_ids(item["messages"], item.get("enable_thinking", True), model_name)
+            yield item
+
+    stats = {"items": 0, "prompt_tokens": 0, "completion_tokens": 0, "batches": 0}
+    start = time.perf_counter()
+    with model_registry.lease(model_name) as model, open(output_path, "a", encoding="utf-8") as out:
+        for batch in iter_batches(prepared(), window, batch_size, max_batch_tokens):
+            outputs = generate_batch_with_model(
+                model,
+                [item["input_ids"] for item in batch],
+                [item.get("max_new_tokens", max_new_tokens) for item in batch],
+            )
+            for item, output_ids in zip(batch, outputs):
+                record = {
+                    "id": item["id"],
+                    "content": parse_output(output_ids, model_name),
+                    "prompt_tokens": len(item["input_ids"]),
+                    "completion_tokens": len(output_ids),
+                }
+                if keep_thinking:
+                    record["thinking"] = split_thinking(output_ids, model_name)
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                stats["prompt_tokens"] += record["prompt_tokens"]
+                stats["completion_tokens"] += record["completion_tokens"]
+            # 每批写完立即落盘，中断后可以从这里继续
+            out.flush()
+            stats["items"] += len(batch)
+            stats["batches"] += 1
+            elapsed = time.perf_counter() - start
+            print(
+                f"  已完成 {stats['items']} 条，生成 {stats['completion_tokens'] / elapsed:.1f} tokens/s",
+                end="\r"
+            )
+
+    stats["seconds"] = round(time.perf_counter() - start, 2)
+    seconds = max(stats["seconds"], 1e-9)
+    stats["completion_tokens_per_second"] = round(stats["completion_tokens"] / seconds, 1)
+    stats["total_tokens_per_second"] = round(
+        (stats["prompt_tokens"] + stats["completion_tokens"]) / seconds, 1
+    )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线批量推理")
+    parser.add_argument("input", help="输入 JSONL 文件")
+    parser.add_argument("output", help="输出 JSONL 文件（追加写入，可断点续跑）")
+    parser.add_argument("--model", default=None, help="模型名称，默认 DEFAULT_MODEL")
+    parser.add_argument("--batch-size", type=int, default=8, help="每批最多条目数")
+    parser.add_argument("--max-batch-tokens", type=int, default=16384, help="每批填充后的 prompt token 总数上限")
+    parser.add_argument("--window", type=int, default=512, help="按长度排序的窗口大小（条）")
+    parser.add_argument("--max-new-tokens", type=int, default=2048, help="默认最大生成 token 数")
+    parser.add_argument("--keep-thinking", action="store_true", help="输出中保留思考内容")
+    args = parser.parse_args()
+
+    stats = run(
+        args.input,
+        args.output,
+        model_name=args.model,
+        batch_size=args.batch_size,
+        max_batch_tokens=args.max_batch_tokens,
+        window=args.window,
+        max_new_tokens=args.max_new_tokens,
+        keep_thinking=args.keep_thinking,
+    )
+    print()
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+"""
+生成取消控制
+把"客户端已断开"等取消信号接入 transformers 的 StoppingCriteria，
+使 model.generate 在下一个解码步提前结束并返回已生成的部分
+
+该模块会导入 transformers，只应在真正推理时延迟导入
+"""
+from typing import Callable, List, Optional
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+
+# 取消检查函数：返回 True 表示应停止生成
+CancelCheck = Callable[[], bool]
+
+
+class CancellationCriteria(StoppingCriteria):
+    """
+    按批次中每一行独立判断是否取消
+
+    返回与批次大小相同的布尔张量，被取消的行视为已结束，不影响同批次的其他行
+    """
+
+    def __init__(self, checks: List[Optional[CancelCheck]]):
+        self.checks = checks
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        flags = [bool(check and check()) for check in self.checks]
+        return torch.tensor(flags, dtype=torch.bool, device=input_ids.device)
+
+
+def build_stopping_criteria(checks: List[Optional[CancelCheck]]) -> Optional[StoppingCriteriaList]:
+    """没有任何取消检查时返回 None，保持原有的生成路径"""
+    if not any(checks):
+        return None
+    return StoppingCriteriaList([CancellationCriteria(checks)])
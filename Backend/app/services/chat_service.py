@@ -3,11 +3,113 @@
 使用 PyMongo Async API
 """
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Dict, Tuple
+from pymongo import UpdateOne
 from pymongo.asynchronous.database import AsyncDatabase
 from bson import ObjectId
 
+from app.core.config import settings
+from app.core.http_cache import timestamp_ms
 from app.models.chat import conversation_helper
+from app.services.archive_service import archive_conversations, restore_conversation
+from app.services.summary_service import summary_context_message
+
+# 批量操作中单项结果：(是否成功, 说明)
+BulkResult = Dict[str, Tuple[bool, Optional[str]]]
+
+# 生成被取消且没有可保存内容时写入的提示
+CANCELLED_MESSAGE = "（回复生成已取消）"
+
+# 消息总数由数据库计算，不需要传输消息本身（归档存根中记录了原消息数量）
+MESSAGE_COUNT_EXPR = {
+    "$cond": [
+        {"$eq": ["$archived", True]},
+        "$message_count",
+        {"$size": {"$ifNull": ["$messages", []]}},
+    ]
+}
+
+# 会话列表：只读取元数据
+LIST_PROJECTION = {
+    "user_id": 1,
+    "title": 1,
+    "created_at": 1,
+    "updated_at": 1,
+    "message_count": MESSAGE_COUNT_EXPR,
+}
+
+
+# 会话详情：消息上的 prompt 片段缓存只在服务端构建上下文时使用，不需要读取
+DETAIL_PROJECTION = {
+    "messages.segment_ids": 0,
+    "messages.segment_key": 0,
+}
+
+
+def context_projection(max_messages: Optional[int] = None) -> dict:
+    """
+    构建对话上下文所需的字段：最近 max_messages 条消息、消息总数与滚动摘要
+    
+    Args:
+        max_messages: 读取的消息数量，默认取配置
+    """
+    return {
+        "user_id": 1,
+        "title": 1,
+        "created_at": 1,
+        "updated_at": 1,
+        "summary": 1,
+        "summary_until": 1,
+        "summary_source_tokens": 1,
+        "summary_tokens": 1,
+        "messages": {"$slice": -(max_messages or settings.CONTEXT_MAX_MESSAGES)},
+        "message_count": MESSAGE_COUNT_EXPR,
+    }
+
+
+async def get_latest_update(db: AsyncDatabase, user_id: str) -> int:
+    """
+    用户会话中最近一次更新时间（毫秒），没有会话时为 0
+    
+    与会话列表使用同一个 (user_id, updated_at) 索引，只读取索引中的一条记录
+    """
+    latest = await db.conversations.find_one(
+        {"user_id": user_id}, {"_id": 0, "updated_at": 1}, sort=[("updated_at", -1)]
+    )
+    return timestamp_ms(latest.get("updated_at")) if latest else 0
+
+
+def conversation_version(conversation: dict) -> Tuple[int, int]:
+    """
+    会话详情的版本：(updated_at 毫秒数, 消息数量)
+    
+    消息数量一并参与比较，避免同一毫秒内连续写入两条消息时版本不变
+    """
+    count = conversation.get("message_count")
+    if count is None:
+        count = len(conversation.get("messages", []))
+    return timestamp_ms(conversation.get("updated_at")), count
+
+
+async def get_conversation_version(
+    db: AsyncDatabase,
+    conversation_id: str,
+    user_id: str
+) -> Optional[Tuple[int, int]]:
+    """
+    只按主键读取版本字段（不传输消息），用于条件请求
+    
+    Returns:
+        conversation_version 的结果，不存在或不属于该用户则返回 None
+    """
+    try:
+        conversation = await db.conversations.find_one(
+            {"_id": ObjectId(conversation_id), "user_id": user_id},
+            {"_id": 0, "updated_at": 1, "message_count": MESSAGE_COUNT_EXPR}
+        )
+    except Exception:
+        return None
+    return conversation_version(conversation) if conversation else None
 
 
 async def create_conversation(
@@ -44,7 +146,8 @@ async def create_conversation(
 async def get_conversation_by_id(
     db: AsyncDatabase,
     conversation_id: str,
-    user_id: str
+    user_id: str,
+    projection: Optional[dict] = None
 ) -> Optional[dict]:
     """
     根据ID获取会话（需验证用户归属）
@@ -53,20 +156,50 @@ async def get_conversation_by_id(
         db: MongoDB 数据库实例
         conversation_id: 会话ID
         user_id: 用户ID（验证归属）
+        projection: 只读取的字段（如 context_projection()），默认读取整个文档
     
     Returns:
         会话字典，不存在或不属于该用户则返回 None
     """
+    conversation = await find_conversation_document(db, conversation_id, user_id, projection)
+    if conversation:
+        return conversation_helper(conversation)
+    return None
+
+
+async def find_conversation_document(
+    db: AsyncDatabase,
+    conversation_id: str,
+    user_id: str,
+    projection: Optional[dict] = None
+) -> Optional[dict]:
+    """
+    根据ID获取原始会话文档（需验证用户归属）
+    
+    不经过 conversation_helper 转换，供需要直接处理 BSON 文档的快速路径使用
+    
+    Args:
+        db: MongoDB 数据库实例
+        conversation_id: 会话ID
+        user_id: 用户ID（验证归属）
+        projection: 只读取的字段，默认读取整个文档
+    
+    Returns:
+        MongoDB 原始文档，不存在或不属于该用户则返回 None
+    """
     try:
-        conversation = await db.conversations.find_one({
-            "_id": ObjectId(conversation_id),
-            "user_id": user_id
-        })
-        if conversation:
-            return conversation_helper(conversation)
+        query = {"_id": ObjectId(conversation_id), "user_id": user_id}
+        if projection is not None and any(value != 0 for value in projection.values()):
+            # 包含式投影需要带上 archived 以判断是否为归档存根
+            projection = {**projection, "archived": 1}
+        conversation = await db.conversations.find_one(query, projection)
+        # 已归档的会话只剩存根，透明地恢复到热集合后重新读取
+        if conversation and conversation.get("archived"):
+            await restore_conversation(db, conversation["_id"])
+            conversation = await db.conversations.find_one(query, projection)
+        return conversation
     except:
-        pass
-    return None
+        return None
 
 
 async def get_user_conversations(
@@ -88,17 +221,10 @@ async def get_user_conversations(
         会话列表
     """
     cursor = db.conversations.find(
-        {"user_id": user_id}
+        {"user_id": user_id}, LIST_PROJECTION
     ).sort("updated_at", -1).skip(skip).limit(limit)
     
-    conversations = []
-    async for conv in cursor:
-        conv_dict = conversation_helper(conv)
-        # 添加消息数量
-        conv_dict["message_count"] = len(conv.get("messages", []))
-        conversations.append(conv_dict)
-    
-    return conversations
+    return [conversation_helper(conv) async for conv in cursor]
 
 
 async def count_user_conversations(db: AsyncDatabase, user_id: str) -> int:
@@ -111,7 +237,8 @@ async def add_message_to_conversation(
     conversation_id: str,
     user_id: str,
     role: str,
-    content: str
+    content: str,
+    extra: Optional[dict] = None
 ) -> bool:
     """
     向会话添加消息
@@ -122,6 +249,7 @@ async def add_message_to_conversation(
         user_id: 用户ID（验证归属）
         role: 消息角色 (user/assistant/system)
         content: 消息内容
+        extra: 附加字段（如 status）
     
     Returns:
         是否添加成功
@@ -130,7 +258,8 @@ async def add_message_to_conversation(
         message = {
             "role": role,
             "content": content,
-            "created_at": datetime.utcnow()
+            "created_at": datetime.utcnow(),
+            **(extra or {})
         }
         
         result = await db.conversations.update_one(
@@ -144,11 +273,48 @@ async def add_message_to_conversation(
             }
         )
         
-        return result.modified_count > 0
+        if result.modified_count == 0:
+            return False
+        return True
     except:
         return False
 
 
+async def save_assistant_reply(
+    db: AsyncDatabase,
+    conversation_id: str,
+    user_id: str,
+    content: str,
+    cancelled: bool = False,
+    extra: Optional[dict] = None
+) -> Optional[str]:
+    """
+    保存 AI 回复，被取消的回复按 CANCELLED_MESSAGE_POLICY 处理
+    
+    Args:
+        db: MongoDB 数据库实例
+        conversation_id: 会话ID
+        user_id: 用户ID
+        content: 回复内容
+        cancelled: 生成是否被取消
+        extra: 随消息保存的附加字段（如 degraded）
+    
+    Returns:
+        实际保存的内容，不保存（discard）时返回 None
+    """
+    if not cancelled:
+        await add_message_to_conversation(db, conversation_id, user_id, "assistant", content, extra)
+        return content
+    if settings.CANCELLED_MESSAGE_POLICY == "discard":
+        return None
+    if settings.CANCELLED_MESSAGE_POLICY == "marker" or not content:
+        content = CANCELLED_MESSAGE
+    await add_message_to_conversation(
+        db, conversation_id, user_id, "assistant", content, {**(extra or {}), "status": "cancelled"}
+    )
+    return content
+
+
 async def update_conversation_title(
     db: AsyncDatabase,
     conversation_id: str,
@@ -180,7 +346,9 @@ async def update_conversation_title(
                 }
             }
         )
-        return result.modified_count > 0
+        if result.modified_count == 0:
+            return False
+        return True
     except:
         return False
 
@@ -206,24 +374,194 @@ async def delete_conversation(
             "_id": ObjectId(conversation_id),
             "user_id": user_id
         })
-        return result.deleted_count > 0
+        if result.deleted_count > 0:
+            # 同时清理可能存在的归档数据
+            await db.conversation_archives.delete_one({"_id": ObjectId(conversation_id)})
+            return True
+        return False
     except:
         return False
 
 
-def get_conversation_context(conversation: dict, max_messages: int = 10) -> List[dict]:
+async def _resolve_owned_ids(
+    db: AsyncDatabase,
+    conversation_ids: List[str],
+    user_id: str
+) -> Tuple[Dict[str, ObjectId], BulkResult]:
+    """
+    校验一批会话ID的合法性和归属（一次查询）
+    
+    Args:
+        db: MongoDB 数据库实例
+        conversation_ids: 会话ID列表
+        user_id: 用户ID（验证归属）
+    
+    Returns:
+        (属于该用户的 ID -> ObjectId 映射, 校验失败项的结果)
+    """
+    results: BulkResult = {}
+    candidates: Dict[str, ObjectId] = {}
+    for cid in dict.fromkeys(conversation_ids):  # 去重并保持顺序
+        if ObjectId.is_valid(cid):
+            candidates[cid] = ObjectId(cid)
+        else:
+            results[cid] = (False, "无效的会话ID")
+    
+    owned = set()
+    if candidates:
+        cursor = db.conversations.find(
+            {"_id": {"$in": list(candidates.values())}, "user_id": user_id},
+            {"_id": 1}
+        )
+        owned = {doc["_id"] async for doc in cursor}
+    
+    owned_ids = {}
+    for cid, oid in candidates.items():
+        if oid in owned:
+            owned_ids[cid] = oid
+        else:
+            results[cid] = (False, "会话不存在或无权访问")
+    return owned_ids, results
+
+
+async def bulk_delete_conversations(
+    db: AsyncDatabase,
+    conversation_ids: List[str],
+    user_id: str
+) -> BulkResult:
+    """
+    批量删除会话（一次 delete_many）
+    
+    Args:
+        db: MongoDB 数据库实例
+        conversation_ids: 会话ID列表
+        user_id: 用户ID（验证归属）
+    
+    Returns:
+        每个会话ID的处理结果
+    """
+    owned_ids, results = await _resolve_owned_ids(db, conversation_ids, user_id)
+    if owned_ids:
+        object_ids = list(owned_ids.values())
+        await db.conversations.delete_many({"_id": {"$in": object_ids}, "user_id": user_id})
+        await db.conversation_archives.delete_many({"_id": {"$in": object_ids}})
+        for cid in owned_ids:
+            results[cid] = (True, None)
+    return results
+
+
+async def bulk_update_conversation_titles(
+    db: AsyncDatabase,
+    titles: Dict[str, str],
+    user_id: str
+) -> BulkResult:
+    """
+    批量更新会话标题（一次 bulk_write）
+    
+    Args:
+        db: MongoDB 数据库实例
+        titles: 会话ID -> 新标题
+        user_id: 用户ID（验证归属）
+    
+    Returns:
+        每个会话ID的处理结果
+    """
+    owned_ids, results = await _resolve_owned_ids(db, list(titles), user_id)
+    if owned_ids:
+        now = datetime.utcnow()
+        await db.conversations.bulk_write([
+            UpdateOne(
+                {"_id": oid, "user_id": user_id},
+                {"$set": {"title": titles[cid], "updated_at": now}}
+            )
+            for cid, oid in owned_ids.items()
+        ], ordered=False)
+        for cid in owned_ids:
+            results[cid] = (True, None)
+    return results
+
+
+async def bulk_archive_conversations(
+    db: AsyncDatabase,
+    conversation_ids: List[str],
+    user_id: str
+) -> BulkResult:
+    """
+    批量归档会话到冷存储
+    
+    Args:
+        db: MongoDB 数据库实例
+        conversation_ids: 会话ID列表
+        user_id: 用户ID（验证归属）
+    
+    Returns:
+        每个会话ID的处理结果
+    """
+    owned_ids, results = await _resolve_owned_ids(db, conversation_ids, user_id)
+    if not owned_ids:
+        return results
+    
+    cursor = db.conversations.find({
+        "_id": {"$in": list(owned_ids.values())},
+        "user_id": user_id,
+        "archived": {"$ne": True}
+    })
+    conversations = await cursor.to_list()
+    pending = {conv["_id"] for conv in conversations}
+    archived = await archive_conversations(db, conversations)
+    
+    for cid, oid in owned_ids.items():
+        if oid not in pending:
+            results[cid] = (True, "会话已归档")
+        elif oid in archived:
+            results[cid] = (True, None)
+        else:
+            results[cid] = (False, "会话在归档期间被修改，请重试")
+    return results
+
+
+async def delete_all_user_conversations(db: AsyncDatabase, user_id: str) -> int:
+    """
+    删除用户的全部会话（包括冷存储中的归档）
+    
+    Args:
+        db: MongoDB 数据库实例
+        user_id: 用户ID
+    
+    Returns:
+        删除的会话数量
+    """
+    result = await db.conversations.delete_many({"user_id": user_id})
+    await db.conversation_archives.delete_many({"user_id": user_id})
+    return result.deleted_count
+
+
+def get_conversation_context(conversation: dict, max_messages: Optional[int] = None) -> List[dict]:
     """
     获取会话的上下文消息（用于发送给AI）
     
+    开启记忆模式且会话已有摘要时，以一条系统消息携带摘要放在最前面
+    
     Args:
         conversation: 会话字典
-        max_messages: 最大消息数量
+        max_messages: 最大消息数量，默认取配置
     
     Returns:
-        消息列表（只包含 role 和 content）
+        消息列表（role 和 content，以及可能持久化的 token id 片段）
     """
+    max_messages = max_messages or settings.CONTEXT_MAX_MESSAGES
     messages = conversation.get("messages", [])
     # 获取最近的消息作为上下文
     recent_messages = messages[-max_messages:] if len(messages) > max_messages else messages
     
-    return [{"role": msg["role"], "content": msg["content"]} for msg in recent_messages]
+    context = []
+    for msg in recent_messages:
+        item = {"role": msg["role"], "content": msg["content"]}
+        # 持久化的 token id 片段，构建 prompt 时直接复用（见 prompt_cache）
+        if "segment_ids" in msg:
+            item["segment_key"] = msg.get("segment_key")
+            item["segment_ids"] = msg["segment_ids"]
+        context.append(item)
+    if settings.CONTEXT_SUMMARY_ENABLED and conversation.get("summary"):
+        context.insert(0, summary_context_message(conversation["summary"]))
+    return context
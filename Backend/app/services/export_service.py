@@ -0,0 +1,161 @@
+"""
+聊天记录导出服务
+直接从 MongoDB 游标分批读取并逐条编码，保证导出时服务端内存占用平稳
+"""
+import json
+import zlib
+from datetime import datetime
+from typing import AsyncIterator, List, Optional
+from pymongo.asynchronous.database import AsyncDatabase
+from bson import ObjectId
+
+from app.core.config import settings
+from app.services.archive_service import load_archived_messages
+
+# 导出格式 -> (媒体类型, 文件扩展名)
+EXPORT_FORMATS = {
+    "jsonl": ("application/x-ndjson", "jsonl"),
+    "markdown": ("text/markdown; charset=utf-8", "md"),
+}
+
+# Markdown 中各角色的显示名称
+ROLE_NAMES = {
+    "user": "用户",
+    "assistant": "AI 助手",
+    "system": "系统",
+}
+
+
+def _format_datetime(value: Optional[datetime]) -> Optional[str]:
+    """将 datetime 转换为 ISO 格式字符串"""
+    return value.isoformat() if value else None
+
+
+def conversation_to_jsonl(conversation: dict) -> str:
+    """
+    将单个会话文档编码为一行 JSON（NDJSON）
+
+    Args:
+        conversation: MongoDB 会话文档
+
+    Returns:
+        以换行结尾的 JSON 字符串
+    """
+    record = {
+        "id": str(conversation["_id"]),
+        "title": conversation.get("title", "新对话"),
+        "created_at": _format_datetime(conversation.get("created_at")),
+        "updated_at": _format_datetime(conversation.get("updated_at")),
+        "messages": [
+            {
+                "role": msg["role"],
+                "content": msg["content"],
+                "created_at": _format_datetime(msg.get("created_at")),
+            }
+            for msg in conversation.get("messages", [])
+        ],
+    }
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def conversation_to_markdown(conversation: dict) -> str:
+    """
+    将单个会话文档编码为 Markdown 片段
+
+    Args:
+        conversation: MongoDB 会话文档
+
+    Returns:
+        Markdown 文本
+    """
+    lines = [
+        f"# {conversation.get('title', '新对话')}",
+        "",
+        f"- 会话ID: {conversation['_id']}",
+        f"- 创建时间: {_format_datetime(conversation.get('created_at'))}",
+        f"- 更新时间: {_format_datetime(conversation.get('updated_at'))}",
+        "",
+    ]
+    for msg in conversation.get("messages", []):
+        role = ROLE_NAMES.get(msg["role"], msg["role"])
+        created_at = _format_datetime(msg.get("created_at")) or ""
+        lines.append(f"## {role} {created_at}".rstrip())
+        lines.append("")
+        lines.append(msg["content"])
+        lines.append("")
+    lines.append("---")
+    lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+async def iter_user_conversations(
+    db: AsyncDatabase,
+    user_id: str,
+    conversation_ids: Optional[List[str]] = None,
+    batch_size: Optional[int] = None
+) -> AsyncIterator[dict]:
+    """
+    分批遍历用户的会话文档
+
+    Args:
+        db: MongoDB 数据库实例
+        user_id: 用户ID（验证归属）
+        conversation_ids: 指定导出的会话ID列表，不传则导出全部
+        batch_size: 每批从服务器拉取的文档数量
+
+    Yields:
+        MongoDB 会话文档
+    """
+    query = {"user_id": user_id}
+    if conversation_ids:
+        # 非法的 ID 直接忽略，与单条查询的行为保持一致
+        query["_id"] = {
+            "$in": [ObjectId(cid) for cid in conversation_ids if ObjectId.is_valid(cid)]
+        }
+
+    cursor = db.conversations.find(query).sort("updated_at", -1).batch_size(
+        batch_size or settings.EXPORT_BATCH_SIZE
+    )
+    async for conversation in cursor:
+        # 归档会话直接从冷存储解压消息，不回写热集合
+        if conversation.get("archived"):
+            conversation["messages"] = await load_archived_messages(db, conversation["_id"])
+        yield conversation
+
+
+async def stream_conversation_export(
+    db: AsyncDatabase,
+    user_id: str,
+    export_format: str = "jsonl",
+    conversation_ids: Optional[List[str]] = None,
+    compress: bool = False
+) -> AsyncIterator[bytes]:
+    """
+    流式导出用户的聊天记录
+
+    每次只在内存中保留一个会话文档，按块输出编码后的字节；
+    开启压缩时使用 zlib 增量压缩为 gzip 格式
+
+    Args:
+        db: MongoDB 数据库实例
+        user_id: 用户ID
+        export_format: 导出格式 (jsonl/markdown)
+        conversation_ids: 指定导出的会话ID列表
+        compress: 是否进行 gzip 压缩
+
+    Yields:
+        导出内容的字节块
+    """
+    encode = conversation_to_jsonl if export_format == "jsonl" else conversation_to_markdown
+    # wbits=31 表示输出带 gzip 头的压缩流
+    compressor = zlib.compressobj(settings.EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+
+    async for conversation in iter_user_conversations(db, user_id, conversation_ids):
+        chunk = encode(conversation).encode("utf-8")
+        if compressor:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+
+    if compressor:
+        yield compressor.flush()
@@ -0,0 +1,173 @@
+"""
+请求幂等服务
+客户端或代理重试同一请求时携带相同的 Idempotency-Key，只执行一次：
+
+- 原请求仍在进行：同一进程内直接等待同一个任务；其他 worker 进程轮询等待结果
+- 原请求已完成：返回保存的响应（保留 IDEMPOTENCY_TTL_SECONDS，由 purge_at 上的 TTL 索引清理）
+- 原请求失败：删除记录，重试会重新执行
+
+记录以 "<用户ID>:<幂等键>" 为 _id 保存在 idempotency_keys 集合中，
+插入 pending 记录即为抢占执行权，_id 唯一保证多个 worker 之间只有一个执行
+
+执行期间定期更新 pending 记录的 heartbeat_at（并推迟 purge_at），生成再久也不会被 TTL 删除；
+超过 IDEMPOTENCY_PENDING_TTL_SECONDS 没有心跳的 pending 记录视为执行者已崩溃，由重试接管
+"""
+import asyncio
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Tuple
+
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.errors import DuplicateKeyError
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+# 本进程内正在执行的请求：记录ID -> (请求指纹, 任务)
+_inflight: Dict[str, Tuple[str, asyncio.Task]] = {}
+
+
+class IdempotencyConflict(Exception):
+    """同一个幂等键被用于内容不同的请求"""
+
+    def __init__(self):
+        super().__init__("Idempotency-Key 已被用于内容不同的请求")
+
+
+def request_fingerprint(payload: dict) -> str:
+    """计算请求内容的指纹，用于识别幂等键被误用于不同的请求"""
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def run_idempotent(
+    db: AsyncDatabase,
+    user_id: str,
+    key: str,
+    fingerprint: str,
+    handler: Callable[[], Awaitable[dict]]
+) -> Tuple[dict, bool]:
+    """
+    以幂等方式执行请求
+
+    Args:
+        db: MongoDB 数据库实例
+        user_id: 用户ID（幂等键按用户隔离）
+        key: 幂等键
+        fingerprint: 请求内容指纹
+        handler: 实际执行请求的协程函数，返回可存入 MongoDB 的响应字典
+
+    Returns:
+        (响应, 是否为重放的结果)
+
+    Raises:
+        IdempotencyConflict: 幂等键已用于不同的请求
+    """
+    doc_id = f"{user_id}:{key}"
+    while True:
+        inflight = _inflight.get(doc_id)
+        if inflight is not None:
+            if inflight[0] != fingerprint:
+                raise IdempotencyConflict()
+            metrics.inc("idempotency_attached_total")
+            return await asyncio.shield(inflight[1]), True
+
+        record = await db.idempotency_keys.find_one({"_id": doc_id})
+        if record is not None:
+            if record["fingerprint"] != fingerprint:
+                raise IdempotencyConflict()
+            if record["status"] == "completed":
+                metrics.inc("idempotency_replayed_total")
+                return record["response"], True
+            if not _is_stale(record):
+                # 其他 worker 正在执行
+                await asyncio.sleep(settings.IDEMPOTENCY_POLL_INTERVAL)
+                continue
+            # 执行者已退出而没有清理（进程崩溃），放弃这条记录（期间有新的心跳则不删除）
+            await db.idempotency_keys.delete_one(
+                {"_id": doc_id, "status": "pending", "heartbeat_at": record.get("heartbeat_at")}
+            )
+            metrics.inc("idempotency_stale_takeovers_total")
+            continue
+
+        now = datetime.utcnow()
+        try:
+            await db.idempotency_keys.insert_one({
+                "_id": doc_id,
+                "status": "pending",
+                "fingerprint": fingerprint,
+                "created_at": now,
+                "heartbeat_at": now,
+                "purge_at": now + timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS),
+            })
+        except DuplicateKeyError:
+            continue
+        break
+
+    # 在独立的任务中执行，原请求断开（协程被取消）时不影响等待同一结果的重试
+    task = asyncio.ensure_future(_execute(db, doc_id, fingerprint, handler))
+    _inflight[doc_id] = (fingerprint, task)
+    return await asyncio.shield(task), False
+
+
+def _is_stale(record: dict) -> bool:
+    """pending 记录超过 IDEMPOTENCY_PENDING_TTL_SECONDS 没有心跳"""
+    last_seen = record.get("heartbeat_at") or record["created_at"]
+    return datetime.utcnow() - last_seen > timedelta(seconds=settings.IDEMPOTENCY_PENDING_TTL_SECONDS)
+
+
+async def _heartbeat(db: AsyncDatabase, doc_id: str):
+    """执行期间定期更新心跳，并推迟 TTL 清理时间"""
+    interval = settings.IDEMPOTENCY_PENDING_TTL_SECONDS / 4
+    while True:
+        await asyncio.sleep(interval)
+        now = datetime.utcnow()
+        try:
+            await db.idempotency_keys.update_one(
+                {"_id": doc_id, "status": "pending"},
+                {"$set": {
+                    "heartbeat_at": now,
+                    "purge_at": now + timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS),
+                }}
+            )
+        except Exception as e:
+            print(f"幂等记录心跳更新失败: {e}")
+
+
+async def _execute(
+    db: AsyncDatabase,
+    doc_id: str,
+    fingerprint: str,
+    handler: Callable[[], Awaitable[dict]]
+) -> dict:
+    """执行请求并保存结果，失败时删除 pending 记录使重试可以重新执行"""
+    heartbeat = asyncio.ensure_future(_heartbeat(db, doc_id))
+    try:
+        try:
+            response = await handler()
+        finally:
+            heartbeat.cancel()
+        now = datetime.utcnow()
+        # upsert：即使 pending 记录已经不在（如被人工清理），响应也会保存下来
+        await db.idempotency_keys.update_one(
+            {"_id": doc_id},
+            {
+                "$set": {
+                    "status": "completed",
+                    "response": response,
+                    "purge_at": now + timedelta(seconds=settings.IDEMPOTENCY_TTL_SECONDS),
+                },
+                "$setOnInsert": {"fingerprint": fingerprint, "created_at": now},
+            },
+            upsert=True
+        )
+        return response
+    except BaseException:
+        try:
+            await db.idempotency_keys.delete_one({"_id": doc_id, "status": "pending"})
+        except Exception as e:
+            print(f"清理幂等记录失败: {e}")
+        raise
+    finally:
+        _inflight.pop(doc_id, None)
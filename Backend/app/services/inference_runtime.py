@@ -0,0 +1,163 @@
+"""
+CPU 推理运行时配置：intra-op / inter-op 线程数与核心绑定
+在进程第一次加载模型前调用 configure_inference_runtime()，每个进程只生效一次
+
+- 多个 worker 共用一台机器时，INFERENCE_THREADS=0 会按 INFERENCE_WORKERS 平均分配核心，避免超额订阅
+- INFERENCE_CPU_AFFINITY=auto 时每个 worker 绑定到一段连续的核心（按 worker 序号），
+  worker 序号取 INFERENCE_WORKER_INDEX，未配置时通过锁文件自动领取空闲序号
+- 最优配置可以用 benchmarks/tune_threads.py 扫描得到并写入 .env
+"""
+import os
+import tempfile
+import threading
+from typing import List, Optional
+
+from app.core.config import settings
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+_lock = threading.Lock()
+_applied: Optional[dict] = None
+# 持有 worker 序号的锁文件，进程退出时由操作系统释放
+_slot_file = None
+
+
+def parse_cpu_list(value: str) -> List[int]:
+    """解析核心列表，如 "0-7,16-23" -> [0, ..., 7, 16, ..., 23]"""
+    cpus: List[int] = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition("-")
+        cpus.extend(range(int(start), int(end or start) + 1))
+    return cpus
+
+
+def available_cpus() -> List[int]:
+    """当前进程允许使用的核心（容器 / taskset 限制后的结果）"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def claim_worker_index(workers: int) -> int:
+    """
+    领取一个空闲的 worker 序号（同一台机器上的进程之间互斥）
+
+    没有 fcntl（Windows）时退化为按进程号取模
+    """
+    global _slot_file
+    if settings.INFERENCE_WORKER_INDEX >= 0:
+        return settings.INFERENCE_WORKER_INDEX
+    if fcntl is None:
+        return os.getpid() % workers
+    for index in range(workers):
+        path = os.path.join(tempfile.gettempdir(), f"aifs-inference-worker-{index}.lock")
+        f = open(path, "w")
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            continue
+        _slot_file = f
+        return index
+    return os.getpid() % workers
+
+
+def plan_runtime(
+    threads: int = 0,
+    interop_threads: int = 0,
+    affinity: str = "",
+    workers: int = 1,
+    worker_index: int = 0,
+    cpus: Optional[List[int]] = None
+) -> dict:
+    """
+    计算当前 worker 的运行时配置（不修改进程状态）
+
+    Returns:
+        {"threads", "interop_threads", "cpus"}，值为 0 / None 表示沿用默认值
+    """
+    cpus = cpus if cpus is not None else available_cpus()
+    workers = max(workers, 1)
+    pinned: Optional[List[int]] = None
+    if affinity == "auto":
+        per_worker = max(len(cpus) // workers, 1)
+        start = (worker_index % workers) * per_worker
+        pinned = cpus[start:start + per_worker] or cpus
+    elif affinity:
+        pinned = parse_cpu_list(affinity)
+
+    if not threads:
+        if pinned is not None:
+            threads = len(pinned)
+        elif workers > 1:
+            threads = max(len(cpus) // workers, 1)
+    return {"threads": threads, "interop_threads": interop_threads, "cpus": pinned}
+
+
+def _pin_process(cpus: List[int]):
+    """把进程内已有的全部线程绑定到 cpus，之后创建的线程会继承绑定"""
+    task_dir = "/proc/self/task"
+    tids = [int(tid) for tid in os.listdir(task_dir)] if os.path.isdir(task_dir) else [0]
+    for tid in tids:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except OSError:
+            # 线程可能已经退出
+            continue
+
+
+def configure_inference_runtime() -> dict:
+    """
+    按配置设置 torch 线程数与核心绑定（每个进程只执行一次）
+
+    Returns:
+        实际生效的配置
+    """
+    global _applied
+    with _lock:
+        if _applied is not None:
+            return _applied
+        import torch
+
+        workers = max(settings.INFERENCE_WORKERS, 1)
+        worker_index = claim_worker_index(workers) if settings.INFERENCE_CPU_AFFINITY == "auto" else 0
+        plan = plan_runtime(
+            settings.INFERENCE_THREADS,
+            settings.INFERENCE_INTEROP_THREADS,
+            settings.INFERENCE_CPU_AFFINITY,
+            workers,
+            worker_index,
+        )
+
+        if plan["cpus"] is not None:
+            if hasattr(os, "sched_setaffinity"):
+                _pin_process(plan["cpus"])
+            else:
+                print("⚠️ 当前平台不支持核心绑定，已忽略 INFERENCE_CPU_AFFINITY")
+                plan["cpus"] = None
+        if plan["threads"]:
+            torch.set_num_threads(plan["threads"])
+        if plan["interop_threads"]:
+            try:
+                torch.set_num_interop_threads(plan["interop_threads"])
+            except RuntimeError as e:
+                # inter-op 线程池已经启动后不能再修改
+                print(f"⚠️ 无法设置 inter-op 线程数: {e}")
+
+        _applied = {
+            "worker_index": worker_index,
+            "threads": torch.get_num_threads(),
+            "interop_threads": torch.get_num_interop_threads(),
+            "cpus": plan["cpus"],
+        }
+        print(
+            f"🧵 推理线程: intra-op {_applied['threads']}，inter-op {_applied['interop_threads']}，"
+            f"核心 {_applied['cpus'] if _applied['cpus'] is not None else '不绑定'}"
+        )
+        return _applied
@@ -0,0 +1,179 @@
+"""
+自适应降级（load shedding）
+根据本进程中正在进行的生成数量和最近的生成速度（每 token 耗时的指数滑动平均），
+在压力大时逐级降低生成配置，让所有请求的延迟保持可控:
+
+- 1 级：关闭思考模式
+- 2 级：同时把 max_new_tokens 降到 LOAD_SHED_MAX_NEW_TOKENS
+- 3 级：同时把上下文缩短到最近 LOAD_SHED_CONTEXT_MESSAGES 条消息
+
+升级立即生效；降级（恢复）带滞后：指标低于阈值 × LOAD_SHED_RECOVERY_RATIO
+并持续 LOAD_SHED_RECOVERY_SECONDS 后才恢复一级，避免在阈值附近来回切换
+
+默认关闭（LOAD_SHED_ENABLED=False），阈值按部署环境确定:
+- 每 token 耗时从进入生成开始计时（包含排队与 prefill），先在无并发时观察
+  generation_ms_per_token_ewma 得到基线，LOAD_SHED_LATENCY_TIERS_MS 取基线的约 2 / 4 / 8 倍
+- 逐步增加并发，找到每 token 耗时开始明显上升时的进行中数量 N，
+  LOAD_SHED_QUEUE_TIERS 取 N / 2N / 4N
+- 默认值 [200, 400, 800] ms 与 [4, 8, 16] 对应基线约 100 ms/token、N=4 的部署
+"""
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+MAX_LEVEL = 3
+
+# 样本太少时（如很短的回复）每 token 耗时主要是 prefill，不计入
+MIN_SAMPLE_TOKENS = 8
+
+
+@dataclass
+class GenerationPlan:
+    """本次生成使用的配置"""
+    level: int
+    enable_thinking: bool = True
+    max_new_tokens: Optional[int] = None      # None 表示沿用默认值
+    context_messages: Optional[int] = None    # None 表示沿用 CONTEXT_MAX_MESSAGES
+
+    @property
+    def degraded(self) -> bool:
+        return self.level > 0
+
+    def generate_kwargs(self) -> dict:
+        """传给 generate_ai_reply / stream_ai_reply 的参数"""
+        kwargs = {"enable_thinking": self.enable_thinking}
+        if self.max_new_tokens is not None:
+            kwargs["max_new_tokens"] = self.max_new_tokens
+        return kwargs
+
+
+class GenerationSample:
+    """一次生成的统计，由调用方在生成结束后填写生成的 token 数"""
+
+    def __init__(self):
+        self.tokens = 0
+        self.started = time.perf_counter()   # 开始计入进行中的时间（作为排队等待的起点）
+
+
+class LoadShedder:
+    """降级控制器（线程安全，进程内单例）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.level = 0
+        self.in_flight = 0
+        self.latency_ms: Optional[float] = None   # 每 token 耗时的滑动平均（毫秒）
+        self._last_sample = 0.0
+        self._below_since: Optional[float] = None
+
+    def plan(self) -> GenerationPlan:
+        """按当前降级等级生成本次请求的配置"""
+        if not settings.LOAD_SHED_ENABLED:
+            return GenerationPlan(level=0)
+        with self._lock:
+            self._evaluate()
+            level = self.level
+        return GenerationPlan(
+            level=level,
+            enable_thinking=level < 1,
+            max_new_tokens=settings.LOAD_SHED_MAX_NEW_TOKENS if level >= 2 else None,
+            context_messages=settings.LOAD_SHED_CONTEXT_MESSAGES if level >= 3 else None,
+        )
+
+    @contextmanager
+    def track(self, plan: GenerationPlan) -> Iterator[GenerationSample]:
+        """统计一次生成：期间计入进行中的数量，结束后更新每 token 耗时"""
+        sample = GenerationSample()
+        with self._lock:
+            self.in_flight += 1
+            metrics.set("generation_in_flight", self.in_flight)
+            self._evaluate()
+        if plan.degraded:
+            metrics.inc("load_shed_degraded_responses_total", level=str(plan.level))
+        try:
+            yield sample
+        finally:
+            elapsed = time.perf_counter() - sample.started
+            with self._lock:
+                self.in_flight -= 1
+                metrics.set("generation_in_flight", self.in_flight)
+                if sample.tokens >= MIN_SAMPLE_TOKENS:
+                    self._record(elapsed * 1000 / sample.tokens)
+                self._evaluate()
+
+    def _record(self, ms_per_token: float):
+        alpha = settings.LOAD_SHED_EWMA_ALPHA
+        if self.latency_ms is None:
+            self.latency_ms = ms_per_token
+        else:
+            self.latency_ms = alpha * ms_per_token + (1 - alpha) * self.latency_ms
+        self._last_sample = time.monotonic()
+        metrics.set("generation_ms_per_token_ewma", round(self.latency_ms, 2))
+
+    def _target(self, scale: float) -> int:
+        """按阈值 × scale 计算应处的等级（取进行中数量与延迟两者中较高的）"""
+        level = 0
+        for i, threshold in enumerate(settings.LOAD_SHED_QUEUE_TIERS[:MAX_LEVEL]):
+            if self.in_flight >= threshold * scale:
+                level = max(level, i + 1)
+        if self.latency_ms is not None:
+            for i, threshold in enumerate(settings.LOAD_SHED_LATENCY_TIERS_MS[:MAX_LEVEL]):
+                if self.latency_ms >= threshold * scale:
+                    level = max(level, i + 1)
+        return level
+
+    def _evaluate(self):
+        """调整降级等级（调用方持有锁）"""
+        now = time.monotonic()
+        # 空闲一段时间后旧的延迟样本不再代表当前负载
+        if (
+            self.latency_ms is not None
+            and self.in_flight == 0
+            and now - self._last_sample > settings.LOAD_SHED_RECOVERY_SECONDS
+        ):
+            self.latency_ms = None
+
+        target = self._target(1.0)
+        if target > self.level:
+            self._set_level(target)
+            self._below_since = None
+            return
+        recover_to = self._target(settings.LOAD_SHED_RECOVERY_RATIO)
+        if self.level == 0 or recover_to >= self.level:
+            self._below_since = None
+            return
+        if self._below_since is None:
+            self._below_since = now
+            return
+        # 每持续一个观察周期恢复一级（空闲较久后再次评估时可以一次恢复多级）
+        periods = int((now - self._below_since) // settings.LOAD_SHED_RECOVERY_SECONDS)
+        if periods > 0:
+            self._set_level(max(self.level - periods, recover_to))
+            self._below_since = now
+
+    def _set_level(self, level: int):
+        direction = "up" if level > self.level else "down"
+        print(
+            f"{'⚠️' if direction == 'up' else '✅'} 生成降级等级 {self.level} -> {level}"
+            f"（进行中 {self.in_flight}，每 token {self.latency_ms or 0:.0f} ms）"
+        )
+        self.level = level
+        metrics.set("load_shed_level", level)
+        metrics.inc("load_shed_transitions_total", direction=direction)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "level": self.level,
+                "in_flight": self.in_flight,
+                "ms_per_token": round(self.latency_ms, 2) if self.latency_ms is not None else None,
+            }
+
+
+# 创建全局降级控制器
+load_shedder = LoadShedder()
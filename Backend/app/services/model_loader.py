@@ -0,0 +1,193 @@
+"""
+模型加载与本地权重缓存
+首次加载时把原始检查点按目标精度转换一次，保存为可内存映射的权重文件；
+之后的进程直接 mmap 权重，按需分页载入而不是解析并复制整个检查点，
+同一台机器上的多个进程还能共享操作系统页缓存中的权重
+
+预先转换（部署时执行一次，在 Backend 目录下）:
+    python -m app.services.model_loader
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Optional
+
+from app.core.config import settings
+
+# 缓存目录中的文件名
+WEIGHTS_FILE = "weights.pt"
+META_FILE = "cache_meta.json"
+
+# 缓存格式版本，格式变化时递增以使旧缓存失效
+CACHE_FORMAT_VERSION = 1
+
+
+def _resolve_dtype(dtype_name: str, config):
+    """把配置中的精度名称转换为 torch.dtype，auto 表示沿用检查点的精度"""
+    import torch
+
+    if dtype_name == "auto":
+        dtype = getattr(config, "torch_dtype", None)
+        if isinstance(dtype, str):
+            return getattr(torch, dtype)
+        return dtype or torch.float32
+    return getattr(torch, dtype_name)
+
+
+def _checkpoint_fingerprint(model_path: str, dtype_name: str) -> str:
+    """
+    计算检查点指纹：路径、文件大小与修改时间、目标精度、依赖版本
+    任何一项变化都会生成新的缓存目录
+    """
+    import torch
+    import transformers
+
+    entries = []
+    for root, _, files in os.walk(model_path):
+        for name in sorted(files):
+            stat = os.stat(os.path.join(root, name))
+            entries.append(f"{os.path.relpath(os.path.join(root, name), model_path)}:{stat.st_size}:{int(stat.st_mtime)}")
+    raw = "|".join([
+        os.path.abspath(model_path),
+        dtype_name,
+        torch.__version__,
+        transformers.__version__,
+        str(CACHE_FORMAT_VERSION),
+        *entries,
+    ])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def get_cache_dir(model_path: str, dtype_name: Optional[str] = None) -> str:
+    """获取检查点对应的缓存目录"""
+    dtype_name = dtype_name or settings.MODEL_DTYPE
+    name = os.path.basename(os.path.normpath(model_path))
+    key = _checkpoint_fingerprint(model_path, dtype_name)
+    return os.path.join(settings.MODEL_CACHE_DIR, f"{name}-{dtype_name}-{key}")
+
+
+def convert_checkpoint(model_path: str, dtype_name: Optional[str] = None) -> str:
+    """
+    把检查点转换为缓存格式（已存在则直接返回）
+
+    先写入临时目录再重命名，避免并发转换或中途失败留下不完整的缓存
+
+    Args:
+        model_path: 原始检查点路径
+        dtype_name: 目标精度（auto/float32/float16/bfloat16）
+
+    Returns:
+        缓存目录
+    """
+    import torch
+    from modelscope import AutoModelForCausalLM
+
+    dtype_name = dtype_name or settings.MODEL_DTYPE
+    cache_dir = get_cache_dir(model_path, dtype_name)
+    if os.path.exists(os.path.join(cache_dir, META_FILE)):
+        return cache_dir
+
+    print(f"🔧 正在转换模型检查点: {model_path} -> {cache_dir}")
+    start = time.perf_counter()
+    model = AutoModelForCausalLM.from_pretrained(model_path, dtype="auto")
+    dtype = _resolve_dtype(dtype_name, model.config)
+    model = model.to(dtype)
+
+    tmp_dir = f"{cache_dir}.tmp-{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    try:
+        model.config.save_pretrained(tmp_dir)
+        if model.generation_config is not None:
+            model.generation_config.save_pretrained(tmp_dir)
+        torch.save(model.state_dict(), os.path.join(tmp_dir, WEIGHTS_FILE))
+        with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "source": os.path.abspath(model_path),
+                "dtype": str(dtype),
+                "format_version": CACHE_FORMAT_VERSION,
+                "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }, f, ensure_ascii=False, indent=2)
+        try:
+            os.rename(tmp_dir, cache_dir)
+        except OSError:
+            # 其他进程已经完成了转换
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    print(f"✅ 模型检查点转换完成，耗时 {time.perf_counter() - start:.1f}s")
+    return cache_dir
+
+
+def load_cached_model(cache_dir: str):
+    """
+    从缓存目录加载模型
+
+    先在 meta 设备上创建不占内存的模型骨架，再把 mmap 方式打开的权重
+    直接赋给参数（assign=True），权重页在首次访问时才从磁盘载入
+
+    Args:
+        cache_dir: 缓存目录
+
+    Returns:
+        模型实例
+    """
+    import torch
+    from accelerate import init_empty_weights
+    from transformers import AutoConfig, AutoModelForCausalLM, GenerationConfig
+
+    config = AutoConfig.from_pretrained(cache_dir)
+    with init_empty_weights(include_buffers=False):
+        model = AutoModelForCausalLM.from_config(config)
+
+    state_dict = torch.load(
+        os.path.join(cache_dir, WEIGHTS_FILE),
+        mmap=True,
+        weights_only=True,
+        map_location="cpu",
+    )
+    model.load_state_dict(state_dict, assign=True)
+    model.tie_weights()
+    try:
+        model.generation_config = GenerationConfig.from_pretrained(cache_dir)
+    except OSError:
+        pass
+    model.eval()
+
+    if torch.cuda.is_available():
+        model = model.to("cuda")
+    return model
+
+
+def load_causal_lm(model_path: str):
+    """
+    加载因果语言模型
+
+    配置了 MODEL_CACHE_DIR 时走转换缓存 + mmap 路径，否则按原方式加载
+
+    Args:
+        model_path: 原始检查点路径
+
+    Returns:
+        模型实例
+    """
+    from app.services.inference_runtime import configure_inference_runtime
+
+    # 线程数与核心绑定需要在第一次推理前设置
+    configure_inference_runtime()
+    if not settings.MODEL_CACHE_DIR:
+        from modelscope import AutoModelForCausalLM
+        return AutoModelForCausalLM.from_pretrained(
+            model_path,
+            dtype=settings.MODEL_DTYPE,
+            device_map="auto"
+        )
+    return load_cached_model(convert_checkpoint(model_path))
+
+
+if __name__ == "__main__":
+    if not settings.MODEL_CACHE_DIR:
+        raise SystemExit("请先配置 MODEL_CACHE_DIR")
+    print(f"缓存目录: {convert_checkpoint(settings.MODEL_PATH)}")
@@ -0,0 +1,203 @@
+"""
+多模型注册表
+按名称管理多个模型（如不同的金融微调版本），首次使用时加载，
+在内存预算内按最近最少使用（LRU）顺序淘汰
+
+- 同一模型的并发首次请求只会触发一次加载，其余请求等待加载完成
+- 正在生成的请求通过租约（lease）持有模型，持有期间不会被淘汰
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Set
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+
+def get_model_paths() -> Dict[str, str]:
+    """可用模型：名称 -> 检查点路径（默认模型未单独配置时使用 MODEL_PATH）"""
+    paths = dict(settings.MODELS)
+    paths.setdefault(settings.DEFAULT_MODEL, settings.MODEL_PATH)
+    return paths
+
+
+def resolve_model_name(model_name: Optional[str] = None) -> str:
+    """
+    解析模型名称（可以是完整模型，也可以是 LoRA 适配器）
+
+    Raises:
+        ValueError: 模型未注册
+    """
+    name = model_name or settings.DEFAULT_MODEL
+    if name not in get_model_paths() and name not in settings.ADAPTERS:
+        raise ValueError(f"未注册的模型: {name}")
+    return name
+
+
+def get_base_model_name(model_name: Optional[str] = None) -> str:
+    """获取实际承载推理的完整模型名称（适配器返回其基座模型）"""
+    name = resolve_model_name(model_name)
+    if name in settings.ADAPTERS:
+        return settings.ADAPTER_BASE_MODEL or settings.DEFAULT_MODEL
+    return name
+
+
+def _estimate_checkpoint_bytes(model_path: str) -> int:
+    """根据检查点权重文件大小估算加载后的内存占用（加载前用于腾出空间）"""
+    total = 0
+    for root, _, files in os.walk(model_path):
+        for name in files:
+            if name.endswith((".safetensors", ".bin", ".pt", ".pth")):
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def _model_bytes(model) -> int:
+    """统计模型参数和缓冲区实际占用的字节数"""
+    tensors = list(model.parameters()) + list(model.buffers())
+    seen = set()
+    total = 0
+    for tensor in tensors:
+        # 共享权重（如 tie_word_embeddings）只计算一次
+        key = tensor.data_ptr()
+        if key in seen:
+            continue
+        seen.add(key)
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class _Entry:
+    """一个已加载的模型"""
+
+    def __init__(self, model, size_bytes: int):
+        self.model = model
+        self.size_bytes = size_bytes
+        self.refs = 0
+        self.last_used = time.time()
+
+
+class ModelRegistry:
+    """在内存预算内按 LRU 管理常驻模型"""
+
+    def __init__(self, budget_bytes: int = 0):
+        self.budget_bytes = budget_bytes  # 0 表示不限制
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._loading: Set[str] = set()
+        self._cond = threading.Condition()
+        self._evict_listeners: List[Callable[[str], None]] = []
+
+    def add_evict_listener(self, listener: Callable[[str], None]):
+        """注册模型被卸载时的回调（参数为模型名称）"""
+        self._evict_listeners.append(listener)
+
+    def _resident_bytes(self) -> int:
+        return sum(entry.size_bytes for entry in self._entries.values())
+
+    def _evict_for(self, incoming_bytes: int):
+        """淘汰最近最少使用且没有租约的模型，直到能容纳新模型（需持有锁）"""
+        if not self.budget_bytes:
+            return
+        for name in list(self._entries):
+            if self._resident_bytes() + incoming_bytes <= self.budget_bytes:
+                return
+            entry = self._entries[name]
+            if entry.refs == 0:
+                del self._entries[name]
+                for listener in self._evict_listeners:
+                    listener(name)
+                metrics.inc("model_evictions_total", model=name)
+                print(f"♻️ 已卸载模型: {name}")
+        if self._resident_bytes() + incoming_bytes > self.budget_bytes:
+            print("⚠️ 常驻模型均在使用中，本次加载将超出内存预算")
+
+    def _update_gauges(self):
+        metrics.set("model_resident_count", len(self._entries))
+        metrics.set("model_resident_bytes", self._resident_bytes())
+
+    def acquire(self, model_name: Optional[str] = None):
+        """
+        获取模型并增加引用计数（必要时加载）
+
+        Returns:
+            模型实例
+        """
+        from app.services.model_loader import load_causal_lm
+
+        name = get_base_model_name(model_name)
+        with self._cond:
+            while True:
+                entry = self._entries.get(name)
+                if entry is not None:
+                    entry.refs += 1
+                    entry.last_used = time.time()
+                    self._entries.move_to_end(name)
+                    return entry.model
+                if name not in self._loading:
+                    break
+                # 其他线程正在加载同一个模型，等待其完成（失败时由等待者重新加载）
+                self._cond.wait()
+
+            self._loading.add(name)
+            path = get_model_paths()[name]
+            self._evict_for(_estimate_checkpoint_bytes(path))
+
+        # 加载在锁外进行，不阻塞其他模型的请求
+        start = time.perf_counter()
+        try:
+            model = load_causal_lm(path)
+        except BaseException:
+            with self._cond:
+                self._loading.discard(name)
+                self._cond.notify_all()
+            raise
+        metrics.observe("model_load_seconds", time.perf_counter() - start, model=name)
+
+        with self._cond:
+            entry = _Entry(model, _model_bytes(model))
+            entry.refs = 1
+            self._evict_for(entry.size_bytes)
+            self._entries[name] = entry
+            self._loading.discard(name)
+            self._update_gauges()
+            self._cond.notify_all()
+        return model
+
+    def release(self, model_name: Optional[str] = None):
+        """释放租约，必要时按预算淘汰"""
+        name = get_base_model_name(model_name)
+        with self._cond:
+            entry = self._entries.get(name)
+            if entry is not None:
+                entry.refs -= 1
+            self._evict_for(0)
+            self._update_gauges()
+
+    @contextmanager
+    def lease(self, model_name: Optional[str] = None):
+        """在 with 块内持有模型，期间不会被淘汰"""
+        model = self.acquire(model_name)
+        try:
+            yield model
+        finally:
+            self.release(model_name)
+
+    def resident(self) -> List[dict]:
+        """当前常驻模型的状态"""
+        with self._cond:
+            return [
+                {
+                    "name": name,
+                    "size_mb": round(entry.size_bytes / 1024 / 1024, 1),
+                    "in_use": entry.refs,
+                    "last_used": entry.last_used,
+                }
+                for name, entry in self._entries.items()
+            ]
+
+
+# 创建全局模型注册表
+model_registry = ModelRegistry(settings.MODEL_MEMORY_BUDGET_MB * 1024 * 1024)
@@ -0,0 +1,280 @@
+"""
+本地模型服务进程
+由单独的进程加载并持有模型，多个 API worker 通过本地 IPC 提交生成任务，
+HTTP 并发与模型内存占用可以分别扩展
+
+启动模型服务（在 Backend 目录下）:
+    python -m app.services.model_server
+
+API worker 配置 INFERENCE_BACKEND=server 后即通过该服务推理
+
+连接使用 pickle 序列化，只能暴露给可信的 worker：使用默认 authkey 时只允许监听本机回环地址
+"""
+import ipaddress
+import threading
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Connection, Listener
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, List, Optional
+
+from app.core.config import settings
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - 可选依赖
+    np = None
+
+# 共享内存中数组的描述标记
+# token id 数组（prompt 与生成结果）经共享内存传递，消息中只有描述信息；
+# 小于 MODEL_SERVER_SHM_THRESHOLD 字节的数组随消息直接发送（默认 0，全部走共享内存）
+SHM_MARKER = "__shm__"
+
+# 配置中的默认 authkey，只允许在回环地址上使用
+DEFAULT_AUTHKEY = "change-me-model-server"
+
+
+# ==================== 数据传输 ====================
+
+def _pack_value(value: Any) -> Any:
+    """大于阈值的 numpy 数组放入共享内存，只传递描述信息"""
+    if np is None or not isinstance(value, np.ndarray) or value.nbytes < settings.MODEL_SERVER_SHM_THRESHOLD:
+        return value
+    shm = SharedMemory(create=True, size=value.nbytes)
+    np.ndarray(value.shape, dtype=value.dtype, buffer=shm.buf)[...] = value
+    descriptor = {SHM_MARKER: shm.name, "shape": value.shape, "dtype": value.dtype.str}
+    shm.close()
+    # 共享内存由接收方负责释放，发送方不再跟踪，避免退出时被提前回收
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return descriptor
+
+
+def _unpack_value(value: Any) -> Any:
+    """从共享内存中取回数组并释放共享内存"""
+    if not isinstance(value, dict) or SHM_MARKER not in value:
+        return value
+    shm = SharedMemory(name=value[SHM_MARKER])
+    try:
+        array = np.ndarray(value["shape"], dtype=np.dtype(value["dtype"]), buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return array
+
+
+def _as_array(ids: List[int]) -> Any:
+    """token id 列表转为 numpy 数组以走共享内存（未安装 numpy 时退化为随消息发送列表）"""
+    return np.asarray(ids, dtype=np.int64) if np is not None else ids
+
+
+def _as_list(ids: Any) -> List[int]:
+    """numpy 数组转回 token id 列表"""
+    return ids.tolist() if hasattr(ids, "tolist") else list(ids)
+
+
+def pack(payload: dict) -> dict:
+    """打包一条消息（只处理第一层的值）"""
+    return {key: _pack_value(value) for key, value in payload.items()}
+
+
+def unpack(payload: dict) -> dict:
+    """解包一条消息"""
+    return {key: _unpack_value(value) for key, value in payload.items()}
+
+
+# ==================== 服务端 ====================
+
+def _handle_request(request: dict, should_stop: Callable[[], bool]) -> dict:
+    """在模型服务进程内执行一次请求"""
+    from app.services import ai_service
+
+    op = request.get("op")
+    if op == "ping":
+        return {"ok": True}
+    if op == "generate_ids":
+        stop = ai_service.StopFlag(should_stop)
+        output_ids = ai_service.generate_ids_local(
+            _as_list(request["input_ids"]),
+            request.get("max_new_tokens", 32768),
+            request.get("model_name"),
+            stop
+        )
+        # 是否真的因取消而提前结束，由停止条件在生成过程中记录
+        return {"ok": True, "result": _as_array(output_ids), "cancelled": stop.fired}
+    return {"ok": False, "error": f"未知操作: {op}"}
+
+
+def _serve_connection(conn: Connection, slots: threading.Semaphore):
+    """处理单个 worker 连接上的所有请求"""
+    with conn:
+        while True:
+            try:
+                request = unpack(conn.recv())
+            except (EOFError, OSError):
+                return
+            if request.get("op") == "cancel":
+                # 取消消息到达时生成已经结束，直接忽略
+                continue
+            try:
+                with slots:
+                    # 客户端不会在一次请求未完成时发送新请求，生成期间收到的消息只可能是取消
+                    response = _handle_request(request, conn.poll)
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            try:
+                conn.send(pack(response))
+            except (EOFError, OSError):
+                return
+
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def check_listen_config(host: str, authkey: str):
+    """
+    检查监听配置：连接上的消息用 pickle 反序列化，能连上端口并通过认证即可执行任意代码
+
+    Raises:
+        RuntimeError: authkey 为空，或在非回环地址上使用默认 authkey
+    """
+    if not authkey:
+        raise RuntimeError("MODEL_SERVER_AUTHKEY 不能为空")
+    if authkey == DEFAULT_AUTHKEY and not _is_loopback(host):
+        raise RuntimeError(
+            f"模型服务监听 {host} 时必须修改默认的 MODEL_SERVER_AUTHKEY（默认值只允许用于回环地址）"
+        )
+
+
+def serve():
+    """启动模型服务，阻塞运行"""
+    from app.services import ai_service
+
+    check_listen_config(settings.MODEL_SERVER_HOST, settings.MODEL_SERVER_AUTHKEY)
+    # 先加载默认模型，worker 连接进来时即可直接推理；其他模型按需加载
+    ai_service.get_model()
+
+    address = (settings.MODEL_SERVER_HOST, settings.MODEL_SERVER_PORT)
+    slots = threading.Semaphore(settings.MODEL_SERVER_CONCURRENCY)
+    with Listener(address, authkey=settings.MODEL_SERVER_AUTHKEY.encode()) as listener:
+        print(f"🧠 模型服务已启动: {address[0]}:{address[1]}")
+        while True:
+            try:
+                conn = listener.accept()
+            except KeyboardInterrupt:
+                break
+            except Exception as e:
+                print(f"模型服务接受连接失败: {e}")
+                continue
+            threading.Thread(target=_serve_connection, args=(conn, slots), daemon=True).start()
+    print("👋 模型服务已关闭")
+
+
+# ==================== 客户端 ====================
+
+class ModelClient:
+    """
+    模型服务客户端
+    每个线程同一时间独占一条连接，空闲连接放回连接池复用
+    """
+
+    def __init__(self, host: str, port: int, authkey: str):
+        self._address = (host, port)
+        self._authkey = authkey.encode()
+        self._idle: List[Connection] = []
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> Connection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return Client(self._address, authkey=self._authkey)
+
+    def _release(self, conn: Connection):
+        with self._lock:
+            self._idle.append(conn)
+
+    def call(self, op: str, should_stop: Optional[Callable[[], bool]] = None, **kwargs) -> Any:
+        """
+        发送一次请求并等待结果
+
+        等待期间如果 should_stop 返回 True，向模型服务发送一次取消消息，
+        模型服务会提前结束生成并返回已生成的部分
+
+        Returns:
+            模型服务的响应
+
+        Raises:
+            RuntimeError: 模型服务返回错误
+        """
+        conn = self._acquire()
+        try:
+            conn.send(pack({"op": op, **kwargs}))
+            cancel_sent = False
+            while not conn.poll(settings.CANCEL_POLL_INTERVAL):
+                if should_stop and not cancel_sent and should_stop():
+                    conn.send({"op": "cancel"})
+                    cancel_sent = True
+            response = unpack(conn.recv())
+        except Exception:
+            # 连接状态未知，直接丢弃
+            conn.close()
+            raise
+        self._release(conn)
+        if not response.get("ok"):
+            raise RuntimeError(response.get("error", "模型服务错误"))
+        return response
+
+    def generate_ids(
+        self,
+        input_ids: List[int],
+        max_new_tokens: int = 32768,
+        model_name: Optional[str] = None,
+        should_stop: Optional[Callable[[], bool]] = None
+    ) -> List[int]:
+        """
+        远程生成（分词和解码在 worker 本地完成，模型服务只负责推理）
+
+        Args:
+            input_ids: prompt 的 token id 列表
+            max_new_tokens: 最大生成 token 数
+            model_name: 模型名称
+            should_stop: 取消检查函数
+
+        Returns:
+            新生成部分的 token id 列表
+        """
+        response = self.call(
+            "generate_ids",
+            should_stop=should_stop,
+            input_ids=_as_array(input_ids),
+            max_new_tokens=max_new_tokens,
+            model_name=model_name
+        )
+        if hasattr(should_stop, "fired"):
+            # 以模型服务中停止条件的结果为准（发出取消时生成可能已经自然结束）
+            should_stop.fired = bool(response.get("cancelled"))
+        return _as_list(response["result"])
+
+
+_client: Optional[ModelClient] = None
+
+
+def get_model_client() -> ModelClient:
+    """获取当前进程的模型服务客户端"""
+    global _client
+    if _client is None:
+        _client = ModelClient(
+            settings.MODEL_SERVER_HOST,
+            settings.MODEL_SERVER_PORT,
+            settings.MODEL_SERVER_AUTHKEY
+        )
+    return _client
+
+
+if __name__ == "__main__":
+    serve()
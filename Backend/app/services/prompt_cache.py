@@ -0,0 +1,220 @@
+"""
+增量 prompt 编码缓存
+对话模板把每条消息渲染为以特殊 token 分隔的独立片段，分词器先按特殊 token 切分再分词，
+因此每条消息的 token id 片段与上下文无关，可以缓存后直接拼接成完整的 prompt，
+每轮只需要为新消息分词，而不是重新渲染并分词全部上下文
+
+消息片段的文本通过对比模板渲染结果得到（插入锚点消息后取差），
+不依赖具体模板的格式；模板不满足"逐条消息独立渲染"时由校验发现并回退
+
+自检（在 Backend 目录下，使用 DEFAULT_MODEL 的分词器）:
+    python -m app.services.prompt_cache --cases 200
+"""
+import argparse
+import hashlib
+import random
+import sys
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+# 用于取差的锚点消息
+ANCHOR_MESSAGE = {"role": "user", "content": "."}
+
+
+class SegmentationError(Exception):
+    """模板渲染结果无法按消息切分"""
+
+
+class PromptEncoder:
+    """
+    基于消息片段缓存的 prompt 编码器
+
+    片段按 (角色, 内容, 是否为第一条消息, 是否启用思考) 缓存在进程内的 LRU 中；
+    消息上持久化的片段（segment_key 与当前分词器一致时）也可以直接使用
+    """
+
+    def __init__(self, tokenizer, max_entries: int):
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        template = getattr(tokenizer, "chat_template", None) or ""
+        raw = f"{tokenizer.name_or_path}|{len(tokenizer)}|{template}"
+        self.fingerprint = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+        # 校验发现与完整编码不一致后停用
+        self.disabled = False
+        self.verified = 0
+        self._segments: "OrderedDict[tuple, Tuple[int, ...]]" = OrderedDict()
+        self._suffixes = {}
+        self._anchor_texts = {}
+        self._lock = threading.Lock()
+
+    def segment_key(self, enable_thinking: bool) -> str:
+        """持久化片段的键：分词器与模板不变、思考模式相同时片段才能复用"""
+        return f"{self.fingerprint}-t{int(enable_thinking)}"
+
+    def _render(self, messages: List[dict], enable_thinking: bool, add_generation_prompt: bool = False) -> str:
+        return self.tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=add_generation_prompt,
+            enable_thinking=enable_thinking
+        )
+
+    def _tokenize(self, text: str) -> List[int]:
+        return self.tokenizer(text, add_special_tokens=False).input_ids
+
+    def _strip(self, text: str, prefix: str, suffix: str) -> str:
+        if not text.startswith(prefix) or not text.endswith(suffix) or len(text) < len(prefix) + len(suffix):
+            raise SegmentationError("对话模板的渲染结果无法按消息切分")
+        return text[len(prefix):len(text) - len(suffix)]
+
+    def _anchors(self, enable_thinking: bool) -> Tuple[str, str]:
+        """锚点消息单独渲染的文本，以及它跟在其他消息之后时的文本"""
+        if enable_thinking not in self._anchor_texts:
+            once = self._render([ANCHOR_MESSAGE], enable_thinking)
+            twice = self._render([ANCHOR_MESSAGE, ANCHOR_MESSAGE], enable_thinking)
+            self._anchor_texts[enable_thinking] = (once, self._strip(twice, once, ""))
+        return self._anchor_texts[enable_thinking]
+
+    def segment_text(self, message: dict, first: bool, enable_thinking: bool) -> str:
+        """
+        单条消息在 prompt 中的文本
+
+        消息后面总是跟一条锚点消息，避免被当作最后一条消息而按不同方式渲染（如思考块）
+        """
+        message = {"role": message["role"], "content": message["content"]}
+        anchor_once, anchor_suffix = self._anchors(enable_thinking)
+        if first:
+            return self._strip(self._render([message, ANCHOR_MESSAGE], enable_thinking), "", anchor_suffix)
+        rendered = self._render([ANCHOR_MESSAGE, message, ANCHOR_MESSAGE], enable_thinking)
+        return self._strip(rendered, anchor_once, anchor_suffix)
+
+    def segment_ids(self, message: dict, first: bool, enable_thinking: bool) -> Tuple[int, ...]:
+        """单条消息的 token id 片段（优先使用缓存）"""
+        if not first and message.get("segment_key") == self.segment_key(enable_thinking):
+            metrics.inc("prompt_cache_persisted_hits_total")
+            return tuple(message["segment_ids"])
+        key = (message["role"], message["content"], first, enable_thinking)
+        with self._lock:
+            ids = self._segments.get(key)
+            if ids is not None:
+                self._segments.move_to_end(key)
+                metrics.inc("prompt_cache_hits_total")
+                return ids
+        ids = tuple(self._tokenize(self.segment_text(message, first, enable_thinking)))
+        metrics.inc("prompt_cache_misses_total")
+        with self._lock:
+            self._segments[key] = ids
+            while len(self._segments) > self.max_entries:
+                self._segments.popitem(last=False)
+        return ids
+
+    def generation_suffix(self, enable_thinking: bool) -> Tuple[int, ...]:
+        """生成提示（如 <|im_start|>assistant\\n）的 token id"""
+        if enable_thinking not in self._suffixes:
+            base = self._render([ANCHOR_MESSAGE], enable_thinking)
+            text = self._strip(self._render([ANCHOR_MESSAGE], enable_thinking, add_generation_prompt=True), base, "")
+            self._suffixes[enable_thinking] = tuple(self._tokenize(text))
+        return self._suffixes[enable_thinking]
+
+    def encode(self, messages: List[dict], enable_thinking: bool = True) -> List[int]:
+        """拼接各消息的片段得到完整 prompt 的 token id"""
+        ids: List[int] = []
+        for i, message in enumerate(messages):
+            ids.extend(self.segment_ids(message, i == 0, enable_thinking))
+        ids.extend(self.generation_suffix(enable_thinking))
+        return ids
+
+    def reference(self, messages: List[dict], enable_thinking: bool = True) -> List[int]:
+        """按原方式整体渲染并分词，作为校验基准"""
+        text = self._render(
+            [{"role": m["role"], "content": m["content"]} for m in messages],
+            enable_thinking,
+            add_generation_prompt=True
+        )
+        return self.tokenizer([text]).input_ids[0]
+
+    def should_verify(self) -> bool:
+        """前 PROMPT_CACHE_VERIFY_FIRST 次总是校验，之后按 PROMPT_CACHE_VERIFY_RATE 抽样"""
+        return self.verified < settings.PROMPT_CACHE_VERIFY_FIRST or random.random() < settings.PROMPT_CACHE_VERIFY_RATE
+
+    def verify(self, messages: List[dict], enable_thinking: bool = True) -> Optional[List[int]]:
+        """
+        对比拼接结果与完整编码
+
+        Returns:
+            不一致时返回完整编码的结果（并停用缓存），一致时返回 None
+        """
+        self.verified += 1
+        expected = self.reference(messages, enable_thinking)
+        try:
+            if self.encode(messages, enable_thinking) == expected:
+                return None
+        except SegmentationError:
+            pass
+        self.disabled = True
+        metrics.inc("prompt_cache_mismatches_total")
+        metrics.set("prompt_cache_disabled", 1, tokenizer=self.fingerprint)
+        return expected
+
+
+# ==================== 自检 ====================
+
+_SAMPLE_TEXTS = [
+    "你好",
+    "请分析一下这家公司近三年的现金流。",
+    "ROE = 净利润 / 净资产\n\n- 2022: 12.5%\n- 2023: 13.1%",
+    "```python\nprint('hello')\n```",
+    "  前后有空格  ",
+    "\n以换行开头和结尾\n",
+    "emoji 📈📉 与全角符号：（）【】",
+    "English text with numbers 3.1415 and symbols <>&\"'",
+    "<think>\n思考内容\n</think>\n\n正式回答",
+]
+
+
+def _random_conversation(rng: random.Random) -> List[dict]:
+    messages = []
+    if rng.random() < 0.3:
+        messages.append({"role": "system", "content": rng.choice(_SAMPLE_TEXTS)})
+    for i in range(rng.randint(0, 8)):
+        role = "user" if i % 2 == 0 else "assistant"
+        text = "".join(rng.choice(_SAMPLE_TEXTS) for _ in range(rng.randint(1, 3)))
+        messages.append({"role": role, "content": text})
+    # 与实际调用一致：最后一条总是用户消息
+    if not messages or messages[-1]["role"] != "user":
+        messages.append({"role": "user", "content": rng.choice(_SAMPLE_TEXTS)})
+    return messages
+
+
+def main():
+    from app.services.ai_service import get_tokenizer
+
+    parser = argparse.ArgumentParser(description="prompt 片段缓存自检")
+    parser.add_argument("--model", default=None, help="模型名称，默认 DEFAULT_MODEL")
+    parser.add_argument("--cases", type=int, default=200, help="随机对话数量")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    encoder = PromptEncoder(get_tokenizer(args.model), settings.PROMPT_CACHE_MAX_ENTRIES)
+    rng = random.Random(args.seed)
+    failures = 0
+    for case in range(args.cases):
+        messages = _random_conversation(rng)
+        enable_thinking = rng.random() < 0.5
+        try:
+            ok = encoder.encode(messages, enable_thinking) == encoder.reference(messages, enable_thinking)
+        except SegmentationError:
+            ok = False
+        if not ok:
+            failures += 1
+            print(f"❌ 第 {case} 组不一致: {messages}")
+    print(f"{args.cases - failures}/{args.cases} 组与 apply_chat_template 完全一致")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""
+本地资料检索（RAG）服务
+把本地金融文档切块、用 CPU 嵌入模型编码后写入磁盘向量索引（见 vector_index），
+对话时先检索与用户问题最相关的片段，作为参考资料注入 prompt
+
+构建索引（在 Backend 目录下）:
+    python -m app.services.rag_service ingest <文档目录>
+    python -m app.services.rag_service query "<问题>"
+"""
+import os
+import sys
+import threading
+import time
+from typing import Iterator, List, Optional
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+# 支持的文档类型（纯文本）
+DOCUMENT_EXTENSIONS = (".txt", ".md")
+
+# 切块时优先在这些字符之后断开
+SENTENCE_ENDINGS = "。！？；!?;\n"
+
+_embedder = None
+_embedder_lock = threading.Lock()
+_index = None
+_index_mtime = None
+
+
+def chunk_text(text: str, size: Optional[int] = None, overlap: Optional[int] = None) -> List[str]:
+    """
+    把文本切成长度不超过 size 的块，相邻块重叠 overlap 个字符
+
+    块的结尾尽量落在句末标点上（不早于块长度的一半）
+    """
+    size = size or settings.RAG_CHUNK_SIZE
+    overlap = settings.RAG_CHUNK_OVERLAP if overlap is None else overlap
+    text = text.strip()
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            cut = max(text.rfind(c, start + size // 2, end) for c in SENTENCE_ENDINGS)
+            if cut != -1:
+                end = cut + 1
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def iter_document_chunks(corpus_dir: str) -> Iterator[dict]:
+    """遍历目录中的文档并逐个产出文本块元数据"""
+    for root, _, files in os.walk(corpus_dir):
+        for name in sorted(files):
+            if not name.lower().endswith(DOCUMENT_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                text = f.read()
+            source = os.path.relpath(path, corpus_dir)
+            for position, chunk in enumerate(chunk_text(text)):
+                yield {"text": chunk, "source": source, "position": position}
+
+
+class Embedder:
+    """CPU 上运行的句向量模型（如 bge-small-zh），取 [CLS] 或平均池化并归一化"""
+
+    def __init__(self, model_path: str):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        from app.services.inference_runtime import configure_inference_runtime
+
+        configure_inference_runtime()
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+        self.model = AutoModel.from_pretrained(model_path).eval()
+        self.dim = self.model.config.hidden_size
+
+    def embed(self, texts: List[str]):
+        """编码一批文本，返回 (n, dim) 的 float32 数组"""
+        torch = self.torch
+        inputs = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=settings.RAG_EMBEDDING_MAX_LENGTH,
+            return_tensors="pt",
+        )
+        with torch.inference_mode():
+            hidden = self.model(**inputs).last_hidden_state
+        if settings.RAG_EMBEDDING_POOLING == "mean":
+            mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        else:
+            pooled = hidden[:, 0]
+        pooled = torch.nn.functional.normalize(pooled, dim=-1)
+        return pooled.float().numpy()
+
+
+def get_embedder() -> Embedder:
+    """获取嵌入模型（延迟加载）"""
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            if not settings.RAG_EMBEDDING_MODEL:
+                raise RuntimeError("请先配置 RAG_EMBEDDING_MODEL")
+            _embedder = Embedder(settings.RAG_EMBEDDING_MODEL)
+        return _embedder
+
+
+def get_index():
+    """
+    获取向量索引，索引被重建后自动重新打开；不存在时返回 None
+
+    重建时新旧目录替换之间有短暂的间隙，此时继续使用已打开的旧索引（持有的是旧文件）
+    """
+    from app.services.vector_index import META_FILE, open_index
+
+    global _index, _index_mtime
+    try:
+        mtime = os.path.getmtime(os.path.join(settings.RAG_INDEX_DIR, META_FILE))
+    except OSError:
+        return _index
+    if _index is None or mtime != _index_mtime:
+        _index = open_index(settings.RAG_INDEX_DIR)
+        _index_mtime = mtime
+    return _index
+
+
+def ingest(corpus_dir: str, index_dir: Optional[str] = None) -> int:
+    """
+    切块、编码并写入向量索引（整体替换旧索引）
+
+    Args:
+        corpus_dir: 文档目录
+        index_dir: 索引目录，默认取 RAG_INDEX_DIR
+
+    Returns:
+        写入的文本块数量
+    """
+    from app.services.vector_index import VectorIndexWriter
+
+    embedder = get_embedder()
+    writer = VectorIndexWriter(
+        index_dir or settings.RAG_INDEX_DIR,
+        embedder.dim,
+        settings.RAG_INDEX_DTYPE,
+        settings.RAG_EMBEDDING_MODEL,
+    )
+    start = time.perf_counter()
+    batch: List[dict] = []
+
+    def flush():
+        writer.add(embedder.embed([chunk["text"] for chunk in batch]), batch)
+        batch.clear()
+        elapsed = time.perf_counter() - start
+        print(f"  已写入 {writer.count} 块，{writer.count / elapsed:.1f} 块/秒", end="\r")
+
+    try:
+        for chunk in iter_document_chunks(corpus_dir):
+            batch.append(chunk)
+            if len(batch) >= settings.RAG_EMBED_BATCH_SIZE:
+                flush()
+        if batch:
+            flush()
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    print(f"\n✅ 索引构建完成: {writer.count} 块，耗时 {time.perf_counter() - start:.1f}s")
+    return writer.count
+
+
+def retrieve(query: str, k: Optional[int] = None) -> List[dict]:
+    """
+    检索与问题最相关的文本块
+
+    Returns:
+        文本块元数据列表（附带 score），相似度低于 RAG_MIN_SCORE 的被过滤
+    """
+    index = get_index()
+    if index is None or index.count == 0:
+        return []
+    start = time.perf_counter()
+    query_text = settings.RAG_QUERY_INSTRUCTION + query
+    scores, ids = index.search(get_embedder().embed([query_text]), k or settings.RAG_TOP_K)
+    results = []
+    for score, chunk in zip(scores[0].tolist(), index.get_chunks(ids[0].tolist())):
+        if score >= settings.RAG_MIN_SCORE:
+            results.append({**chunk, "score": score})
+    metrics.observe("rag_retrieval_seconds", time.perf_counter() - start)
+    metrics.inc("rag_passages_total", len(results))
+    return results
+
+
+def build_context_message(passages: List[dict]) -> dict:
+    """把检索到的片段包装为系统消息（总长度不超过 RAG_MAX_CONTEXT_CHARS）"""
+    lines = ["以下是从资料库中检索到的参考资料，回答时请优先依据这些资料，资料不相关时忽略："]
+    remaining = settings.RAG_MAX_CONTEXT_CHARS
+    for i, passage in enumerate(passages, 1):
+        text = passage["text"][:remaining]
+        if not text:
+            break
+        lines.append(f"[{i}]（{passage['source']}）{text}")
+        remaining -= len(text)
+    return {"role": "system", "content": "\n".join(lines)}
+
+
+def augment_messages(messages: List[dict], query: str) -> List[dict]:
+    """
+    在最后一条（用户）消息之前插入检索到的参考资料
+
+    检索失败不影响对话，按原消息生成
+    """
+    try:
+        passages = retrieve(query)
+    except Exception as e:
+        print(f"资料检索失败: {e}")
+        return messages
+    if not passages:
+        return messages
+    return messages[:-1] + [build_context_message(passages)] + messages[-1:]
+
+
+def _print_results(results: List[dict]):
+    for result in results:
+        print(f"{result['score']:.3f}  {result['source']}#{result['position']}  {result['text'][:80]}")
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) < 2 or argv[0] not in ("ingest", "query"):
+        print("用法: python -m app.services.rag_service ingest <文档目录> | query <问题>")
+        return 1
+    if argv[0] == "ingest":
+        ingest(argv[1])
+    else:
+        _print_results(retrieve(" ".join(argv[1:])))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
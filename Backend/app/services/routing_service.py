@@ -0,0 +1,180 @@
+"""
+多节点会话亲和路由
+按 conversation_id 一致性哈希到推理节点，使同一会话的连续轮次落在同一节点上，
+复用节点内的上下文缓存与 prompt 片段缓存
+
+- 每个节点在哈希环上有 ROUTER_VIRTUAL_NODES 个虚拟节点，负载均匀
+- 节点加入或离开时只有约 1/N 的会话改变归属
+- 节点不健康时，它的会话顺延到环上的下一个健康节点，恢复后自动回到原节点
+"""
+import asyncio
+import bisect
+import hashlib
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import httpx
+
+from app.core.config import settings
+from app.core.metrics import metrics
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """带虚拟节点的一致性哈希环"""
+
+    def __init__(self, nodes: Iterable[str] = (), virtual_nodes: int = 160):
+        self.virtual_nodes = virtual_nodes
+        self._hashes: List[int] = []
+        self._owners: Dict[int, str] = {}
+        self.nodes: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str):
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for i in range(self.virtual_nodes):
+            point = _hash(f"{node}#{i}")
+            self._owners[point] = node
+            bisect.insort(self._hashes, point)
+
+    def remove(self, node: str):
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        points = {point for point, owner in self._owners.items() if owner == node}
+        self._hashes = [point for point in self._hashes if point not in points]
+        for point in points:
+            del self._owners[point]
+
+    def walk(self, key: str) -> List[str]:
+        """从 key 的位置顺时针遍历，返回去重后的节点顺序（第一个为主节点）"""
+        if not self._hashes:
+            return []
+        start = bisect.bisect(self._hashes, _hash(key))
+        order: List[str] = []
+        for i in range(len(self._hashes)):
+            node = self._owners[self._hashes[(start + i) % len(self._hashes)]]
+            if node not in order:
+                order.append(node)
+                if len(order) == len(self.nodes):
+                    break
+        return order
+
+    def shares(self) -> Dict[str, float]:
+        """每个节点在环上占据的比例"""
+        shares = {node: 0 for node in self.nodes}
+        total = 1 << 64
+        for i, point in enumerate(self._hashes):
+            previous = self._hashes[i - 1] if i else self._hashes[-1] - total
+            shares[self._owners[point]] += point - previous
+        return {node: round(size / total, 4) for node, size in shares.items()}
+
+
+class _NodeState:
+    """节点健康状态"""
+
+    def __init__(self):
+        self.healthy = True
+        self.failures = 0
+        self.last_checked: Optional[float] = None
+
+
+class NodePool:
+    """推理节点池：哈希环 + 健康检查"""
+
+    def __init__(self, nodes: Iterable[str], virtual_nodes: int):
+        self.ring = HashRing(virtual_nodes=virtual_nodes)
+        self._states: Dict[str, _NodeState] = {}
+        self._lock = threading.Lock()
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str):
+        """节点加入（新节点先视为健康，由健康检查确认）"""
+        node = node.rstrip("/")
+        with self._lock:
+            self.ring.add(node)
+            self._states.setdefault(node, _NodeState())
+            self._update_gauges()
+
+    def remove(self, node: str):
+        """节点离开"""
+        node = node.rstrip("/")
+        with self._lock:
+            self.ring.remove(node)
+            self._states.pop(node, None)
+            self._update_gauges()
+
+    def candidates(self, key: str) -> List[str]:
+        """按优先级返回可用节点：环上顺序中的健康节点，全部不健康时仍按环顺序尝试"""
+        with self._lock:
+            order = self.ring.walk(key)
+            healthy = [node for node in order if self._states[node].healthy]
+        return healthy or order
+
+    def mark(self, node: str, ok: bool):
+        """记录一次请求或健康检查的结果"""
+        with self._lock:
+            state = self._states.get(node)
+            if state is None:
+                return
+            state.last_checked = time.time()
+            if ok:
+                if not state.healthy:
+                    print(f"✅ 节点恢复: {node}")
+                state.failures = 0
+                state.healthy = True
+            else:
+                state.failures += 1
+                if state.healthy and state.failures >= settings.ROUTER_UNHEALTHY_AFTER:
+                    state.healthy = False
+                    print(f"⚠️ 节点不可用: {node}")
+            self._update_gauges()
+
+    def status(self) -> List[dict]:
+        with self._lock:
+            shares = self.ring.shares()
+            return [
+                {
+                    "url": node,
+                    "healthy": state.healthy,
+                    "failures": state.failures,
+                    "last_checked": state.last_checked,
+                    "share": shares.get(node, 0),
+                }
+                for node, state in self._states.items()
+            ]
+
+    def _update_gauges(self):
+        metrics.set("router_nodes", len(self._states))
+        metrics.set("router_healthy_nodes", sum(state.healthy for state in self._states.values()))
+
+    async def check_health(self, client: httpx.AsyncClient):
+        """并发检查所有节点（请求节点的根路径）"""
+        nodes = list(self._states)
+
+        async def check(node: str):
+            try:
+                response = await client.get(f"{node}/", timeout=settings.ROUTER_HEALTH_TIMEOUT)
+                self.mark(node, response.status_code < 500)
+            except httpx.HTTPError:
+                self.mark(node, False)
+
+        await asyncio.gather(*(check(node) for node in nodes))
+
+    async def run_health_loop(self, client: httpx.AsyncClient):
+        """周期性健康检查（后台任务）"""
+        while True:
+            await self.check_health(client)
+            await asyncio.sleep(settings.ROUTER_HEALTH_INTERVAL)
+
+
+# 创建全局节点池
+node_pool = NodePool(settings.ROUTER_NODES, settings.ROUTER_VIRTUAL_NODES)
@@ -0,0 +1,68 @@
+"""
+逐 token 流式输出
+generate 在后台线程中运行，每个解码步产生的 token 经队列交给消费线程，
+再增量解码为文本片段
+
+该模块会导入 transformers，只应在真正推理时延迟导入
+"""
+from queue import Queue
+from typing import Iterator, List
+
+from transformers.generation.streamers import BaseStreamer
+
+
+class TokenQueueStreamer(BaseStreamer):
+    """把 generate 新生成的 token id 放入队列（跳过第一次传入的 prompt）"""
+
+    def __init__(self):
+        self.queue: "Queue[List[int]]" = Queue()
+        self._prompt_skipped = False
+
+    def put(self, value):
+        if not self._prompt_skipped:
+            self._prompt_skipped = True
+            return
+        self.queue.put(value.reshape(-1).tolist())
+
+    def end(self):
+        self.queue.put(None)
+
+    def __iter__(self) -> Iterator[int]:
+        while True:
+            token_ids = self.queue.get()
+            if token_ids is None:
+                return
+            yield from token_ids
+
+
+class IncrementalDecoder:
+    """
+    增量解码 token
+
+    多字节字符可能被拆到多个 token 中，解码结果以替换字符结尾时先不输出；
+    遇到换行后清空缓存，避免每一步都重新解码整段回复
+    """
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self._token_ids: List[int] = []
+        self._printed = 0
+        self._started = False
+
+    def feed(self, token_id: int) -> str:
+        """加入一个 token，返回新增的可输出文本（可能为空）"""
+        self._token_ids.append(token_id)
+        text = self.tokenizer.decode(self._token_ids, skip_special_tokens=True)
+        if text.endswith("�"):
+            return ""
+        delta = text[self._printed:]
+        if text.endswith("\n"):
+            self._token_ids = []
+            self._printed = 0
+        else:
+            self._printed = len(text)
+        # 与 parse_output 一致，去掉回复开头的换行
+        if not self._started:
+            delta = delta.lstrip("\n")
+            self._started = bool(delta)
+        return delta
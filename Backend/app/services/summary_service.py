@@ -0,0 +1,144 @@
+"""
+会话滚动摘要服务
+把滑出上下文窗口的历史消息压缩成摘要保存在会话文档中，
+组装上下文时以"摘要 + 最近消息"的形式发送给模型
+"""
+from typing import List, Optional
+from pymongo.asynchronous.database import AsyncDatabase
+from bson import ObjectId
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services.ai_service import generate_ai_response, count_prompt_tokens
+
+# 正在生成摘要的会话，避免同一会话并发生成
+_summarizing = set()
+
+SUMMARY_PROMPT = (
+    "你是一个对话记录整理助手。请把下面的对话内容与已有摘要合并，"
+    "生成一段简洁的中文摘要，保留用户的关键问题、涉及的金融产品与数据、"
+    "以及已经给出的重要结论。只输出摘要内容。"
+)
+
+
+def needs_summary(message_count: int, summary_until: int, max_messages: Optional[int] = None) -> bool:
+    """
+    判断会话是否有滑出上下文窗口但尚未被摘要的消息
+
+    Args:
+        message_count: 会话当前的消息数量
+        summary_until: 摘要已覆盖的消息数量
+        max_messages: 上下文窗口大小
+
+    Returns:
+        是否需要更新摘要
+    """
+    max_messages = max_messages or settings.CONTEXT_MAX_MESSAGES
+    return message_count - max_messages > summary_until
+
+
+def build_summary_messages(previous_summary: str, messages: List[dict]) -> List[dict]:
+    """构建用于生成摘要的对话输入"""
+    transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+    content = f"已有摘要：\n{previous_summary or '（无）'}\n\n新增对话：\n{transcript}"
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT},
+        {"role": "user", "content": content},
+    ]
+
+
+def summarize_messages(previous_summary: str, messages: List[dict]) -> str:
+    """
+    调用模型把已有摘要与新滑出窗口的消息合并为新摘要（同步，较慢）
+
+    Args:
+        previous_summary: 已有摘要
+        messages: 新滑出窗口的消息
+
+    Returns:
+        新摘要文本
+    """
+    return generate_ai_response(
+        build_summary_messages(previous_summary, messages),
+        enable_thinking=False,
+        max_new_tokens=settings.SUMMARY_MAX_NEW_TOKENS
+    )
+
+
+async def update_conversation_summary(db: AsyncDatabase, conversation_id: str, model_name: Optional[str] = None):
+    """
+    更新会话的滚动摘要（后台任务，不在请求路径上运行）
+
+    以 summary_until 作为乐观锁写回，期间若已被其他任务更新则放弃
+
+    Args:
+        db: MongoDB 数据库实例
+        conversation_id: 会话ID
+        model_name: 会话本轮使用的模型，摘要节省的 token 数按该模型的分词器统计
+    """
+    if conversation_id in _summarizing:
+        return
+    _summarizing.add(conversation_id)
+    try:
+        # 摘要只需要消息文本，不读取消息上的 prompt 片段缓存
+        conversation = await db.conversations.find_one(
+            {"_id": ObjectId(conversation_id)},
+            {"messages.segment_ids": 0, "messages.segment_key": 0}
+        )
+        if not conversation:
+            return
+        messages = conversation.get("messages", [])
+        summary_until = conversation.get("summary_until", 0)
+        if not needs_summary(len(messages), summary_until):
+            return
+
+        window_start = len(messages) - settings.CONTEXT_MAX_MESSAGES
+        new_messages = [
+            {"role": msg["role"], "content": msg["content"]}
+            for msg in messages[summary_until:window_start]
+        ]
+        previous_summary = conversation.get("summary", "")
+
+        # 模型推理是同步阻塞的，放到线程池中执行
+        summary = await run_in_threadpool(summarize_messages, previous_summary, new_messages)
+        source_tokens = conversation.get("summary_source_tokens", 0) + await run_in_threadpool(
+            count_prompt_tokens, new_messages, model_name
+        )
+        summary_tokens = await run_in_threadpool(
+            count_prompt_tokens, [summary_context_message(summary)], model_name
+        )
+
+        await db.conversations.update_one(
+            {"_id": conversation["_id"], "summary_until": conversation.get("summary_until")},
+            {
+                "$set": {
+                    "summary": summary,
+                    "summary_until": window_start,
+                    "summary_source_tokens": source_tokens,
+                    "summary_tokens": summary_tokens,
+                }
+            }
+        )
+        metrics.inc("conversation_summaries_total")
+    except Exception as e:
+        print(f"会话摘要生成失败: {e}")
+    finally:
+        _summarizing.discard(conversation_id)
+
+
+def summary_context_message(summary: str) -> dict:
+    """把摘要包装为发送给模型的系统消息"""
+    return {"role": "system", "content": f"以下是此前对话的摘要：\n{summary}"}
+
+
+def record_prompt_savings(conversation: dict):
+    """
+    记录使用摘要代替完整历史所节省的 prompt token 数
+
+    节省量在生成摘要时已预先算好，这里只做累加，不在请求路径上分词
+    """
+    saved = conversation.get("summary_source_tokens", 0) - conversation.get("summary_tokens", 0)
+    if saved > 0:
+        metrics.inc("prompt_tokens_saved_total", saved)
+        metrics.inc("summary_context_requests_total")
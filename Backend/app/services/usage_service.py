@@ -0,0 +1,251 @@
+"""
+用量统计服务
+每条助手消息上保存了本次生成的用量（usage 字段：模型、prompt / completion / 思考 token 数、排队等待与生成耗时），
+这里用聚合管道把它们按 用户 / 天 / 模型 汇总到 usage_daily 集合
+
+汇总是增量且幂等的：usage_rollup_state 中记录水位线，每次处理到 当前时间 - USAGE_ROLLUP_LAG_SECONDS，
+对水位线所在当天 0 点之后的各 用户 / 天 / 模型 从消息重新计算完整的用量，借助 conversations.updated_at 索引
+只读取这段时间内有更新的会话，结果通过 $merge 整行替换 usage_daily 中的对应行（不累加），
+同一段窗口被重复处理（失败重试、多个进程并发）也不会重复计数；报表只读 usage_daily，不会重新扫描历史
+
+重新计算只覆盖有新消息的日期，此前已汇总的日期不受会话删除影响；
+但在删除会话后当天又有新消息时，当天的用量按剩余会话重新计算
+
+汇总由后台任务（USAGE_ROLLUP_ENABLED）或命令行定期执行，查询接口只读取已汇总的结果
+
+运行方式（在 Backend 目录下）:
+    python -m app.services.usage_service rollup
+    python -m app.services.usage_service report --start 2025-01-01 --by day model
+"""
+import argparse
+import asyncio
+import json
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from pymongo.asynchronous.database import AsyncDatabase
+from pymongo.errors import DuplicateKeyError
+
+from app.core.config import settings
+
+ROLLUP_KEY = "usage_daily"
+
+# 第一次汇总从这里开始（处理全部历史消息，之后只处理增量）
+EPOCH = datetime(1970, 1, 1)
+
+# 累加的字段（messages 为消息条数）
+SUM_FIELDS = ["messages", "prompt_tokens", "completion_tokens", "thinking_tokens", "queue_wait_ms", "generation_ms"]
+
+# 报表可以按这些维度分组
+GROUP_FIELDS = ["user_id", "day", "model"]
+
+
+def day_start(value: datetime) -> datetime:
+    """所在当天的 0 点（UTC，与 $dateToString 的分组一致）"""
+    return datetime(value.year, value.month, value.day)
+
+
+def rollup_pipeline(start: datetime, end: datetime) -> List[dict]:
+    """
+    重新计算 [start 当天 0 点, end) 之间写入的助手消息用量，替换 usage_daily 中对应的行
+
+    每行记录 computed_until（即 end），并发或乱序执行时保留计算时间更晚的结果
+    """
+    since = day_start(start)
+    usage_fields = SUM_FIELDS[1:]
+    return [
+        # 包含该时间段消息的会话，updated_at 一定不早于 since（走 updated_at 索引）
+        {"$match": {"updated_at": {"$gte": since}}},
+        # 先在服务端筛出时间段内带用量的助手消息，不展开也不传输消息正文
+        {"$project": {
+            "user_id": 1,
+            "messages": {"$filter": {
+                "input": {"$ifNull": ["$messages", []]},
+                "as": "m",
+                "cond": {"$and": [
+                    {"$eq": ["$$m.role", "assistant"]},
+                    {"$gte": ["$$m.created_at", since]},
+                    {"$lt": ["$$m.created_at", end]},
+                    {"$eq": [{"$type": "$$m.usage"}, "object"]},
+                ]},
+            }},
+        }},
+        {"$unwind": "$messages"},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$messages.created_at"}},
+                "model": {"$ifNull": ["$messages.usage.model", "unknown"]},
+            },
+            "messages": {"$sum": 1},
+            **{field: {"$sum": f"$messages.usage.{field}"} for field in usage_fields},
+        }},
+        {"$project": {
+            "_id": {"$concat": ["$_id.user_id", ":", "$_id.day", ":", "$_id.model"]},
+            "user_id": "$_id.user_id",
+            "day": "$_id.day",
+            "model": "$_id.model",
+            **{field: 1 for field in SUM_FIELDS},
+            "computed_until": {"$literal": end},
+        }},
+        {"$merge": {
+            "into": "usage_daily",
+            "on": "_id",
+            # 整行替换为重新计算的完整用量；已有的行由更晚的汇总算出时保留
+            "whenMatched": [{"$replaceWith": {"$cond": [
+                {"$gte": ["$$new.computed_until", "$computed_until"]}, "$$new", "$$ROOT",
+            ]}}],
+            "whenNotMatched": "insert",
+        }},
+    ]
+
+
+async def _claim_window(db: AsyncDatabase, end: datetime) -> Optional[datetime]:
+    """
+    原子地把水位线推进到 end，返回窗口起点
+
+    多个进程同时汇总时只有一个能认领同一段窗口，避免重复计算；没有新窗口时返回 None
+    """
+    state = await db.usage_rollup_state.find_one({"_id": ROLLUP_KEY})
+    start = state["watermark"] if state else EPOCH
+    if end <= start:
+        return None
+    if state is None:
+        try:
+            await db.usage_rollup_state.insert_one({"_id": ROLLUP_KEY, "watermark": end})
+        except DuplicateKeyError:
+            return None
+        return start
+    result = await db.usage_rollup_state.update_one(
+        {"_id": ROLLUP_KEY, "watermark": start},
+        {"$set": {"watermark": end}}
+    )
+    return start if result.modified_count else None
+
+
+async def rollup_usage(db: AsyncDatabase, now: Optional[datetime] = None) -> Optional[dict]:
+    """
+    增量汇总用量到 usage_daily
+
+    留出 USAGE_ROLLUP_LAG_SECONDS 的延迟，等待已生成时间戳但尚未写入的消息落库
+
+    Returns:
+        本次处理的时间窗口，没有新窗口（或被其他进程认领）时返回 None
+    """
+    end = (now or datetime.utcnow()) - timedelta(seconds=settings.USAGE_ROLLUP_LAG_SECONDS)
+    start = await _claim_window(db, end)
+    if start is None:
+        return None
+    try:
+        cursor = await db.conversations.aggregate(rollup_pipeline(start, end))
+        await cursor.to_list()
+    except Exception:
+        # 汇总失败时把水位线退回，下次重新处理这段窗口（$merge 可能已写入部分行，重新计算后整行替换）
+        await db.usage_rollup_state.update_one(
+            {"_id": ROLLUP_KEY, "watermark": end},
+            {"$set": {"watermark": start}}
+        )
+        raise
+    return {"start": start, "end": end}
+
+
+async def run_usage_rollup_loop(db: AsyncDatabase):
+    """
+    后台用量汇总任务
+    在应用生命周期内周期性运行，直到被取消（多个 worker 同时运行时由水位线保证只有一个处理同一段窗口）
+    """
+    while True:
+        try:
+            await rollup_usage(db)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"用量汇总任务出错: {e}")
+        await asyncio.sleep(settings.USAGE_ROLLUP_INTERVAL_SECONDS)
+
+
+async def get_user_usage(
+    db: AsyncDatabase,
+    user_id: str,
+    start_day: Optional[str] = None,
+    end_day: Optional[str] = None
+) -> List[dict]:
+    """
+    查询用户每天、每个模型的用量（走 usage_daily 的 user_id + day 索引）
+
+    Args:
+        start_day / end_day: 日期范围（YYYY-MM-DD，含两端），不传则不限制
+    """
+    query: dict = {"user_id": user_id}
+    day_range = {}
+    if start_day:
+        day_range["$gte"] = start_day
+    if end_day:
+        day_range["$lte"] = end_day
+    if day_range:
+        query["day"] = day_range
+    cursor = db.usage_daily.find(query, {"_id": 0, "computed_until": 0}).sort([("day", 1), ("model", 1)])
+    return await cursor.to_list()
+
+
+async def summarize_usage(
+    db: AsyncDatabase,
+    group_by: List[str],
+    start_day: Optional[str] = None,
+    end_day: Optional[str] = None
+) -> List[dict]:
+    """
+    在 usage_daily 上按指定维度再次汇总（容量规划报表，如按天 + 模型）
+
+    Args:
+        group_by: GROUP_FIELDS 的子集
+    """
+    match: dict = {}
+    if start_day or end_day:
+        match["day"] = {}
+        if start_day:
+            match["day"]["$gte"] = start_day
+        if end_day:
+            match["day"]["$lte"] = end_day
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {field: f"${field}" for field in group_by},
+            **{field: {"$sum": f"${field}"} for field in SUM_FIELDS},
+        }},
+        {"$sort": {f"_id.{field}": 1 for field in group_by} or {"messages": -1}},
+    ]
+    cursor = await db.usage_daily.aggregate(pipeline)
+    return [{**row.pop("_id"), **row} async for row in cursor]
+
+
+async def main():
+    """命令行入口"""
+    from pymongo import AsyncMongoClient
+
+    parser = argparse.ArgumentParser(description="用量统计")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rollup", help="增量汇总用量")
+    report = subparsers.add_parser("report", help="输出用量报表（先执行一次增量汇总）")
+    report.add_argument("--start", default=None, help="开始日期 YYYY-MM-DD")
+    report.add_argument("--end", default=None, help="结束日期 YYYY-MM-DD")
+    report.add_argument("--by", nargs="*", choices=GROUP_FIELDS, default=["day", "model"], help="分组维度")
+    args = parser.parse_args()
+
+    client = AsyncMongoClient(settings.MONGO_URL)
+    db = client[settings.MONGO_DB]
+    try:
+        window = await rollup_usage(db)
+        if window:
+            print(f"✅ 已汇总 {window['start']:%Y-%m-%d %H:%M:%S} ~ {window['end']:%Y-%m-%d %H:%M:%S} 的用量")
+        else:
+            print("没有需要汇总的新用量")
+        if args.command == "report":
+            for row in await summarize_usage(db, args.by, args.start, args.end):
+                print(json.dumps(row, ensure_ascii=False))
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
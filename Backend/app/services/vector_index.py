@@ -0,0 +1,193 @@
+"""
+磁盘向量索引
+向量按行连续写入一个原始文件，查询时以 np.memmap 映射，按块做矩阵乘法并用
+argpartition 取每块的 top-k 再合并，内存占用只与块大小有关，与索引规模无关
+
+索引目录结构:
+- vectors.bin: 归一化后的向量（行优先，dtype 见 index_meta.json）
+- chunks.jsonl: 每行一个文本块的元数据（text/source/position）
+- offsets.npy: chunks.jsonl 中每行的起始字节偏移，按 id 随机读取
+- index_meta.json: 数量、维度、精度、嵌入模型
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+VECTORS_FILE = "vectors.bin"
+CHUNKS_FILE = "chunks.jsonl"
+OFFSETS_FILE = "offsets.npy"
+META_FILE = "index_meta.json"
+
+# 查询时每次参与矩阵乘法的行数
+SEARCH_BLOCK_ROWS = 32768
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """按行 L2 归一化，之后内积即余弦相似度"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class VectorIndexWriter:
+    """
+    顺序写入向量索引
+
+    先写入临时目录，close 时整体替换旧索引，重建期间查询仍使用旧索引
+    """
+
+    def __init__(self, index_dir: str, dim: int, dtype: str = "float32", embedding_model: str = ""):
+        self.index_dir = index_dir
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.embedding_model = embedding_model
+        self.count = 0
+        self._tmp_dir = f"{os.path.normpath(index_dir)}.tmp-{os.getpid()}"
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        self._vectors = open(os.path.join(self._tmp_dir, VECTORS_FILE), "wb")
+        self._chunks = open(os.path.join(self._tmp_dir, CHUNKS_FILE), "wb")
+        self._offsets = [0]
+
+    def add(self, vectors: np.ndarray, chunks: List[dict]):
+        """
+        追加一批向量及其元数据
+
+        Args:
+            vectors: (n, dim) 向量，写入前归一化
+            chunks: n 个文本块元数据
+        """
+        if len(vectors) != len(chunks):
+            raise ValueError("向量与文本块数量不一致")
+        if len(vectors) == 0:
+            return
+        vectors = normalize(vectors)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"向量维度应为 {self.dim}，实际为 {vectors.shape[1]}")
+        self._vectors.write(vectors.astype(self.dtype).tobytes())
+        for chunk in chunks:
+            line = json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n"
+            self._chunks.write(line)
+            self._offsets.append(self._offsets[-1] + len(line))
+        self.count += len(vectors)
+
+    def close(self):
+        """写入元数据并替换旧索引"""
+        self._vectors.close()
+        self._chunks.close()
+        np.save(os.path.join(self._tmp_dir, OFFSETS_FILE), np.asarray(self._offsets, dtype=np.int64))
+        with open(os.path.join(self._tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "count": self.count,
+                "dim": self.dim,
+                "dtype": self.dtype.name,
+                "embedding_model": self.embedding_model,
+                "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }, f, ensure_ascii=False, indent=2)
+
+        old_dir = f"{os.path.normpath(self.index_dir)}.old-{os.getpid()}"
+        if os.path.exists(self.index_dir):
+            os.rename(self.index_dir, old_dir)
+        os.rename(self._tmp_dir, self.index_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    def abort(self):
+        """放弃本次写入"""
+        self._vectors.close()
+        self._chunks.close()
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+
+class VectorIndex:
+    """
+    只读的内存映射向量索引
+
+    向量、偏移与文本块文件在打开时一起持有，重建索引替换目录后，
+    已打开的实例仍读取同一代的文件，不会把旧偏移用到新文件上
+    """
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, META_FILE), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.count = self.meta["count"]
+        self.dim = self.meta["dim"]
+        self.vectors = np.memmap(
+            os.path.join(index_dir, VECTORS_FILE),
+            dtype=np.dtype(self.meta["dtype"]),
+            mode="r",
+            shape=(self.count, self.dim),
+        ) if self.count else np.empty((0, self.dim), dtype=np.float32)
+        self.offsets = np.load(os.path.join(index_dir, OFFSETS_FILE), mmap_mode="r")
+        self._chunks = open(os.path.join(index_dir, CHUNKS_FILE), "rb")
+        self._chunks_lock = threading.Lock()
+
+    def close(self):
+        self._chunks.close()
+
+    def _read(self, start: int, length: int) -> bytes:
+        if hasattr(os, "pread"):
+            return os.pread(self._chunks.fileno(), length, start)
+        # 没有 pread（Windows）时 seek + read 需要加锁
+        with self._chunks_lock:
+            self._chunks.seek(start)
+            return self._chunks.read(length)
+
+    def search(
+        self,
+        queries: np.ndarray,
+        k: int,
+        block_rows: int = SEARCH_BLOCK_ROWS
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        精确内积 top-k 检索
+
+        Args:
+            queries: (q, dim) 或 (dim,) 查询向量
+            k: 每个查询返回的数量
+            block_rows: 每块的行数
+
+        Returns:
+            (scores, ids)，形状均为 (q, min(k, count))，按相似度降序
+        """
+        queries = normalize(np.atleast_2d(queries))
+        k = min(k, self.count)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        if k == 0:
+            return best_scores, best_ids
+
+        for start in range(0, self.count, block_rows):
+            block = np.asarray(self.vectors[start:start + block_rows], dtype=np.float32)
+            scores = queries @ block.T
+            kk = min(k, scores.shape[1])
+            ids = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+            # 与之前各块的候选合并，只保留 k 个
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, ids, axis=1)], axis=1)
+            best_ids = np.concatenate([best_ids, ids + start], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_ids = np.take_along_axis(best_ids, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        return np.take_along_axis(best_scores, order, axis=1), np.take_along_axis(best_ids, order, axis=1)
+
+    def get_chunks(self, ids: Iterable[int]) -> List[dict]:
+        """按 id 读取文本块元数据"""
+        chunks = []
+        for chunk_id in ids:
+            start, end = int(self.offsets[chunk_id]), int(self.offsets[chunk_id + 1])
+            chunks.append(json.loads(self._read(start, end - start)))
+        return chunks
+
+
+def open_index(index_dir: str) -> Optional[VectorIndex]:
+    """打开索引，不存在时返回 None"""
+    if not os.path.exists(os.path.join(index_dir, META_FILE)):
+        return None
+    return VectorIndex(index_dir)
@@ -0,0 +1,108 @@
+"""
+响应压缩基准测试
+对会话详情响应（快速路径编码后的 JSON）和流式导出（逐块 flush）测量各算法、各级别的
+压缩率与 CPU 耗时，并估算不同带宽下的总传输时间（压缩耗时 + 传输耗时），
+用于选择 COMPRESSION_* 配置
+
+运行方式（在 Backend 目录下）:
+    python benchmarks/bench_compression.py --messages 200 --rounds 20
+"""
+import argparse
+import os
+import sys
+import time
+
+# 确保能够导入 Backend 目录下的 app 包
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from bench_serialization import build_document, fast_path
+
+from app.core.compression import BrotliEncoder, GzipEncoder, ZstdEncoder, brotli, zstandard
+
+# 每种算法测试的级别
+LEVELS = {
+    "gzip": [1, 5, 9],
+    "br": [1, 4, 6, 11],
+    "zstd": [1, 3, 9],
+}
+
+# 估算传输时间使用的带宽（Mbit/s）
+BANDWIDTHS = [1, 10, 100]
+
+
+def encoder_factories() -> dict:
+    factories = {"gzip": GzipEncoder}
+    if brotli is not None:
+        factories["br"] = BrotliEncoder
+    if zstandard is not None:
+        factories["zstd"] = ZstdEncoder
+    return factories
+
+
+def compress_once(factory, level: int, payload: bytes) -> bytes:
+    encoder = factory(level)
+    return encoder.compress(payload, False) + encoder.finish()
+
+
+def compress_stream(factory, level: int, chunks: list) -> bytes:
+    """模拟流式响应：每块压缩后立即 flush"""
+    encoder = factory(level)
+    out = [encoder.compress(chunk, True) for chunk in chunks]
+    out.append(encoder.finish())
+    return b"".join(out)
+
+
+def measure(func, rounds: int):
+    """返回 (输出, 单次平均耗时毫秒)"""
+    result = func()  # 预热
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return result, (time.perf_counter() - start) * 1000 / rounds
+
+
+def transfer_ms(size: int, mbps: float) -> float:
+    return size * 8 / (mbps * 1_000_000) * 1000
+
+
+def report(title: str, size: int, rows: list):
+    print(f"\n{title}（原始大小 {size / 1024:.1f} KiB）")
+    header = f"{'算法':<6}{'级别':>4}{'压缩后KiB':>11}{'压缩率':>8}{'CPU ms':>9}"
+    header += "".join(f"{f'{mbps}Mbps ms':>12}" for mbps in BANDWIDTHS)
+    print(header)
+    baseline = "".join(f"{transfer_ms(size, mbps):12.1f}" for mbps in BANDWIDTHS)
+    print(f"{'none':<6}{'-':>4}{size / 1024:11.1f}{1:8.2f}{0:9.2f}{baseline}")
+    for name, level, compressed, cpu_ms in rows:
+        totals = "".join(f"{cpu_ms + transfer_ms(compressed, mbps):12.1f}" for mbps in BANDWIDTHS)
+        print(f"{name:<6}{level:>4}{compressed / 1024:11.1f}{size / compressed:8.2f}{cpu_ms:9.2f}{totals}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="响应压缩基准测试")
+    parser.add_argument("--messages", type=int, default=200, help="会话详情中的消息数量")
+    parser.add_argument("--rounds", type=int, default=20, help="重复次数")
+    parser.add_argument("--chunk-size", type=int, default=4096, help="流式响应每块的字节数")
+    args = parser.parse_args()
+
+    payload = fast_path(build_document(args.messages))
+    chunks = [payload[i:i + args.chunk_size] for i in range(0, len(payload), args.chunk_size)]
+    factories = encoder_factories()
+    print(f"可用算法: {', '.join(factories)}（br 需要 brotli，zstd 需要 zstandard）")
+
+    whole, stream = [], []
+    for name, factory in factories.items():
+        for level in LEVELS[name]:
+            out, cpu_ms = measure(lambda: compress_once(factory, level, payload), args.rounds)
+            whole.append((name, level, len(out), cpu_ms))
+            out, cpu_ms = measure(lambda: compress_stream(factory, level, chunks), args.rounds)
+            stream.append((name, level, len(out), cpu_ms))
+
+    report(f"会话详情（{args.messages} 条消息，一次性响应）", len(payload), whole)
+    report(f"流式响应（每 {args.chunk_size} 字节 flush 一次）", len(payload), stream)
+    print("\n带宽列为压缩耗时 + 传输耗时的估算总延迟")
+
+
+if __name__ == "__main__":
+    main()
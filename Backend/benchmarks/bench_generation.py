@@ -0,0 +1,202 @@
+"""
+生成引擎微基准测试
+测量首 token 延迟（TTFT）、prefill 吞吐与 decode 速度，覆盖:
+- 上下文长度：1~10 轮对话（与 get_conversation_context 截取的窗口一致）
+- 批大小：同一 prompt 复制多份左填充批量生成
+- 线程数：torch.set_num_threads
+
+默认使用一个随机初始化的微型 Qwen3 检查点（首次运行时生成并保存到临时目录，固定随机种子，
+可在 CI 等没有真实模型的环境中运行）；--model real 时使用注册表中的真实模型
+
+运行方式（在 Backend 目录下）:
+    python benchmarks/bench_generation.py --output tiny.json
+    python benchmarks/bench_generation.py --model real --turns 1 5 10 --batch-sizes 1 4 --threads 4 8
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+# 确保能够导入 Backend 目录下的 app 包
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import torch
+from transformers import AutoConfig, AutoModelForCausalLM
+from transformers.generation.streamers import BaseStreamer
+
+from app.core.config import settings
+from app.services.chat_service import get_conversation_context
+
+DEFAULT_TINY_DIR = os.path.join(tempfile.gettempdir(), "aifs-tiny-qwen3")
+
+# 微型模型结构：词表与 Qwen3 一致，其余维度尽量小
+TINY_CONFIG = {
+    "hidden_size": 64,
+    "intermediate_size": 128,
+    "num_hidden_layers": 2,
+    "num_attention_heads": 4,
+    "num_key_value_heads": 2,
+    "head_dim": 16,
+    "max_position_embeddings": 8192,
+}
+
+USER_TEXT = "请结合最近三年的财务报表，分析这家公司的盈利能力和现金流状况，并指出主要风险。"
+ASSISTANT_TEXT = "从利润表看，公司营业收入保持增长，但毛利率有所下降；经营活动现金流与净利润基本匹配。" * 3
+
+
+class TimingStreamer(BaseStreamer):
+    """记录 generate 每一步产出 token 的时间（第一次 put 是 prompt 本身）"""
+
+    def __init__(self):
+        self.times = []
+
+    def put(self, value):
+        self.times.append(time.perf_counter())
+
+    def end(self):
+        pass
+
+
+def load_tiny_model(tiny_dir: str):
+    """加载微型检查点，不存在时按固定种子随机初始化并保存"""
+    if not os.path.exists(os.path.join(tiny_dir, "config.json")):
+        config = AutoConfig.for_model("qwen3", vocab_size=151936, **TINY_CONFIG)
+        torch.manual_seed(0)
+        model = AutoModelForCausalLM.from_config(config)
+        model.save_pretrained(tiny_dir)
+    return AutoModelForCausalLM.from_pretrained(tiny_dir).eval()
+
+
+def load_tokenizer(path: str):
+    """加载分词器，不可用时返回 None（按字符数构造随机 prompt）"""
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(path)
+    except Exception:
+        return None
+
+
+def build_context(turns: int) -> list:
+    """构造 turns 轮对话历史，经 get_conversation_context 截取后加上本轮提问"""
+    messages = []
+    for _ in range(turns - 1):
+        messages.append({"role": "user", "content": USER_TEXT})
+        messages.append({"role": "assistant", "content": ASSISTANT_TEXT})
+    context = get_conversation_context({"messages": messages})
+    return context + [{"role": "user", "content": USER_TEXT}]
+
+
+def prompt_ids(tokenizer, messages: list, vocab_size: int) -> list:
+    if tokenizer is not None:
+        text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return tokenizer([text]).input_ids[0]
+    # 没有分词器时按中文约一字一 token 估算长度
+    length = sum(len(m["content"]) + 5 for m in messages) + 3
+    generator = torch.Generator().manual_seed(length)
+    return torch.randint(0, vocab_size, (length,), generator=generator).tolist()
+
+
+def measure(model, input_ids: list, batch_size: int, new_tokens: int, repeats: int) -> dict:
+    """固定生成 new_tokens 个 token（贪心、禁止提前结束），取多次运行的中位数"""
+    inputs = torch.tensor([input_ids] * batch_size, device=model.device)
+    kwargs = dict(
+        attention_mask=torch.ones_like(inputs),
+        max_new_tokens=new_tokens,
+        min_new_tokens=new_tokens,
+        do_sample=False,
+        pad_token_id=0,
+    )
+    model.generate(inputs, max_new_tokens=2, min_new_tokens=2, do_sample=False, pad_token_id=0)  # 预热
+
+    ttft, decode, total = [], [], []
+    for _ in range(repeats):
+        streamer = TimingStreamer()
+        start = time.perf_counter()
+        with torch.inference_mode():
+            model.generate(inputs, streamer=streamer, **kwargs)
+        end = time.perf_counter()
+        # times[0] 为 prompt，times[1] 为第一个生成的 token
+        first = streamer.times[1]
+        ttft.append(first - start)
+        decode.append((end - first) / max(new_tokens - 1, 1))
+        total.append(end - start)
+
+    ttft_s = statistics.median(ttft)
+    decode_s = statistics.median(decode)
+    return {
+        "ttft_ms": round(ttft_s * 1000, 2),
+        "prefill_tokens_per_second": round(len(input_ids) * batch_size / ttft_s, 1),
+        "decode_tokens_per_second": round(batch_size / decode_s, 1),
+        "total_ms": round(statistics.median(total) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成引擎微基准测试")
+    parser.add_argument("--model", choices=["tiny", "real"], default="tiny", help="微型随机模型或真实模型")
+    parser.add_argument("--model-name", default=None, help="--model real 时使用的模型名称")
+    parser.add_argument("--tiny-dir", default=DEFAULT_TINY_DIR, help="微型检查点目录")
+    parser.add_argument("--tokenizer", default=settings.MODEL_PATH, help="微型模型使用的分词器路径")
+    parser.add_argument("--turns", type=int, nargs="+", default=[1, 2, 5, 10], help="对话轮数")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4], help="批大小")
+    parser.add_argument("--threads", type=int, nargs="+", default=[torch.get_num_threads()], help="线程数")
+    parser.add_argument("--new-tokens", type=int, default=32, help="每次生成的 token 数")
+    parser.add_argument("--repeats", type=int, default=3, help="每组重复次数（取中位数）")
+    parser.add_argument("--output", default=None, help="结果 JSON 文件，默认输出到标准输出")
+    args = parser.parse_args()
+
+    if args.model == "tiny":
+        model = load_tiny_model(args.tiny_dir)
+        tokenizer = load_tokenizer(args.tokenizer)
+        model_label = "tiny-qwen3"
+    else:
+        from app.services.ai_service import get_tokenizer
+        from app.services.model_registry import model_registry, get_base_model_name
+        model = model_registry.acquire(args.model_name)
+        tokenizer = get_tokenizer(args.model_name)
+        model_label = get_base_model_name(args.model_name)
+
+    results = []
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        for turns in args.turns:
+            input_ids = prompt_ids(tokenizer, build_context(turns), model.config.vocab_size)
+            for batch_size in args.batch_sizes:
+                record = {
+                    "threads": threads,
+                    "turns": turns,
+                    "prompt_tokens": len(input_ids),
+                    "batch_size": batch_size,
+                    **measure(model, input_ids, batch_size, args.new_tokens, args.repeats),
+                }
+                results.append(record)
+                print(json.dumps(record, ensure_ascii=False), file=sys.stderr)
+
+    report = {
+        "model": model_label,
+        "device": str(model.device),
+        "dtype": str(model.dtype),
+        "tokenizer": tokenizer is not None,
+        "new_tokens": args.new_tokens,
+        "context_max_messages": settings.CONTEXT_MAX_MESSAGES,
+        "torch": torch.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+资料检索（RAG）基准测试
+用随机向量构造指定规模的索引（默认 100 万块），测量索引写入吞吐与查询延迟；
+配置了 RAG_EMBEDDING_MODEL 时再测量嵌入模型的编码吞吐，估算真实文档的入库耗时
+
+运行方式（在 Backend 目录下）:
+    python benchmarks/bench_rag.py --chunks 1000000 --dim 512 --queries 200
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# 确保能够导入 Backend 目录下的 app 包
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app.core.config import settings
+from app.services.vector_index import VectorIndex, VectorIndexWriter
+
+SAMPLE_TEXT = "公司2023年实现营业收入同比增长12.5%，归属于上市公司股东的净利润为8.3亿元，经营活动现金流量净额保持稳定。"
+
+
+def build_index(index_dir: str, chunks: int, dim: int, dtype: str, batch: int) -> float:
+    """写入随机向量与模拟元数据，返回耗时（秒）"""
+    rng = np.random.default_rng(0)
+    writer = VectorIndexWriter(index_dir, dim, dtype, "synthetic")
+    start = time.perf_counter()
+    for offset in range(0, chunks, batch):
+        n = min(batch, chunks - offset)
+        vectors = rng.standard_normal((n, dim), dtype=np.float32)
+        metadata = [
+            {"text": SAMPLE_TEXT, "source": f"doc-{(offset + i) // 100}.txt", "position": (offset + i) % 100}
+            for i in range(n)
+        ]
+        writer.add(vectors, metadata)
+    writer.close()
+    return time.perf_counter() - start
+
+
+def measure_queries(index: VectorIndex, queries: int, k: int, batch: int) -> dict:
+    """单条查询的延迟分布，以及批量查询的吞吐"""
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((queries, index.dim), dtype=np.float32)
+
+    index.search(vectors[:1], k)  # 预热，页面载入页缓存
+    latencies = []
+    for vector in vectors:
+        start = time.perf_counter()
+        _, ids = index.search(vector, k)
+        index.get_chunks(ids[0].tolist())
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+
+    start = time.perf_counter()
+    for offset in range(0, queries, batch):
+        index.search(vectors[offset:offset + batch], k)
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 2),
+        "max_ms": round(latencies[-1], 2),
+        "batch_size": batch,
+        "batch_queries_per_second": round(queries / batch_seconds, 1),
+    }
+
+
+def measure_embedding(samples: int) -> dict:
+    """嵌入模型的编码吞吐（块/秒），并估算 100 万块的入库耗时"""
+    from app.services.rag_service import get_embedder
+
+    embedder = get_embedder()
+    texts = [SAMPLE_TEXT * 4] * settings.RAG_EMBED_BATCH_SIZE
+    embedder.embed(texts)  # 预热
+    start = time.perf_counter()
+    done = 0
+    while done < samples:
+        embedder.embed(texts)
+        done += len(texts)
+    rate = done / (time.perf_counter() - start)
+    return {
+        "model": settings.RAG_EMBEDDING_MODEL,
+        "chunks_per_second": round(rate, 1),
+        "estimated_1m_chunks_hours": round(1_000_000 / rate / 3600, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="资料检索基准测试")
+    parser.add_argument("--chunks", type=int, default=1_000_000, help="索引中的文本块数量")
+    parser.add_argument("--dim", type=int, default=512, help="向量维度")
+    parser.add_argument("--dtype", default=settings.RAG_INDEX_DTYPE, help="向量存储精度")
+    parser.add_argument("--queries", type=int, default=200, help="查询次数")
+    parser.add_argument("--k", type=int, default=settings.RAG_TOP_K, help="每次返回的数量")
+    parser.add_argument("--query-batch", type=int, default=32, help="批量查询的大小")
+    parser.add_argument("--embed-samples", type=int, default=256, help="嵌入吞吐测试的文本块数（0 表示跳过）")
+    parser.add_argument("--dir", default=None, help="索引目录（默认使用临时目录，结束后删除）")
+    args = parser.parse_args()
+
+    work_dir = args.dir or tempfile.mkdtemp(prefix="bench_rag_")
+    index_dir = os.path.join(work_dir, "index")
+    try:
+        build_seconds = build_index(index_dir, args.chunks, args.dim, args.dtype, 10_000)
+        index = VectorIndex(index_dir)
+        report = {
+            "chunks": args.chunks,
+            "dim": args.dim,
+            "dtype": args.dtype,
+            "index_mb": round(os.path.getsize(os.path.join(index_dir, "vectors.bin")) / 1024 / 1024, 1),
+            "ingest": {
+                "seconds": round(build_seconds, 2),
+                "chunks_per_second": round(args.chunks / build_seconds, 1),
+            },
+            "query": measure_queries(index, args.queries, args.k, args.query_batch),
+        }
+        if args.embed_samples and settings.RAG_EMBEDDING_MODEL:
+            report["embedding"] = measure_embedding(args.embed_samples)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    finally:
+        if not args.dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+会话详情序列化基准测试
+对比默认路径（conversation_helper -> ConversationDetail -> JSONResponse）
+与快速路径（conversation_detail_helper -> FastJSONResponse）
+
+运行方式（在 Backend 目录下）:
+    python benchmarks/bench_serialization.py --messages 1000 --rounds 50
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+# 确保能够导入 Backend 目录下的 app 包
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.core.serialization import FastJSONResponse, orjson
+from app.models.chat import conversation_helper, conversation_detail_helper
+from app.schemas.chat import ConversationDetail
+
+
+def build_document(message_count: int) -> dict:
+    """构造一个包含指定数量消息的会话文档（模拟驱动返回的数据）"""
+    now = datetime.utcnow().replace(microsecond=0)
+    messages = []
+    for i in range(message_count):
+        role = "user" if i % 2 == 0 else "assistant"
+        content = ("请分析一下近期的市场走势。" if role == "user"
+                   else "根据公开的财务数据，该公司近三个季度的营收保持稳定增长。" * 8)
+        messages.append({
+            "role": role,
+            "content": content,
+            "created_at": now + timedelta(seconds=i),
+        })
+    return {
+        "_id": ObjectId(),
+        "user_id": str(ObjectId()),
+        "title": "基准测试会话",
+        "messages": messages,
+        "created_at": now,
+        "updated_at": now + timedelta(seconds=message_count),
+    }
+
+
+def default_path(document: dict) -> bytes:
+    """原有路径：dict 转换 + 逐条消息校验 + response_model 再校验 + 标准 json 编码"""
+    conversation = conversation_helper(document)
+    detail = ConversationDetail(
+        id=conversation["id"],
+        title=conversation["title"],
+        created_at=conversation["created_at"],
+        updated_at=conversation["updated_at"],
+        message_count=len(conversation.get("messages", [])),
+        messages=conversation.get("messages", [])
+    )
+    # FastAPI 会按 response_model 再校验一次并转换为 JSON 兼容对象
+    payload = ConversationDetail.model_validate(detail.model_dump()).model_dump(mode="json")
+    return JSONResponse(jsonable_encoder(payload)).body
+
+
+def fast_path(document: dict) -> bytes:
+    """快速路径：直接从文档编码"""
+    return FastJSONResponse(conversation_detail_helper(document)).body
+
+
+def measure(func, document: dict, rounds: int) -> float:
+    """返回单次调用的平均耗时（毫秒）"""
+    func(document)  # 预热
+    start = time.perf_counter()
+    for _ in range(rounds):
+        func(document)
+    return (time.perf_counter() - start) * 1000 / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="会话详情序列化基准测试")
+    parser.add_argument("--messages", type=int, default=1000, help="每个会话的消息数量")
+    parser.add_argument("--rounds", type=int, default=50, help="重复次数")
+    args = parser.parse_args()
+
+    document = build_document(args.messages)
+    default_ms = measure(default_path, document, args.rounds)
+    fast_ms = measure(fast_path, document, args.rounds)
+
+    print(f"消息数量: {args.messages}，重复次数: {args.rounds}")
+    print(f"JSON 编码器: {'orjson' if orjson else 'json (标准库)'}")
+    print(f"默认路径: {default_ms:8.2f} ms/次")
+    print(f"快速路径: {fast_ms:8.2f} ms/次")
+    print(f"加速比:   {default_ms / fast_ms:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+应用冷启动基准测试
+多次在全新进程中导入 app.main，取中位数与启动预算（STARTUP_BUDGET_MS）比较；
+超出预算或启动时导入了推理依赖则以非零状态退出，可直接用于 CI
+
+运行方式（在 Backend 目录下）:
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import os
+import statistics
+import sys
+
+# 确保能够导入 Backend 目录下的 app 包
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from app.core.config import settings
+from app.core.startup_profile import measure_startup
+
+
+def main():
+    parser = argparse.ArgumentParser(description="应用冷启动基准测试")
+    parser.add_argument("--module", default="app.main", help="要导入的模块")
+    parser.add_argument("--runs", type=int, default=5, help="重复次数")
+    parser.add_argument("--budget-ms", type=float, default=settings.STARTUP_BUDGET_MS, help="启动耗时预算")
+    args = parser.parse_args()
+
+    results = [measure_startup(args.module) for _ in range(args.runs)]
+    import_ms = [r["import_ms"] for r in results]
+    rss_mb = [r["max_rss_mb"] for r in results]
+    heavy = sorted({m for r in results for m in r["heavy_modules"]})
+
+    median_ms = statistics.median(import_ms)
+    print(f"模块: {args.module}，重复次数: {args.runs}")
+    print(f"导入耗时: 中位数 {median_ms:.1f} ms，最小 {min(import_ms):.1f} ms，最大 {max(import_ms):.1f} ms")
+    print(f"峰值内存: 中位数 {statistics.median(rss_mb):.1f} MB")
+    print(f"启动预算: {args.budget_ms:.0f} ms")
+
+    failed = False
+    if median_ms > args.budget_ms:
+        print("❌ 冷启动耗时超出预算")
+        failed = True
+    if heavy:
+        print(f"❌ 启动时导入了推理依赖: {', '.join(heavy)}")
+        failed = True
+    if not failed:
+        print("✅ 冷启动在预算之内")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+CPU 推理线程自动调优
+按 worker 数量扫描 intra-op 线程数、inter-op 线程数与核心绑定的组合：每个组合同时启动 N 个子进程
+（模拟 N 个 worker 同时推理），各自用微型 Qwen3 检查点测量生成速度，
+取总 decode 吞吐最高的组合，可直接写入 .env
+
+inter-op 线程数在进程内只能设置一次，因此每个组合都在新的子进程中运行
+
+运行方式（在 Backend 目录下）:
+    python benchmarks/tune_threads.py --workers 2
+    python benchmarks/tune_threads.py --workers 4 --write
+"""
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+# 确保能够导入 Backend 目录下的 app 包
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from bench_generation import DEFAULT_TINY_DIR, build_context, load_tiny_model, load_tokenizer, measure, prompt_ids
+
+from app.core.config import settings
+from app.services.inference_runtime import available_cpus
+
+
+def candidates(workers: int) -> list:
+    """待扫描的 (threads, interop_threads, affinity) 组合，0 表示沿用 torch 默认值"""
+    per_worker = max(len(available_cpus()) // workers, 1)
+    threads = sorted({per_worker, max(per_worker // 2, 1)})
+    if workers == 1:
+        threads.insert(0, 0)
+    interop = [0, 1]
+    affinity = ["", "auto"] if hasattr(os, "sched_setaffinity") else [""]
+    return list(itertools.product(threads, interop, affinity))
+
+
+def run_child(args):
+    """子进程：按环境变量中的配置设置运行时，等到统一的开始时间后测量"""
+    from app.services.inference_runtime import configure_inference_runtime
+
+    runtime = configure_inference_runtime()
+    model = load_tiny_model(args.tiny_dir)
+    tokenizer = load_tokenizer(args.tokenizer)
+    input_ids = prompt_ids(tokenizer, build_context(args.turns), model.config.vocab_size)
+    # 各 worker 同时开始，才能反映共享核心时的争用
+    time.sleep(max(args.start_at - time.time(), 0))
+    result = measure(model, input_ids, args.batch_size, args.new_tokens, args.repeats)
+    print(json.dumps({**runtime, **result}))
+
+
+def run_config(args, threads: int, interop: int, affinity: str) -> dict:
+    """同时启动 workers 个子进程运行同一组配置，汇总结果"""
+    start_at = time.time() + args.startup_seconds
+    processes = []
+    for index in range(args.workers):
+        env = {
+            **os.environ,
+            "INFERENCE_THREADS": str(threads),
+            "INFERENCE_INTEROP_THREADS": str(interop),
+            "INFERENCE_CPU_AFFINITY": affinity,
+            "INFERENCE_WORKERS": str(args.workers),
+            "INFERENCE_WORKER_INDEX": str(index),
+        }
+        command = [
+            sys.executable, os.path.abspath(__file__), "--child",
+            "--start-at", str(start_at),
+            "--tiny-dir", args.tiny_dir,
+            "--tokenizer", args.tokenizer,
+            "--turns", str(args.turns),
+            "--batch-size", str(args.batch_size),
+            "--new-tokens", str(args.new_tokens),
+            "--repeats", str(args.repeats),
+        ]
+        processes.append(subprocess.Popen(command, env=env, stdout=subprocess.PIPE, text=True))
+
+    results = []
+    for process in processes:
+        stdout, _ = process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f"子进程失败（退出码 {process.returncode}）")
+        results.append(json.loads(stdout.strip().splitlines()[-1]))
+    return {
+        "threads": threads,
+        "interop_threads": interop,
+        "affinity": affinity,
+        "decode_tokens_per_second": round(sum(r["decode_tokens_per_second"] for r in results), 1),
+        "ttft_ms": max(r["ttft_ms"] for r in results),
+        "workers": results,
+    }
+
+
+def update_env_file(path: str, values: dict):
+    """更新 .env 中的配置项，保留其他内容，不存在的项追加到末尾"""
+    lines = []
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    remaining = dict(values)
+    for i, line in enumerate(lines):
+        key = line.split("=", 1)[0].strip()
+        if key in remaining:
+            lines[i] = f"{key}={remaining.pop(key)}"
+    lines.extend(f"{key}={value}" for key, value in remaining.items())
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU 推理线程自动调优")
+    parser.add_argument("--workers", type=int, default=settings.INFERENCE_WORKERS, help="同时推理的进程数")
+    parser.add_argument("--tiny-dir", default=DEFAULT_TINY_DIR, help="微型检查点目录")
+    parser.add_argument("--tokenizer", default=settings.MODEL_PATH, help="分词器路径")
+    parser.add_argument("--turns", type=int, default=5, help="对话轮数（决定 prompt 长度）")
+    parser.add_argument("--batch-size", type=int, default=1, help="批大小")
+    parser.add_argument("--new-tokens", type=int, default=32, help="每次生成的 token 数")
+    parser.add_argument("--repeats", type=int, default=3, help="每组重复次数（取中位数）")
+    parser.add_argument("--startup-seconds", type=float, default=15, help="子进程加载模型的等待时间")
+    parser.add_argument("--output", default=None, help="完整结果 JSON 文件")
+    parser.add_argument("--write", action="store_true", help="把最优配置写入 .env")
+    parser.add_argument("--env-file", default=".env", help="--write 写入的文件")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--start-at", type=float, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    # 先在父进程中生成微型检查点，避免子进程同时创建
+    load_tiny_model(args.tiny_dir)
+    print(f"可用核心: {len(available_cpus())}，worker 数: {args.workers}")
+
+    results = []
+    for threads, interop, affinity in candidates(args.workers):
+        record = run_config(args, threads, interop, affinity)
+        results.append(record)
+        print(
+            f"threads={threads or '默认':<4} interop={interop or '默认':<4} affinity={affinity or '无':<5} "
+            f"总吞吐 {record['decode_tokens_per_second']:8.1f} tokens/s  最大 TTFT {record['ttft_ms']:8.1f} ms"
+        )
+
+    best = max(results, key=lambda r: (r["decode_tokens_per_second"], -r["ttft_ms"]))
+    values = {
+        "INFERENCE_THREADS": best["threads"],
+        "INFERENCE_INTEROP_THREADS": best["interop_threads"],
+        "INFERENCE_WORKERS": args.workers,
+        "INFERENCE_CPU_AFFINITY": best["affinity"],
+    }
+    print(f"最优配置: {json.dumps(values, ensure_ascii=False)}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"best": values, "results": results}, f, ensure_ascii=False, indent=2)
+    if args.write:
+        update_env_file(args.env_file, values)
+        print(f"已写入 {args.env_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+"""
+测试公共配置（在 Backend 目录下运行 python -m pytest）
+"""
+import asyncio
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def run(coro):
+    """在新的事件循环中运行协程（不依赖 pytest-asyncio）"""
+    return asyncio.run(coro)
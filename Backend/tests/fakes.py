@@ -0,0 +1,340 @@
+"""
+测试用的内存版 MongoDB 集合（只实现测试用到的操作、过滤条件、投影与聚合阶段）
+"""
+import copy
+from types import SimpleNamespace
+from typing import Optional
+
+from bson import ObjectId
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
+
+def _get(doc, path: str):
+    """按点分路径取值，不存在时返回 None"""
+    for part in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+def _order(value):
+    # 与 BSON 的比较顺序一致：null 小于其他值
+    return (value is not None, value)
+
+
+_COMPARE = {
+    "$gte": lambda a, b: _order(a) >= _order(b),
+    "$gt": lambda a, b: _order(a) > _order(b),
+    "$lt": lambda a, b: _order(a) < _order(b),
+    "$lte": lambda a, b: _order(a) <= _order(b),
+}
+
+
+def _has(doc: dict, path: str) -> bool:
+    for part in path.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return False
+        doc = doc[part]
+    return True
+
+
+def _match_operator(doc: dict, key: str, op: str, bound) -> bool:
+    actual = _get(doc, key)
+    if op in _COMPARE:
+        return actual is not None and _COMPARE[op](actual, bound)
+    if op == "$ne":
+        return actual != bound
+    if op == "$in":
+        return actual in bound
+    if op == "$nin":
+        return actual not in bound
+    if op == "$exists":
+        return _has(doc, key) == bool(bound)
+    if op == "$not":
+        return not all(_match_operator(doc, key, inner, value) for inner, value in bound.items())
+    raise NotImplementedError(op)
+
+
+def _matches(doc: dict, query: dict) -> bool:
+    # 与 MongoDB 一致：过滤值为 None 时也匹配字段不存在的文档
+    for key, value in query.items():
+        if key == "$or":
+            if not any(_matches(doc, branch) for branch in value):
+                return False
+        elif isinstance(value, dict) and value and all(op.startswith("$") for op in value):
+            if not all(_match_operator(doc, key, op, bound) for op, bound in value.items()):
+                return False
+        elif _get(doc, key) != value:
+            return False
+    return True
+
+
+def _apply_update(doc: dict, update: dict):
+    """就地应用 $set / $unset / $inc / $push（支持 $each 与 $position）"""
+    doc.update(copy.deepcopy(update.get("$set", {})))
+    for key in update.get("$unset", {}):
+        doc.pop(key, None)
+    for key, value in update.get("$inc", {}).items():
+        doc[key] = doc.get(key, 0) + value
+    for key, value in update.get("$push", {}).items():
+        items = doc.setdefault(key, [])
+        if isinstance(value, dict) and "$each" in value:
+            position = value.get("$position", len(items))
+            items[position:position] = copy.deepcopy(value["$each"])
+        else:
+            items.append(copy.deepcopy(value))
+
+
+def _evaluate(expr, doc: dict, variables: Optional[dict] = None):
+    """聚合表达式（只支持投影与用量汇总管道用到的运算符）"""
+    variables = variables or {}
+    if isinstance(expr, str) and expr.startswith("$$"):
+        name, _, path = expr[2:].partition(".")
+        value = doc if name == "ROOT" else variables[name]
+        return _get(value, path) if path else value
+    if isinstance(expr, str) and expr.startswith("$"):
+        return _get(doc, expr[1:])
+    if isinstance(expr, list):
+        return [_evaluate(item, doc, variables) for item in expr]
+    if not isinstance(expr, dict):
+        return expr
+    if len(expr) != 1 or not next(iter(expr)).startswith("$"):
+        return {key: _evaluate(value, doc, variables) for key, value in expr.items()}
+    (op, args), = expr.items()
+    if op == "$literal":
+        return args
+    if op == "$cond":
+        condition, then, otherwise = args
+        return _evaluate(then if _evaluate(condition, doc, variables) else otherwise, doc, variables)
+    if op == "$filter":
+        items = _evaluate(args["input"], doc, variables) or []
+        return [
+            item for item in items
+            if _evaluate(args["cond"], doc, {**variables, args["as"]: item})
+        ]
+    if op == "$dateToString":
+        return _evaluate(args["date"], doc, variables).strftime(args["format"])
+    if op == "$type":
+        value = _evaluate(args, doc, variables)
+        return "object" if isinstance(value, dict) else "missing" if value is None else type(value).__name__
+    values = _evaluate(args, doc, variables)
+    if op == "$eq":
+        return values[0] == values[1]
+    if op in _COMPARE:
+        return _COMPARE[op](values[0], values[1])
+    if op == "$and":
+        return all(values)
+    if op == "$size":
+        return len(values)
+    if op == "$ifNull":
+        return values[1] if values[0] is None else values[0]
+    if op == "$concat":
+        return "".join(values)
+    raise NotImplementedError(op)
+
+
+def _project(doc: dict, projection) -> dict:
+    """按 MongoDB 的规则应用 find 投影：包含式、排除式（支持数组内字段）、$slice 与表达式"""
+    if not projection:
+        return doc
+    excluded = {key: value for key, value in projection.items() if value == 0}
+    if len(excluded) == len(projection) or excluded.keys() == {"_id"} and len(projection) == 1:
+        result = {key: value for key, value in doc.items() if projection.get(key) != 0}
+        for path in excluded:
+            field, _, sub = path.partition(".")
+            if sub and isinstance(result.get(field), list):
+                result[field] = [{k: v for k, v in item.items() if k != sub} for item in result[field]]
+        return result
+    result = {"_id": doc["_id"]} if projection.get("_id", 1) != 0 and "_id" in doc else {}
+    for key, value in projection.items():
+        if key == "_id" and not isinstance(value, (dict, str)):
+            continue
+        if isinstance(value, dict) and "$slice" in value:
+            if key in doc:
+                result[key] = doc[key][value["$slice"]:]
+        elif isinstance(value, (dict, str)):
+            result[key] = _evaluate(value, doc)
+        elif value and key in doc:
+            result[key] = doc[key]
+    return result
+
+
+class FakeCursor:
+    def __init__(self, docs: list):
+        self._docs = docs
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self._docs.sort(key=lambda doc: _order(doc.get(field)), reverse=order < 0)
+        return self
+
+    def skip(self, count):
+        self._docs = self._docs[count:]
+        return self
+
+    def limit(self, count):
+        if count:
+            self._docs = self._docs[:count]
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._docs:
+            yield doc
+
+    async def to_list(self):
+        return list(self._docs)
+
+
+class FakeCollection:
+    def __init__(self, database=None):
+        self.database = database
+        self.docs = {}
+        self.calls = []
+        # 用于模拟 $merge 写入部分结果后失败：写入这么多行后抛出异常
+        self.fail_merge_after: Optional[int] = None
+
+    async def find_one(self, query, projection=None, sort=None, **kwargs):
+        self.calls.append(("find_one", query, projection))
+        docs = [doc for doc in self.docs.values() if _matches(doc, query)]
+        for key, direction in reversed(sort or []):
+            docs.sort(key=lambda doc: doc.get(key), reverse=direction < 0)
+        return _project(copy.deepcopy(docs[0]), projection) if docs else None
+
+    async def count_documents(self, query):
+        self.calls.append(("count_documents", query, None))
+        return sum(1 for doc in self.docs.values() if _matches(doc, query))
+
+    def find(self, query=None, projection=None):
+        self.calls.append(("find", query, projection))
+        docs = [doc for doc in self.docs.values() if _matches(doc, query or {})]
+        return FakeCursor([_project(copy.deepcopy(doc), projection) for doc in docs])
+
+    async def aggregate(self, pipeline):
+        """执行聚合管道（只支持用量汇总用到的阶段）"""
+        self.calls.append(("aggregate", pipeline, None))
+        docs = [copy.deepcopy(doc) for doc in self.docs.values()]
+        for stage in pipeline:
+            (name, spec), = stage.items()
+            if name == "$match":
+                docs = [doc for doc in docs if _matches(doc, spec)]
+            elif name == "$project":
+                docs = [_project(doc, spec) for doc in docs]
+            elif name == "$unwind":
+                field = spec[1:]
+                docs = [{**doc, field: item} for doc in docs for item in doc.get(field) or []]
+            elif name == "$group":
+                docs = self._group(docs, spec)
+            elif name == "$merge":
+                self._merge(docs, spec)
+                docs = []
+            else:
+                raise NotImplementedError(name)
+        return FakeCursor(docs)
+
+    @staticmethod
+    def _group(docs: list, spec: dict) -> list:
+        groups = {}
+        for doc in docs:
+            key = _evaluate(spec["_id"], doc)
+            group = groups.setdefault(repr(key), {"_id": key, **{field: 0 for field in spec if field != "_id"}})
+            for field, accumulator in spec.items():
+                if field != "_id":
+                    group[field] += _evaluate(accumulator["$sum"], doc) or 0
+        return list(groups.values())
+
+    def _merge(self, docs: list, spec: dict):
+        target = self.database[spec["into"]]
+        for written, doc in enumerate(docs):
+            if self.fail_merge_after is not None and written >= self.fail_merge_after:
+                raise RuntimeError("merge interrupted")
+            existing = target.docs.get(doc["_id"])
+            if existing is None:
+                target.docs[doc["_id"]] = doc
+                continue
+            (stage, expr), = spec["whenMatched"][0].items()
+            assert stage == "$replaceWith"
+            target.docs[doc["_id"]] = _evaluate(expr, existing, {"new": doc})
+
+    async def insert_one(self, doc):
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError("duplicate key")
+        self.docs[doc["_id"]] = copy.deepcopy(doc)
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def update_one(self, query, update, upsert=False):
+        for doc in self.docs.values():
+            if _matches(doc, query):
+                before = copy.deepcopy(doc)
+                _apply_update(doc, update)
+                return SimpleNamespace(matched_count=1, modified_count=int(doc != before), upserted_id=None)
+        if upsert:
+            doc = {**query, **update.get("$setOnInsert", {}), **update.get("$set", {})}
+            self.docs[doc["_id"]] = copy.deepcopy(doc)
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=doc["_id"])
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def delete_one(self, query):
+        for key, doc in list(self.docs.items()):
+            if _matches(doc, query):
+                del self.docs[key]
+                return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    async def delete_many(self, query):
+        self.calls.append(("delete_many", query, None))
+        keys = [key for key, doc in self.docs.items() if _matches(doc, query)]
+        for key in keys:
+            del self.docs[key]
+        return SimpleNamespace(deleted_count=len(keys))
+
+    async def update_many(self, query, update):
+        count = 0
+        for doc in self.docs.values():
+            if _matches(doc, query):
+                _apply_update(doc, update)
+                count += 1
+        return SimpleNamespace(matched_count=count, modified_count=count)
+
+    async def bulk_write(self, requests, ordered=True):
+        """逐个执行 pymongo 的 ReplaceOne / UpdateOne（读取其内部属性）"""
+        self.calls.append(("bulk_write", [type(request).__name__ for request in requests], None))
+        matched = modified = 0
+        for request in requests:
+            query, document, upsert = request._filter, request._doc, getattr(request, "_upsert", False)
+            target = next((doc for doc in self.docs.values() if _matches(doc, query)), None)
+            if isinstance(request, ReplaceOne):
+                if target is not None:
+                    self.docs[target["_id"]] = copy.deepcopy(document)
+                    matched += 1
+                    modified += 1
+                elif upsert:
+                    self.docs[document["_id"]] = copy.deepcopy(document)
+            else:
+                result = await self.update_one(query, document, upsert=bool(upsert))
+                matched += result.matched_count
+                modified += result.modified_count
+        return SimpleNamespace(matched_count=matched, modified_count=modified)
+
+
+class FakeDatabase:
+    """按属性或下标访问集合，首次访问时创建"""
+
+    def __init__(self):
+        self.collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name == "collections":
+            raise AttributeError(name)
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(self)
+        return self.collections[name]
+
+    def __getitem__(self, name):
+        return getattr(self, name)
@@ -0,0 +1,59 @@
+"""
+适配器批量生成线程与模型结构修改的互斥
+"""
+import threading
+import time
+
+from app.services.adapter_manager import _Batcher, _Request
+
+
+class FakeBatcher(_Batcher):
+    """用事件代替真实生成，记录批次与修改的先后顺序"""
+
+    def __init__(self):
+        self.events = []
+        self.release = threading.Event()
+        self.started = threading.Event()
+        super().__init__("base", peft_model=None)
+
+    def _generate(self, batch):
+        self.events.append("batch-start")
+        self.started.set()
+        self.release.wait(5)
+        self.events.append("batch-end")
+        return [request.input_ids for request in batch]
+
+
+def test_exclusive_waits_for_running_batch():
+    batcher = FakeBatcher()
+    future = batcher.submit(_Request([1, 2], 4, "a"))
+    assert batcher.started.wait(5)
+
+    def modify():
+        with batcher.exclusive():
+            batcher.events.append("modify")
+
+    modifier = threading.Thread(target=modify)
+    modifier.start()
+    time.sleep(0.05)
+    # 批次仍在生成，修改必须等待
+    assert "modify" not in batcher.events
+
+    batcher.release.set()
+    modifier.join(5)
+    assert future.result(5) == [1, 2]
+    assert batcher.events == ["batch-start", "batch-end", "modify"]
+    batcher.stop()
+
+
+def test_batches_wait_while_model_is_modified():
+    batcher = FakeBatcher()
+    batcher.release.set()
+    with batcher.exclusive():
+        future = batcher.submit(_Request([3], 4, "a"))
+        time.sleep(0.05)
+        assert batcher.events == []
+        batcher.events.append("modify")
+    assert future.result(5) == [3]
+    assert batcher.events == ["modify", "batch-start", "batch-end"]
+    batcher.stop()
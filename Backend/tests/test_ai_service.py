@@ -0,0 +1,81 @@
+"""
+生成结果的取消判定与思考部分的统计
+"""
+import pytest
+
+from app.services import ai_service
+from app.services.ai_service import THINK_END_TOKEN_ID as THINK_END, StopFlag, thinking_length
+
+EOS = 2
+
+
+class FakeTokenizer:
+    eos_token_id = EOS
+    pad_token_id = 3
+
+    def decode(self, ids, skip_special_tokens=True):
+        special = {EOS, self.pad_token_id, THINK_END}
+        return " ".join(str(i) for i in ids if not (skip_special_tokens and i in special))
+
+
+@pytest.fixture(autouse=True)
+def fake_tokenizer(monkeypatch):
+    monkeypatch.setattr(ai_service, "get_tokenizer", lambda model_name=None: FakeTokenizer())
+
+
+def build(output_ids, should_stop=None, enable_thinking=True, max_new_tokens=100):
+    return ai_service._build_result(output_ids, enable_thinking, max_new_tokens, None, should_stop)
+
+
+def test_disconnect_after_natural_end_is_not_cancelled():
+    # 停止条件在生成过程中从未返回 True，之后客户端才断开
+    stop = StopFlag(lambda: True)
+    result = build([10, THINK_END, 11, 12, EOS], stop)
+    assert not result.cancelled
+    assert result.text == "11 12"
+
+
+def test_stop_fired_during_generation_is_cancelled():
+    stop = StopFlag(lambda: True)
+    assert stop()
+    result = build([10, THINK_END, 11], stop)
+    assert result.cancelled
+    assert result.text == "11"
+
+
+def test_stop_fired_on_eos_step_is_not_cancelled():
+    stop = StopFlag(lambda: True)
+    assert stop()
+    assert not build([10, THINK_END, 11, EOS], stop).cancelled
+
+
+def test_cancelled_while_thinking_has_no_reply():
+    stop = StopFlag(lambda: True)
+    stop()
+    result = build([10, 11], stop)
+    assert result.cancelled
+    assert result.text == ""
+    assert result.thinking_tokens == 2
+
+
+def test_stop_flag_latches():
+    answers = iter([False, True, False])
+    stop = StopFlag(lambda: next(answers))
+    assert [stop(), stop(), stop()] == [False, True, True]
+    assert stop.fired
+
+
+def test_thinking_tokens_match_parsed_reply():
+    # 多个 </think> 时以最后一个为界，用量与回复内容一致
+    output_ids = [10, THINK_END, 11, THINK_END, 12, EOS]
+    result = build(output_ids)
+    assert thinking_length(output_ids) == 4
+    assert result.thinking_tokens == 4
+    assert result.text == "12"
+    assert result.thinking_tokens + len([12, EOS]) == result.completion_tokens
+
+
+def test_no_thinking_mode():
+    result = build([11, 12, EOS], enable_thinking=False)
+    assert result.thinking_tokens == 0
+    assert result.text == "11 12"
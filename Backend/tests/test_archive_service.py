@@ -0,0 +1,170 @@
+"""
+会话冷存储：归档、乐观锁、恢复与读取时的透明恢复
+"""
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from app.services import archive_service
+from app.services.archive_service import (
+    archive_conversation,
+    archive_conversations,
+    archive_inactive_conversations,
+    restore_conversation,
+)
+from app.services.chat_service import context_projection, find_conversation_document
+
+from conftest import run
+from fakes import FakeDatabase
+
+# BSON 日期精确到毫秒，归档前后比较消息时去掉微秒
+OLD = (datetime.utcnow() - timedelta(days=90)).replace(microsecond=0)
+
+
+def add_conversation(db, user_id="u1", updated_at=OLD, count=3) -> dict:
+    conversation = {
+        "_id": ObjectId(),
+        "user_id": user_id,
+        "title": "旧会话",
+        "messages": [
+            {"role": "user" if i % 2 == 0 else "assistant", "content": f"消息 {i}", "created_at": updated_at}
+            for i in range(count)
+        ],
+        "created_at": updated_at,
+        "updated_at": updated_at,
+    }
+    db.conversations.docs[conversation["_id"]] = conversation
+    return conversation
+
+
+def hot(db, conversation):
+    return db.conversations.docs[conversation["_id"]]
+
+
+def test_archive_replaces_messages_with_stub():
+    db = FakeDatabase()
+    conversation = add_conversation(db)
+    messages = list(conversation["messages"])
+
+    assert run(archive_conversation(db, dict(conversation, messages=list(messages))))
+
+    stub = hot(db, conversation)
+    assert stub["archived"] is True and stub["messages"] == [] and stub["message_count"] == 3
+    archive = db.conversation_archives.docs[conversation["_id"]]
+    assert archive["user_id"] == "u1" and archive["message_count"] == 3
+    assert archive_service.decompress_messages(archive["blob"]) == messages
+
+
+def test_archive_skips_conversation_modified_after_read():
+    db = FakeDatabase()
+    conversation = add_conversation(db)
+    snapshot = dict(conversation, messages=list(conversation["messages"]))
+    # 读取之后有新消息写入，updated_at 变化
+    hot(db, conversation)["messages"].append({"role": "user", "content": "新消息"})
+    hot(db, conversation)["updated_at"] = datetime.utcnow()
+
+    assert run(archive_conversations(db, [snapshot])) == set()
+    assert "archived" not in hot(db, conversation)
+    assert len(hot(db, conversation)["messages"]) == 4
+    # 写入的归档记录被清理
+    assert db.conversation_archives.docs == {}
+
+
+def test_archive_batch_reports_only_archived():
+    db = FakeDatabase()
+    kept = add_conversation(db)
+    changed = add_conversation(db)
+    snapshots = [dict(c, messages=list(c["messages"])) for c in (kept, changed)]
+    hot(db, changed)["updated_at"] = datetime.utcnow()
+
+    assert run(archive_conversations(db, snapshots)) == {kept["_id"]}
+    assert set(db.conversation_archives.docs) == {kept["_id"]}
+
+
+def test_restore_puts_archived_messages_first():
+    db = FakeDatabase()
+    conversation = add_conversation(db)
+    messages = list(conversation["messages"])
+    run(archive_conversation(db, dict(conversation, messages=list(messages))))
+    # 存根上并发追加的消息保留在归档消息之后
+    hot(db, conversation)["messages"].append({"role": "user", "content": "归档后的新消息"})
+
+    assert run(restore_conversation(db, conversation["_id"]))
+
+    restored = hot(db, conversation)
+    assert restored["messages"] == messages + [{"role": "user", "content": "归档后的新消息"}]
+    assert "archived" not in restored and "message_count" not in restored
+    assert restored["updated_at"] == OLD and restored["restored_at"] > OLD
+    assert db.conversation_archives.docs == {}
+
+
+def test_restore_keeps_archive_written_by_concurrent_rearchive(monkeypatch):
+    db = FakeDatabase()
+    conversation = add_conversation(db)
+    messages = list(conversation["messages"])
+    run(archive_conversation(db, dict(conversation, messages=list(messages))))
+    update_one = db.conversations.update_one
+
+    async def update_then_rearchive(query, update, upsert=False):
+        result = await update_one(query, update, upsert)
+        # 恢复写入热集合之后、删除归档之前，归档任务再次归档了该会话
+        monkeypatch.setattr(db.conversations, "update_one", update_one)
+        current = hot(db, conversation)
+        await archive_conversations(db, [dict(current, messages=list(current["messages"]))])
+        return result
+
+    monkeypatch.setattr(db.conversations, "update_one", update_then_rearchive)
+    assert run(restore_conversation(db, conversation["_id"]))
+
+    assert hot(db, conversation)["archived"] is True
+    archive = db.conversation_archives.docs[conversation["_id"]]
+    assert archive_service.decompress_messages(archive["blob"]) == messages
+
+
+def test_restored_conversation_is_not_archived_again():
+    db = FakeDatabase()
+    conversation = add_conversation(db)
+    assert run(archive_inactive_conversations(db, inactive_days=30)) == 1
+    assert run(restore_conversation(db, conversation["_id"]))
+
+    assert run(archive_inactive_conversations(db, inactive_days=30)) == 0
+    assert "archived" not in hot(db, conversation)
+    # 恢复之后超过阈值仍未更新，才会再次归档
+    hot(db, conversation)["restored_at"] = OLD
+    assert run(archive_inactive_conversations(db, inactive_days=30)) == 1
+
+
+def test_archive_inactive_ignores_recent_and_archived():
+    db = FakeDatabase()
+    old = add_conversation(db)
+    add_conversation(db, updated_at=datetime.utcnow())
+    assert run(archive_inactive_conversations(db, inactive_days=30)) == 1
+    assert run(archive_inactive_conversations(db, inactive_days=30)) == 0
+    assert set(db.conversation_archives.docs) == {old["_id"]}
+
+
+def test_restore_without_archive_clears_stub():
+    db = FakeDatabase()
+    conversation = add_conversation(db, count=0)
+    hot(db, conversation).update(archived=True, message_count=5)
+
+    assert not run(restore_conversation(db, conversation["_id"]))
+    assert "archived" not in hot(db, conversation) and "message_count" not in hot(db, conversation)
+
+
+def test_find_conversation_document_restores_transparently():
+    db = FakeDatabase()
+    conversation = add_conversation(db, count=12)
+    messages = list(conversation["messages"])
+    run(archive_conversation(db, dict(conversation, messages=list(messages))))
+
+    document = run(find_conversation_document(db, str(conversation["_id"]), "u1", context_projection(4)))
+
+    assert document["messages"] == messages[-4:]
+    assert document["message_count"] == 12
+    assert not document.get("archived")
+    assert db.conversation_archives.docs == {}
+    # 其他用户读取不会触发恢复
+    run(archive_conversation(db, dict(hot(db, conversation), messages=list(hot(db, conversation)["messages"]))))
+    assert run(find_conversation_document(db, str(conversation["_id"]), "u2")) is None
+    assert hot(db, conversation)["archived"] is True
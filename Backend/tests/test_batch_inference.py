@@ -0,0 +1,96 @@
+"""
+离线批量推理：按长度分桶、填充上限和断点续跑
+"""
+import json
+from contextlib import contextmanager
+
+from app.services import ai_service, batch_inference
+from app.services.batch_inference import drop_partial_line, iter_batches, load_completed_ids
+from app.services.model_registry import model_registry
+
+
+def items(*lengths):
+    return [{"id": str(i), "input_ids": [0] * length} for i, length in enumerate(lengths)]
+
+
+def lengths(batches):
+    return [[len(item["input_ids"]) for item in batch] for batch in batches]
+
+
+def test_iter_batches_sorts_within_window():
+    batches = list(iter_batches(iter(items(9, 1, 5, 3, 8, 2)), window=3, batch_size=2, max_batch_tokens=1000))
+    # 每个窗口内按长度排序后切分，窗口之间不混合
+    assert lengths(batches) == [[1, 5], [9], [2, 3], [8]]
+
+
+def test_iter_batches_limits_padded_tokens():
+    batches = list(iter_batches(iter(items(4, 4, 4, 10, 10)), window=10, batch_size=8, max_batch_tokens=20))
+    # 加入长度 10 的条目后整批按 10 填充，4 条共 40 超出上限
+    assert lengths(batches) == [[4, 4, 4], [10, 10]]
+    assert all(len(batch) * max(map(len, (i["input_ids"] for i in batch))) <= 20 for batch in batches)
+
+
+def test_iter_batches_keeps_oversized_item_alone():
+    batches = list(iter_batches(iter(items(2, 50)), window=10, batch_size=8, max_batch_tokens=20))
+    assert lengths(batches) == [[2], [50]]
+
+
+def test_load_completed_ids_ignores_partial_line(tmp_path):
+    output = tmp_path / "out.jsonl"
+    assert load_completed_ids(str(output)) == set()
+    output.write_text('{"id": "a"}\n{"id": 2}\n{"id": "c", "cont', encoding="utf-8")
+    assert load_completed_ids(str(output)) == {"a", "2"}
+
+
+def test_drop_partial_line(tmp_path):
+    output = tmp_path / "out.jsonl"
+    output.write_text('{"id": "a"}\n{"id": "b", "content": "中', encoding="utf-8")
+    drop_partial_line(str(output), block_size=4)
+    assert output.read_text(encoding="utf-8") == '{"id": "a"}\n'
+    drop_partial_line(str(output))
+    assert output.read_text(encoding="utf-8") == '{"id": "a"}\n'
+    output.write_text('{"id": "a', encoding="utf-8")
+    drop_partial_line(str(output))
+    assert output.read_text(encoding="utf-8") == ""
+
+
+def fake_generation(monkeypatch):
+    generated = []
+
+    @contextmanager
+    def lease(model_name=None):
+        yield object()
+
+    def generate(model, batch_ids, max_new_tokens):
+        generated.extend(ids[0] for ids in batch_ids)
+        return [[ids[0]] * 2 for ids in batch_ids]
+
+    monkeypatch.setattr(model_registry, "lease", lease)
+    monkeypatch.setattr(
+        ai_service, "build_prompt_ids",
+        lambda messages, enable_thinking=True, model_name=None: [int(messages[-1]["content"])]
+    )
+    monkeypatch.setattr(ai_service, "generate_batch_with_model", generate)
+    monkeypatch.setattr(ai_service, "parse_output", lambda output_ids, model_name=None: f"答案 {output_ids[0]}")
+    return generated
+
+
+def test_run_resumes_after_partial_line(tmp_path, monkeypatch):
+    generated = fake_generation(monkeypatch)
+    source = tmp_path / "in.jsonl"
+    source.write_text("".join(json.dumps({"id": f"q{i}", "prompt": str(i)}) + "\n" for i in range(4)), encoding="utf-8")
+    output = tmp_path / "out.jsonl"
+    # 上次运行写完 q0，写 q1 时中断
+    output.write_text(
+        json.dumps({"id": "q0", "content": "答案 0", "prompt_tokens": 1, "completion_tokens": 2}) + '\n{"id": "q1", "con',
+        encoding="utf-8"
+    )
+
+    stats = batch_inference.run(str(source), str(output), batch_size=2)
+
+    assert sorted(generated) == [1, 2, 3]
+    assert stats["items"] == 3
+    records = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    assert sorted(record["id"] for record in records) == ["q0", "q1", "q2", "q3"]
+    assert {record["id"]: record["content"] for record in records}["q1"] == "答案 1"
+    assert load_completed_ids(str(output)) == {"q0", "q1", "q2", "q3"}
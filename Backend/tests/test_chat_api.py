@@ -0,0 +1,187 @@
+"""
+聊天 HTTP 接口：通过 TestClient 调用路由，数据库替换为内存实现
+"""
+from datetime import datetime, timedelta
+
+import bson
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import chat
+from app.core.config import settings
+from app.core.database import get_db
+from app.core.dependencies import get_current_user
+from app.services import idempotency_service
+from app.services.ai_service import GenerationResult
+from app.services.chat_service import DETAIL_PROJECTION, LIST_PROJECTION, context_projection
+
+from conftest import run
+from fakes import FakeDatabase
+
+MESSAGE_COUNT = 60
+
+
+@pytest.fixture
+def db():
+    return FakeDatabase()
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    monkeypatch.setattr(settings, "CONTEXT_SUMMARY_ENABLED", False)
+    monkeypatch.setattr(settings, "RAG_ENABLED", False)
+    monkeypatch.setattr(idempotency_service, "_inflight", {})
+    monkeypatch.setattr(chat, "resolve_model_name", lambda model_name=None: model_name or "qwen")
+
+    async def no_segments(role, content, model_name=None):
+        return None
+
+    monkeypatch.setattr(chat, "compute_segment_fields", no_segments)
+    app = FastAPI()
+    app.include_router(chat.router, prefix=settings.API_PREFIX)
+    app.dependency_overrides[get_db] = lambda: db
+    app.dependency_overrides[get_current_user] = lambda: {"id": "u1"}
+    return TestClient(app)
+
+
+@pytest.fixture
+def replies(monkeypatch):
+    """按顺序返回的生成结果，元素为异常时抛出"""
+    queue = []
+
+    def generate(messages, model_name=None, should_stop=None, **kwargs):
+        reply = queue.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return GenerationResult(text=reply, completion_tokens=3, max_new_tokens=64)
+
+    monkeypatch.setattr(chat, "generate_ai_reply", generate)
+    return queue
+
+
+def post_chat(client, message, conversation_id=None, key=None):
+    headers = {"Idempotency-Key": key} if key else {}
+    return client.post(
+        f"{settings.API_PREFIX}/chat",
+        json={"message": message, "conversation_id": conversation_id},
+        headers=headers,
+    )
+
+
+def test_generation_error_without_key_returns_apology(client, replies):
+    replies.append(RuntimeError("显存不足"))
+    response = post_chat(client, "你好")
+    assert response.status_code == 200
+    assert response.json()["message"] == "抱歉，AI 暂时无法响应，请稍后重试。"
+
+
+def test_idempotent_generation_error_is_not_replayed(client, db, replies):
+    replies.extend([RuntimeError("显存不足"), "你好，有什么可以帮你？"])
+
+    failed = post_chat(client, "你好", key="k1")
+    assert failed.status_code == 503
+    # 失败的请求不保存幂等记录，重试会重新生成
+    assert db.idempotency_keys.docs == {}
+
+    retried = post_chat(client, "你好", key="k1")
+    assert retried.status_code == 200
+    assert retried.json()["message"] == "你好，有什么可以帮你？"
+    assert "Idempotent-Replayed" not in retried.headers
+
+    replayed = post_chat(client, "你好", key="k1")
+    assert replayed.json() == retried.json()
+    assert replayed.headers["Idempotent-Replayed"] == "true"
+    assert replies == []
+
+
+def add_conversation(db, index: int = 0) -> ObjectId:
+    start = datetime(2026, 1, 1) + timedelta(hours=index)
+    doc = {
+        "_id": ObjectId(),
+        "user_id": "u1",
+        "title": f"会话 {index}",
+        "messages": [
+            {
+                "role": "user" if i % 2 == 0 else "assistant",
+                "content": f"第 {i} 条消息：" + "营业收入与现金流分析。" * 40,
+                "created_at": start + timedelta(minutes=i),
+                "segment_key": "qwen3:1",
+                "segment_ids": list(range(200)),
+            }
+            for i in range(MESSAGE_COUNT)
+        ],
+        "created_at": start,
+        "updated_at": start + timedelta(minutes=MESSAGE_COUNT),
+    }
+    db.conversations.docs[doc["_id"]] = doc
+    return doc["_id"]
+
+
+def full_size(db, conversation_id) -> int:
+    return len(bson.encode(db.conversations.docs[conversation_id]))
+
+
+def read_size(db, call) -> int:
+    """按记录下的查询与投影重新读取，得到这次读取传输的文档大小"""
+    _, query, projection = call
+    return len(bson.encode(run(db.conversations.find_one(query, projection))))
+
+
+def test_list_route_reads_metadata_only(client, db):
+    conversation_ids = [add_conversation(db, i) for i in range(3)]
+
+    response = client.get(f"{settings.API_PREFIX}/conversations", params={"limit": 2})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["total"] == 3
+    assert [item["title"] for item in body["conversations"]] == ["会话 2", "会话 1"]
+    assert all(item["message_count"] == MESSAGE_COUNT for item in body["conversations"])
+    (find,) = [call for call in db.conversations.calls if call[0] == "find"]
+    assert find == ("find", {"user_id": "u1"}, LIST_PROJECTION)
+    # 读取与响应的大小都与消息数量无关
+    assert read_size(db, find) < 200 < full_size(db, conversation_ids[0]) // 100
+    assert len(response.content) < 600
+
+
+@pytest.mark.parametrize("fast_json", [True, False])
+def test_detail_route_drops_segment_cache(client, db, monkeypatch, fast_json):
+    monkeypatch.setattr(settings, "FAST_JSON_RESPONSES", fast_json)
+    conversation_id = add_conversation(db)
+
+    response = client.get(f"{settings.API_PREFIX}/conversations/{conversation_id}")
+
+    assert response.status_code == 200
+    messages = response.json()["messages"]
+    assert len(messages) == MESSAGE_COUNT
+    assert all("segment_ids" not in message and "segment_key" not in message for message in messages)
+    (call,) = [call for call in db.conversations.calls if call[0] == "find_one"]
+    assert call[2] == DETAIL_PROJECTION
+    assert read_size(db, call) < full_size(db, conversation_id) * 0.6
+
+
+def test_chat_route_reads_context_window_only(client, db, replies, monkeypatch):
+    conversation_id = add_conversation(db)
+    prompts = []
+
+    def generate(messages, model_name=None, should_stop=None, **kwargs):
+        prompts.append(messages)
+        return GenerationResult(text="回复", completion_tokens=3, max_new_tokens=64)
+
+    monkeypatch.setattr(chat, "generate_ai_reply", generate)
+    response = post_chat(client, "继续分析", conversation_id=str(conversation_id))
+
+    assert response.status_code == 200
+    context_reads = [call for call in db.conversations.calls if call[0] == "find_one"]
+    assert context_reads[0][2] == {**context_projection(), "archived": 1}
+    # 只读取上下文窗口内的消息
+    assert read_size(db, context_reads[0]) < full_size(db, conversation_id) * (
+        settings.CONTEXT_MAX_MESSAGES + 3
+    ) / MESSAGE_COUNT
+    (messages,) = prompts
+    assert len(messages) == settings.CONTEXT_MAX_MESSAGES + 1
+    assert messages[-2]["content"].startswith(f"第 {MESSAGE_COUNT - 1} 条消息")
+    assert messages[-1] == {"role": "user", "content": "继续分析"}
+    assert len(db.conversations.docs[conversation_id]["messages"]) == MESSAGE_COUNT + 2
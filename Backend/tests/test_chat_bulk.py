@@ -0,0 +1,134 @@
+"""
+会话批量操作：逐项结果与一次查询完成的归属校验
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from app.services.chat_service import (
+    bulk_archive_conversations,
+    bulk_delete_conversations,
+    bulk_update_conversation_titles,
+)
+
+from conftest import run
+from fakes import FakeDatabase
+
+OLD = (datetime.utcnow() - timedelta(days=30)).replace(microsecond=0)
+
+
+@pytest.fixture
+def db():
+    db = FakeDatabase()
+    for user_id, count in (("u1", 3), ("u2", 1)):
+        for i in range(count):
+            doc = {
+                "_id": ObjectId(),
+                "user_id": user_id,
+                "title": f"会话 {i}",
+                "messages": [{"role": "user", "content": f"问题 {i}"}],
+                "created_at": OLD,
+                "updated_at": OLD,
+            }
+            db.conversations.docs[doc["_id"]] = doc
+    return db
+
+
+def ids(db, user_id):
+    return [str(oid) for oid, doc in db.conversations.docs.items() if doc["user_id"] == user_id]
+
+
+def ownership_queries(db):
+    return [
+        call for call in db.conversations.calls
+        if call[0] == "find" and call[2] == {"_id": 1}
+    ]
+
+
+def test_bulk_delete_reports_each_item(db):
+    mine, theirs = ids(db, "u1"), ids(db, "u2")
+    missing = str(ObjectId())
+    request = [mine[0], "not-an-id", theirs[0], missing, mine[1], mine[0]]
+
+    results = run(bulk_delete_conversations(db, request, "u1"))
+
+    assert results == {
+        mine[0]: (True, None),
+        mine[1]: (True, None),
+        "not-an-id": (False, "无效的会话ID"),
+        theirs[0]: (False, "会话不存在或无权访问"),
+        missing: (False, "会话不存在或无权访问"),
+    }
+    assert ids(db, "u1") == [mine[2]] and ids(db, "u2") == theirs
+    # 归属校验只查询一次，删除也只用一次 delete_many
+    (query,) = ownership_queries(db)
+    assert query[1]["user_id"] == "u1" and len(query[1]["_id"]["$in"]) == 4
+    assert [call[0] for call in db.conversations.calls].count("delete_many") == 1
+
+
+def test_bulk_delete_without_valid_ids_skips_queries(db):
+    assert run(bulk_delete_conversations(db, ["x", "y"], "u1")) == {
+        "x": (False, "无效的会话ID"),
+        "y": (False, "无效的会话ID"),
+    }
+    assert db.conversations.calls == []
+
+
+def test_bulk_rename_uses_one_bulk_write(db):
+    mine, theirs = ids(db, "u1"), ids(db, "u2")
+    titles = {mine[0]: "现金流", mine[1]: "估值", theirs[0]: "越权"}
+
+    results = run(bulk_update_conversation_titles(db, titles, "u1"))
+
+    assert results == {
+        mine[0]: (True, None),
+        mine[1]: (True, None),
+        theirs[0]: (False, "会话不存在或无权访问"),
+    }
+    docs = db.conversations.docs
+    assert docs[ObjectId(mine[0])]["title"] == "现金流" and docs[ObjectId(mine[1])]["title"] == "估值"
+    assert docs[ObjectId(mine[0])]["updated_at"] > OLD
+    assert docs[ObjectId(theirs[0])]["title"] == "会话 0"
+    assert len(ownership_queries(db)) == 1
+    assert [call for call in db.conversations.calls if call[0] == "bulk_write"] == [
+        ("bulk_write", ["UpdateOne", "UpdateOne"], None)
+    ]
+
+
+def test_bulk_archive_reports_already_archived(db):
+    mine, theirs = ids(db, "u1"), ids(db, "u2")
+    assert run(bulk_archive_conversations(db, [mine[0]], "u1")) == {mine[0]: (True, None)}
+
+    results = run(bulk_archive_conversations(db, [mine[0], mine[1], theirs[0], "bad"], "u1"))
+
+    assert results == {
+        mine[0]: (True, "会话已归档"),
+        mine[1]: (True, None),
+        theirs[0]: (False, "会话不存在或无权访问"),
+        "bad": (False, "无效的会话ID"),
+    }
+    assert set(map(str, db.conversation_archives.docs)) == {mine[0], mine[1]}
+    assert db.conversations.docs[ObjectId(theirs[0])].get("archived") is None
+
+
+def test_bulk_archive_reports_conversation_modified_during_archive(db, monkeypatch):
+    mine = ids(db, "u1")
+    find = db.conversations.find
+
+    def find_then_modify(query=None, projection=None):
+        cursor = find(query, projection)
+        if projection is None:
+            # 读取待归档会话之后，另一个请求写入了新消息
+            db.conversations.docs[ObjectId(mine[1])]["updated_at"] = datetime.utcnow()
+        return cursor
+
+    monkeypatch.setattr(db.conversations, "find", find_then_modify)
+    results = run(bulk_archive_conversations(db, mine[:2], "u1"))
+
+    assert results == {
+        mine[0]: (True, None),
+        mine[1]: (False, "会话在归档期间被修改，请重试"),
+    }
+    assert db.conversations.docs[ObjectId(mine[1])]["messages"] == [{"role": "user", "content": "问题 1"}]
+    assert set(map(str, db.conversation_archives.docs)) == {mine[0]}
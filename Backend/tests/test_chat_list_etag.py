@@ -0,0 +1,95 @@
+"""
+会话列表的 ETag：由会话总数与最近更新时间得出，写入路径不维护额外版本
+"""
+import time
+
+from fastapi import Response
+
+from app.api.chat import list_conversations
+from app.services.chat_service import (
+    add_message_to_conversation,
+    create_conversation,
+    delete_conversation,
+    update_conversation_title,
+)
+
+from conftest import run
+from fakes import FakeDatabase
+
+USER = {"id": "u1"}
+
+
+def fetch(db, if_none_match=None, skip=0, limit=20):
+    response = Response()
+    result = run(list_conversations(response, skip, limit, if_none_match, USER, db))
+    if isinstance(result, Response) and result.status_code == 304:
+        return 304, result.headers["etag"]
+    return result, response.headers["etag"]
+
+
+def write(db, operation):
+    # 保证两次写入的 updated_at 落在不同的毫秒
+    time.sleep(0.002)
+    return run(operation)
+
+
+def test_unchanged_list_is_not_modified():
+    db = FakeDatabase()
+    write(db, create_conversation(db, "u1", "第一个"))
+    body, etag = fetch(db)
+    assert body.total == 1
+    assert fetch(db, etag) == (304, etag)
+    # 写入路径不再更新用户文档
+    assert db.users.docs == {}
+
+
+def test_list_visible_changes_change_etag():
+    db = FakeDatabase()
+    conversation = write(db, create_conversation(db, "u1", "第一个"))
+    other = write(db, create_conversation(db, "u1", "第二个"))
+    etags = [fetch(db)[1]]
+
+    write(db, add_message_to_conversation(db, conversation["id"], "u1", "user", "你好"))
+    etags.append(fetch(db)[1])
+    write(db, update_conversation_title(db, other["id"], "u1", "改名"))
+    etags.append(fetch(db)[1])
+    write(db, create_conversation(db, "u1", "第三个"))
+    etags.append(fetch(db)[1])
+    write(db, delete_conversation(db, conversation["id"], "u1"))
+    etags.append(fetch(db)[1])
+
+    assert len(set(etags)) == len(etags)
+    for etag in etags[:-1]:
+        assert fetch(db, etag)[0] != 304
+    body, _ = fetch(db, etags[-1])
+    assert body == 304
+
+
+def test_deleting_older_conversation_changes_etag():
+    db = FakeDatabase()
+    older = write(db, create_conversation(db, "u1", "旧"))
+    write(db, create_conversation(db, "u1", "新"))
+    _, etag = fetch(db)
+    # 最近更新时间不变，总数变化
+    write(db, delete_conversation(db, older["id"], "u1"))
+    body, new_etag = fetch(db, etag)
+    assert body != 304 and body.total == 1
+    assert new_etag != etag
+
+
+def test_etag_depends_on_page():
+    db = FakeDatabase()
+    for i in range(3):
+        write(db, create_conversation(db, "u1", f"会话 {i}"))
+    _, first_page = fetch(db, limit=2)
+    _, second_page = fetch(db, skip=2, limit=2)
+    assert first_page != second_page
+    assert fetch(db, first_page, skip=2, limit=2)[0] != 304
+
+
+def test_other_users_do_not_affect_etag():
+    db = FakeDatabase()
+    write(db, create_conversation(db, "u1", "我的"))
+    _, etag = fetch(db)
+    write(db, create_conversation(db, "u2", "别人的"))
+    assert fetch(db, etag) == (304, etag)
@@ -0,0 +1,129 @@
+"""
+会话读取的投影：只传输列表、详情与上下文各自需要的字段
+"""
+from datetime import datetime, timedelta
+
+import bson
+import pytest
+from bson import ObjectId
+
+from app.core.config import settings
+from app.services.chat_service import (
+    DETAIL_PROJECTION,
+    LIST_PROJECTION,
+    context_projection,
+    get_conversation_by_id,
+    get_user_conversations,
+)
+
+from conftest import run
+from fakes import FakeDatabase
+
+MESSAGE_COUNT = 60
+
+
+def make_conversation(index: int = 0) -> dict:
+    start = datetime(2026, 1, 1) + timedelta(hours=index)
+    messages = [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"第 {i} 条消息：" + "营业收入与现金流分析。" * 40,
+            "created_at": start + timedelta(minutes=i),
+            "segment_key": "qwen3:1",
+            "segment_ids": list(range(200)),
+        }
+        for i in range(MESSAGE_COUNT)
+    ]
+    return {
+        "_id": ObjectId(),
+        "user_id": "u1",
+        "title": f"会话 {index}",
+        "messages": messages,
+        "summary": "此前讨论了公司的盈利能力",
+        "summary_until": 20,
+        "summary_source_tokens": 3000,
+        "summary_tokens": 80,
+        "created_at": start,
+        "updated_at": start + timedelta(minutes=MESSAGE_COUNT),
+    }
+
+
+@pytest.fixture
+def db():
+    db = FakeDatabase()
+    for i in range(3):
+        doc = make_conversation(i)
+        db.conversations.docs[doc["_id"]] = doc
+    return db
+
+
+def first_id(db) -> ObjectId:
+    return next(iter(db.conversations.docs))
+
+
+def projected_size(db, projection) -> int:
+    doc = run(db.conversations.find_one({"_id": first_id(db)}, projection))
+    return len(bson.encode(doc))
+
+
+def test_list_projection_reads_metadata_only(db):
+    conversations = run(get_user_conversations(db, "u1"))
+
+    assert db.conversations.calls[-1] == ("find", {"user_id": "u1"}, LIST_PROJECTION)
+    assert [c["title"] for c in conversations] == ["会话 2", "会话 1", "会话 0"]
+    for conversation in conversations:
+        assert conversation["messages"] == []
+        assert conversation["message_count"] == MESSAGE_COUNT
+    # 列表项只有元数据，大小与消息数量无关
+    full = projected_size(db, None)
+    listed = projected_size(db, LIST_PROJECTION)
+    assert set(run(db.conversations.find_one({}, LIST_PROJECTION))) == {
+        "_id", "user_id", "title", "created_at", "updated_at", "message_count",
+    }
+    assert listed < 200 < full // 100
+
+
+def test_detail_projection_drops_segment_cache(db):
+    conversation_id = str(first_id(db))
+    conversation = run(get_conversation_by_id(db, conversation_id, "u1", DETAIL_PROJECTION))
+
+    assert db.conversations.calls[-1][2] == DETAIL_PROJECTION
+    assert len(conversation["messages"]) == MESSAGE_COUNT
+    for message in conversation["messages"]:
+        assert set(message) == {"role", "content", "created_at"}
+    assert conversation["summary"] == "此前讨论了公司的盈利能力"
+    assert projected_size(db, DETAIL_PROJECTION) < projected_size(db, None) * 0.6
+
+
+def test_context_projection_reads_recent_messages(db):
+    conversation_id = str(first_id(db))
+    projection = context_projection()
+    conversation = run(get_conversation_by_id(db, conversation_id, "u1", projection))
+
+    # 包含式投影额外读取 archived 以识别归档存根
+    assert db.conversations.calls[-1][2] == {**projection, "archived": 1}
+    messages = conversation["messages"]
+    assert len(messages) == settings.CONTEXT_MAX_MESSAGES
+    assert messages[-1]["content"].startswith(f"第 {MESSAGE_COUNT - 1} 条消息")
+    # 上下文构建需要片段缓存
+    assert messages[-1]["segment_ids"] == list(range(200))
+    assert conversation["message_count"] == MESSAGE_COUNT
+    assert conversation["summary_until"] == 20
+    full = projected_size(db, None)
+    assert projected_size(db, projection) < full * (settings.CONTEXT_MAX_MESSAGES + 1) / MESSAGE_COUNT
+
+
+def test_context_projection_limit(db):
+    projection = context_projection(4)
+    assert projection["messages"] == {"$slice": -4}
+    doc = run(db.conversations.find_one({"_id": first_id(db)}, projection))
+    assert len(doc["messages"]) == 4
+    assert doc["message_count"] == MESSAGE_COUNT
+
+
+def test_archived_stub_uses_stored_count(db):
+    stub = {"_id": ObjectId(), "user_id": "u1", "title": "旧会话", "archived": True, "message_count": 7,
+            "created_at": datetime(2025, 1, 1), "updated_at": datetime(2025, 1, 1)}
+    db.conversations.docs[stub["_id"]] = stub
+    doc = run(db.conversations.find_one({"_id": stub["_id"]}, LIST_PROJECTION))
+    assert doc["message_count"] == 7
@@ -0,0 +1,128 @@
+"""
+响应压缩中间件：协商、一次性与流式压缩、透传与 ETag
+"""
+import gzip
+import zlib
+
+import brotli
+import pytest
+import zstandard
+
+from app.core.compression import CompressionMiddleware, Encoder, available_encoders, negotiate
+
+from conftest import run
+
+BODY = b'{"messages": [' + b'{"role": "user", "content": "\\u8425\\u4e1a\\u6536\\u5165"},' * 200 + b"{}]}"
+
+DECODERS = {
+    "gzip": gzip.decompress,
+    "br": brotli.decompress,
+    "zstd": lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data),
+}
+
+
+def json_app(body=BODY, status=200, headers=None, chunks=None):
+    """返回固定响应的 ASGI 应用，chunks 不为空时分块流式返回"""
+    async def app(scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": headers if headers is not None else [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"etag", b'"abc"'),
+            ],
+        })
+        for i, chunk in enumerate(chunks or [body]):
+            await send({"type": "http.response.body", "body": chunk, "more_body": i < len(chunks or [body]) - 1})
+    return app
+
+
+def request(app, accept_encoding="gzip, br, zstd", method="GET", **options):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": method, "headers": [(b"accept-encoding", accept_encoding.encode())]}
+    run(CompressionMiddleware(app, **options)(scope, receive, send))
+    headers = {k.decode(): v.decode() for k, v in messages[0]["headers"]}
+    bodies = [m.get("body", b"") for m in messages[1:]]
+    return messages[0]["status"], headers, bodies
+
+
+def test_encoder_is_abstract():
+    with pytest.raises(TypeError):
+        Encoder()
+    assert set(available_encoders(5, 4, 3)) == {"gzip", "br", "zstd"}
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip", "gzip"),
+    ("gzip, br", "br"),
+    ("gzip, br;q=0.5", "gzip"),
+    ("zstd;q=0, gzip", "gzip"),
+    ("*", "zstd"),
+    ("identity", None),
+    ("", None),
+])
+def test_negotiate(header, expected):
+    assert negotiate(header, ["zstd", "br", "gzip"]) == expected
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br", "zstd"])
+def test_compressed_response_round_trips(encoding):
+    status, headers, bodies = request(json_app(), encoding)
+    assert status == 200
+    assert headers["content-encoding"] == encoding
+    assert headers["content-length"] == str(len(bodies[0]))
+    assert headers["vary"] == "Accept-Encoding"
+    assert DECODERS[encoding](bodies[0]) == BODY
+
+
+def test_compressed_response_has_weak_etag():
+    _, headers, _ = request(json_app(), "gzip")
+    assert headers["etag"] == 'W/"abc"'
+    # 未压缩的响应体与上游一致，保留强 ETag
+    _, headers, _ = request(json_app(), "identity")
+    assert headers["etag"] == '"abc"'
+    _, headers, _ = request(json_app(body=b"{}"), "gzip")
+    assert headers["etag"] == '"abc"' and "content-encoding" not in headers
+
+
+def test_not_modified_carries_weak_etag():
+    app = json_app(body=b"", status=304, headers=[(b"etag", b'"abc"')])
+    status, headers, bodies = request(app, "gzip")
+    assert status == 304
+    assert headers["etag"] == 'W/"abc"'
+    assert bodies == [b""]
+
+
+def test_small_and_incompressible_responses_pass_through():
+    status, headers, bodies = request(json_app(body=b'{"ok": true}'), "gzip")
+    assert "content-encoding" not in headers and bodies == [b'{"ok": true}']
+
+    already = json_app(headers=[(b"content-type", b"application/gzip"), (b"etag", b'"x"')])
+    _, headers, bodies = request(already, "gzip")
+    assert "content-encoding" not in headers and headers["etag"] == '"x"' and bodies == [BODY]
+
+    encoded = json_app(headers=[(b"content-type", b"application/json"), (b"content-encoding", b"br")])
+    _, headers, bodies = request(encoded, "gzip")
+    assert headers["content-encoding"] == "br" and bodies == [BODY]
+
+
+def test_streaming_chunks_are_decodable_as_they_arrive():
+    chunks = [BODY[i:i + 1000] for i in range(0, len(BODY), 1000)]
+    status, headers, bodies = request(json_app(chunks=chunks), "gzip")
+    assert "content-length" not in headers
+    assert headers["content-encoding"] == "gzip"
+    # 每块 flush 后，已收到的数据可以立即解压出对应的原文
+    decoder = zlib.decompressobj(31)
+    received = b""
+    for i, body in enumerate(bodies[:-1]):
+        received += decoder.decompress(body)
+        assert received == b"".join(chunks[:i + 1])
+    assert received + decoder.decompress(bodies[-1]) + decoder.flush() == BODY
@@ -0,0 +1,122 @@
+"""
+请求幂等：重放、长时间执行、崩溃接管与结果保存
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.core.config import settings
+from app.services import idempotency_service
+from app.services.idempotency_service import IdempotencyConflict, run_idempotent
+
+from conftest import run
+from fakes import FakeDatabase
+
+
+@pytest.fixture(autouse=True)
+def fast_settings(monkeypatch):
+    monkeypatch.setattr(settings, "IDEMPOTENCY_PENDING_TTL_SECONDS", 0.2)
+    monkeypatch.setattr(settings, "IDEMPOTENCY_POLL_INTERVAL", 0.02)
+    monkeypatch.setattr(idempotency_service, "_inflight", {})
+
+
+def counting_handler(delay=0.0):
+    calls = {"count": 0}
+
+    async def handler():
+        calls["count"] += 1
+        await asyncio.sleep(delay)
+        return {"message": f"reply-{calls['count']}"}
+
+    return handler, calls
+
+
+def test_completed_request_is_replayed():
+    db = FakeDatabase()
+    handler, calls = counting_handler()
+
+    async def scenario():
+        first = await run_idempotent(db, "u1", "k1", "fp", handler)
+        second = await run_idempotent(db, "u1", "k1", "fp", handler)
+        return first, second
+
+    first, second = run(scenario())
+    assert first == ({"message": "reply-1"}, False)
+    assert second == ({"message": "reply-1"}, True)
+    assert calls["count"] == 1
+    record = db.idempotency_keys.docs["u1:k1"]
+    assert record["status"] == "completed"
+    assert record["purge_at"] > datetime.utcnow() + timedelta(hours=1)
+
+
+def test_fingerprint_mismatch_conflicts():
+    db = FakeDatabase()
+    handler, _ = counting_handler()
+
+    async def scenario():
+        await run_idempotent(db, "u1", "k1", "fp", handler)
+        await run_idempotent(db, "u1", "k1", "other", handler)
+
+    with pytest.raises(IdempotencyConflict):
+        run(scenario())
+
+
+def test_generation_longer_than_pending_ttl_is_not_taken_over(monkeypatch):
+    # 执行时间是心跳超时的 4 倍，另一个 worker 的重试应等待而不是重新执行
+    db = FakeDatabase()
+    handler, calls = counting_handler(delay=0.8)
+
+    async def other_worker():
+        await asyncio.sleep(0.4)
+        # 模拟另一个进程：看不到本进程的 _inflight
+        monkeypatch.setattr(idempotency_service, "_inflight", {})
+        return await run_idempotent(db, "u1", "k1", "fp", handler)
+
+    async def scenario():
+        return await asyncio.gather(run_idempotent(db, "u1", "k1", "fp", handler), other_worker())
+
+    original, retry = run(scenario())
+    assert calls["count"] == 1
+    assert original == ({"message": "reply-1"}, False)
+    assert retry == ({"message": "reply-1"}, True)
+
+
+def test_stale_pending_record_is_taken_over():
+    db = FakeDatabase()
+    stale = datetime.utcnow() - timedelta(seconds=5)
+    db.idempotency_keys.docs["u1:k1"] = {
+        "_id": "u1:k1", "status": "pending", "fingerprint": "fp",
+        "created_at": stale, "heartbeat_at": stale, "purge_at": stale + timedelta(days=1),
+    }
+    handler, calls = counting_handler()
+    assert run(run_idempotent(db, "u1", "k1", "fp", handler)) == ({"message": "reply-1"}, False)
+    assert calls["count"] == 1
+
+
+def test_completion_is_saved_when_pending_record_disappeared():
+    db = FakeDatabase()
+
+    async def handler():
+        # 执行期间 pending 记录丢失
+        db.idempotency_keys.docs.clear()
+        return {"message": "done"}
+
+    run(run_idempotent(db, "u1", "k1", "fp", handler))
+    record = db.idempotency_keys.docs["u1:k1"]
+    assert record["status"] == "completed"
+    assert record["response"] == {"message": "done"}
+    assert record["fingerprint"] == "fp"
+
+
+def test_failed_request_can_be_retried():
+    db = FakeDatabase()
+
+    async def failing():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        run(run_idempotent(db, "u1", "k1", "fp", failing))
+    assert db.idempotency_keys.docs == {}
+    handler, calls = counting_handler()
+    assert run(run_idempotent(db, "u1", "k1", "fp", handler))[1] is False
@@ -0,0 +1,127 @@
+"""
+自适应降级：按进行中数量与每 token 耗时逐级降级，恢复带滞后
+"""
+from contextlib import ExitStack
+
+import pytest
+
+from app.core.config import settings
+from app.services import load_shedding
+from app.services.load_shedding import LoadShedder
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(load_shedding.time, "monotonic", clock)
+    monkeypatch.setattr(load_shedding.time, "perf_counter", clock)
+    return clock
+
+
+@pytest.fixture
+def shedder(monkeypatch, clock):
+    monkeypatch.setattr(settings, "LOAD_SHED_ENABLED", True)
+    monkeypatch.setattr(settings, "LOAD_SHED_QUEUE_TIERS", [4, 8, 16])
+    monkeypatch.setattr(settings, "LOAD_SHED_LATENCY_TIERS_MS", [200, 400, 800])
+    monkeypatch.setattr(settings, "LOAD_SHED_EWMA_ALPHA", 1.0)
+    monkeypatch.setattr(settings, "LOAD_SHED_RECOVERY_RATIO", 0.7)
+    monkeypatch.setattr(settings, "LOAD_SHED_RECOVERY_SECONDS", 30)
+    return LoadShedder()
+
+
+def generate(shedder, clock, ms_per_token, tokens=10):
+    """模拟一次生成：耗时 ms_per_token × tokens"""
+    with shedder.track(shedder.plan()) as sample:
+        clock.advance(ms_per_token * tokens / 1000)
+        sample.tokens = tokens
+
+
+def test_disabled_by_default(monkeypatch, clock):
+    assert type(settings).model_fields["LOAD_SHED_ENABLED"].default is False
+    monkeypatch.setattr(settings, "LOAD_SHED_ENABLED", False)
+    shedder = LoadShedder()
+    with ExitStack() as stack:
+        for _ in range(20):
+            stack.enter_context(shedder.track(shedder.plan()))
+        plan = shedder.plan()
+    assert plan.level == 0 and plan.enable_thinking and plan.generate_kwargs() == {"enable_thinking": True}
+
+
+@pytest.mark.parametrize("in_flight, level", [(3, 0), (4, 1), (7, 1), (8, 2), (16, 3), (40, 3)])
+def test_queue_tiers(shedder, in_flight, level):
+    with ExitStack() as stack:
+        for _ in range(in_flight):
+            stack.enter_context(shedder.track(load_shedding.GenerationPlan(level=0)))
+        plan = shedder.plan()
+    assert plan.level == level
+    assert plan.enable_thinking == (level < 1)
+    assert (plan.max_new_tokens is not None) == (level >= 2)
+    assert (plan.context_messages is not None) == (level >= 3)
+
+
+@pytest.mark.parametrize("ms_per_token, level", [(150, 0), (200, 1), (450, 2), (900, 3)])
+def test_latency_tiers(shedder, clock, ms_per_token, level):
+    generate(shedder, clock, ms_per_token)
+    assert shedder.plan().level == level
+
+
+def test_short_replies_are_not_sampled(shedder, clock):
+    generate(shedder, clock, 1000, tokens=load_shedding.MIN_SAMPLE_TOKENS - 1)
+    assert shedder.latency_ms is None and shedder.plan().level == 0
+
+
+def test_recovery_has_hysteresis(shedder, clock):
+    generate(shedder, clock, 900)
+    assert shedder.plan().level == 3
+
+    # 低于 3 级阈值但高于 800 × 0.7：保持 3 级
+    generate(shedder, clock, 600)
+    clock.advance(60)
+    generate(shedder, clock, 600)
+    assert shedder.plan().level == 3
+
+    # 低于恢复线后，每持续 LOAD_SHED_RECOVERY_SECONDS 恢复一级（每次生成耗时 1 秒）
+    generate(shedder, clock, 100)
+    assert shedder.plan().level == 3
+    clock.advance(27)
+    generate(shedder, clock, 100)
+    assert shedder.plan().level == 3
+    clock.advance(3)
+    assert shedder.plan().level == 2
+    clock.advance(31)
+    generate(shedder, clock, 100)
+    assert shedder.plan().level == 1
+
+    # 恢复过程中再次超过阈值立即升级
+    generate(shedder, clock, 450)
+    assert shedder.plan().level == 2
+
+
+def test_recovery_stops_at_level_still_required(shedder, clock):
+    generate(shedder, clock, 900)
+    # 250 ms 仍高于 1 级阈值的恢复线（200 × 0.7）：最多恢复到 1 级
+    for _ in range(5):
+        clock.advance(31)
+        generate(shedder, clock, 250)
+    assert shedder.plan().level == 1
+
+
+def test_idle_resets_latency(shedder, clock):
+    generate(shedder, clock, 900)
+    assert shedder.plan().level == 3
+    # 空闲超过观察周期后旧样本作废，再经过观察周期逐级恢复
+    clock.advance(31)
+    assert shedder.plan().level == 3 and shedder.latency_ms is None
+    clock.advance(100)
+    assert shedder.plan().level == 0
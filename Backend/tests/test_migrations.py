@@ -0,0 +1,83 @@
+"""
+查询计划检查：QUERY_PLANS 中的查询都有索引可用，explain 结果出现 COLLSCAN 或 EOF 时失败
+"""
+import pytest
+
+from app.core.migrations import MIGRATIONS, QUERY_PLANS, check_query_plans
+
+from conftest import run
+
+
+def declared_indexes() -> dict:
+    """集合名 -> 最终保留的索引键列表（不含 _id）"""
+    declared = {}
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        for collection, indexes in migration.indexes.items():
+            for index in indexes:
+                declared.setdefault(collection, {})[index.document["name"]] = list(index.document["key"])
+        for collection, names in migration.drop_indexes.items():
+            for name in names:
+                declared.get(collection, {}).pop(name, None)
+    return {collection: list(indexes.values()) for collection, indexes in declared.items()}
+
+
+def plan_collection_and_filter(command: dict):
+    if "find" in command:
+        return command["find"], command.get("filter", {})
+    if "count" in command:
+        return command["count"], command.get("query", {})
+    if "delete" in command:
+        return command["delete"], command["deletes"][0]["q"]
+    return command["aggregate"], command["pipeline"][0]["$match"]
+
+
+@pytest.mark.parametrize("name", list(QUERY_PLANS))
+def test_every_planned_query_has_an_index(name):
+    collection, query = plan_collection_and_filter(QUERY_PLANS[name])
+    indexes = declared_indexes()
+    # apply 创建索引时会创建集合，check-plans 才不会因为集合不存在而无法验证
+    assert collection in indexes, f"{collection} 没有声明索引"
+    if "_id" in query:
+        return
+    assert any(keys[0] in query for keys in indexes[collection]), f"{name} 的过滤条件没有可用的索引前缀"
+
+
+class ExplainDatabase:
+    """按集合返回预设的 explain 结果"""
+
+    def __init__(self, plans: dict, default: dict):
+        self.plans = plans
+        self.default = default
+
+    async def command(self, name, command, verbosity=None):
+        assert name == "explain" and verbosity == "queryPlanner"
+        collection, _ = plan_collection_and_filter(command)
+        winning = self.plans.get(collection, self.default)
+        if "aggregate" in command:
+            return {"stages": [{"$cursor": {"queryPlanner": {"winningPlan": winning}}}, {"$group": {}}]}
+        return {"queryPlanner": {"winningPlan": winning}}
+
+
+IXSCAN = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "x"}}
+COLLSCAN = {"stage": "COLLSCAN"}
+EOF_PLAN = {"stage": "EOF"}
+
+
+def test_index_plans_pass():
+    assert run(check_query_plans(ExplainDatabase({}, IXSCAN))) == []
+
+
+def test_collection_scan_fails():
+    failures = run(check_query_plans(ExplainDatabase({"usage_daily": COLLSCAN}, IXSCAN)))
+    assert failures and all(name.startswith("usage_service") for name in failures)
+
+
+def test_missing_collection_fails():
+    failures = run(check_query_plans(ExplainDatabase({"idempotency_keys": EOF_PLAN}, IXSCAN)))
+    assert failures == ["idempotency_service: 按键查询"]
+
+
+def test_nested_collection_scan_is_found():
+    plan = {"stage": "SORT", "inputStage": {"stage": "OR", "inputStages": [IXSCAN, COLLSCAN]}}
+    failures = run(check_query_plans(ExplainDatabase({"users": plan}, IXSCAN)))
+    assert sorted(failures) == sorted(name for name in QUERY_PLANS if name.startswith("user_service"))
@@ -0,0 +1,128 @@
+"""
+多模型注册表：并发加载只执行一次、租约期间不淘汰、按内存预算 LRU 淘汰
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.core.config import settings
+from app.services import model_loader, model_registry as registry_module
+from app.services.model_registry import ModelRegistry
+
+MB = 1024 * 1024
+SIZES = {"a": 40 * MB, "b": 40 * MB, "c": 40 * MB, "big": 90 * MB}
+
+
+class FakeModel:
+    def __init__(self, name: str):
+        self.name = name
+        self.size_bytes = SIZES[name]
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """假的加载器：模型路径即名称，按 SIZES 计算占用"""
+    loads = []
+
+    def load(path):
+        loads.append(path)
+        time.sleep(0.05)
+        return FakeModel(path)
+
+    monkeypatch.setattr(settings, "ADAPTERS", {})
+    monkeypatch.setattr(registry_module, "get_model_paths", lambda: {name: name for name in SIZES})
+    monkeypatch.setattr(registry_module, "_estimate_checkpoint_bytes", lambda path: SIZES[path])
+    monkeypatch.setattr(registry_module, "_model_bytes", lambda model: model.size_bytes)
+    monkeypatch.setattr(model_loader, "load_causal_lm", load)
+    return loads
+
+
+def resident(registry: ModelRegistry) -> list:
+    return [item["name"] for item in registry.resident()]
+
+
+def test_concurrent_first_use_loads_once(loads):
+    registry = ModelRegistry()
+    start = threading.Barrier(8)
+
+    def use():
+        start.wait()
+        with registry.lease("a") as model:
+            return model
+
+    with ThreadPoolExecutor(8) as pool:
+        models = list(pool.map(lambda _: use(), range(8)))
+
+    assert loads == ["a"]
+    assert all(model is models[0] for model in models)
+    assert registry.resident()[0]["in_use"] == 0
+
+
+def test_waiters_reload_after_failed_load(loads, monkeypatch):
+    registry = ModelRegistry()
+    attempts = []
+
+    def flaky(path):
+        attempts.append(path)
+        time.sleep(0.05)
+        if len(attempts) == 1:
+            raise RuntimeError("权重文件损坏")
+        return FakeModel(path)
+
+    monkeypatch.setattr(model_loader, "load_causal_lm", flaky)
+    start = threading.Barrier(2)
+
+    def use():
+        start.wait()
+        try:
+            with registry.lease("a"):
+                return "ok"
+        except RuntimeError:
+            return "failed"
+
+    with ThreadPoolExecutor(2) as pool:
+        results = sorted(pool.map(lambda _: use(), range(2)))
+
+    assert results == ["failed", "ok"]
+    assert attempts == ["a", "a"]
+
+
+def test_lru_eviction_within_budget(loads):
+    registry = ModelRegistry(100 * MB)
+    for name in ("a", "b"):
+        with registry.lease(name):
+            pass
+    # 使用 a 之后 b 成为最近最少使用
+    with registry.lease("a"):
+        pass
+    with registry.lease("c"):
+        pass
+
+    assert resident(registry) == ["a", "c"]
+    assert sum(item["size_mb"] for item in registry.resident()) * MB <= 100 * MB
+    with registry.lease("b"):
+        pass
+    assert resident(registry) == ["c", "b"]
+    assert loads == ["a", "b", "c", "b"]
+
+
+def test_leased_model_is_never_evicted(loads):
+    registry = ModelRegistry(100 * MB)
+    with registry.lease("a") as model_a:
+        with registry.lease("b"):
+            pass
+        # 预算只够两个模型：淘汰没有租约的 b，而不是更久未使用但仍在使用的 a
+        with registry.lease("c"):
+            assert resident(registry) == ["a", "c"]
+        with registry.lease("big"):
+            # 没有可淘汰的模型时超出预算加载，a 仍然常驻
+            assert resident(registry) == ["a", "big"]
+        # big 的租约释放后超出预算，淘汰的是 big 而不是仍在使用的 a
+        assert resident(registry) == ["a"]
+        assert registry.acquire("a") is model_a
+        registry.release("a")
+
+    assert resident(registry) == ["a"]
+    assert loads == ["a", "b", "c", "big"]
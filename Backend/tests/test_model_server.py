@@ -0,0 +1,49 @@
+"""
+模型服务数据传输与监听配置
+"""
+import numpy as np
+import pytest
+
+from app.core.config import settings
+from app.services import model_server
+from app.services.model_server import SHM_MARKER, check_listen_config, pack, unpack
+
+
+def test_token_ids_travel_through_shared_memory(monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_SERVER_SHM_THRESHOLD", 0)
+    ids = list(range(100))
+    packed = pack({"op": "generate_ids", "input_ids": model_server._as_array(ids), "max_new_tokens": 8})
+
+    # 消息中只有描述信息，数组本身在共享内存里
+    assert SHM_MARKER in packed["input_ids"]
+    assert packed["max_new_tokens"] == 8
+
+    unpacked = unpack(packed)
+    assert model_server._as_list(unpacked["input_ids"]) == ids
+    # 接收方读取后释放共享内存
+    with pytest.raises(FileNotFoundError):
+        model_server.SharedMemory(name=packed["input_ids"][SHM_MARKER])
+
+
+def test_small_arrays_inline_below_threshold(monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_SERVER_SHM_THRESHOLD", 1024)
+    array = np.arange(10, dtype=np.int64)
+    packed = pack({"input_ids": array})
+    assert packed["input_ids"] is array
+
+
+@pytest.mark.parametrize("host", ["127.0.0.1", "localhost", "::1"])
+def test_default_authkey_allowed_on_loopback(host):
+    check_listen_config(host, model_server.DEFAULT_AUTHKEY)
+
+
+@pytest.mark.parametrize("host", ["0.0.0.0", "10.0.0.5", "model-server"])
+def test_default_authkey_refused_off_loopback(host):
+    with pytest.raises(RuntimeError):
+        check_listen_config(host, model_server.DEFAULT_AUTHKEY)
+    check_listen_config(host, "a-real-secret")
+
+
+def test_empty_authkey_refused():
+    with pytest.raises(RuntimeError):
+        check_listen_config("127.0.0.1", "")
@@ -0,0 +1,216 @@
+"""
+prompt 片段缓存：拼接各消息片段的结果必须与 apply_chat_template + 完整分词逐 token 一致
+"""
+import random
+import re
+
+import pytest
+from jinja2.sandbox import ImmutableSandboxedEnvironment
+
+from app.core.config import settings
+from app.core.metrics import metrics
+from app.services import ai_service
+from app.services.prompt_cache import PromptEncoder, _random_conversation
+
+# Qwen3 的对话模板（去掉了工具调用分支）：首条 system 单独渲染、
+# 历史 assistant 消息去掉思考内容、关闭思考时生成提示带空思考块
+QWEN3_TEMPLATE = """
+{%- if messages[0].role == 'system' %}
+    {{- '<|im_start|>system\\n' + messages[0].content + '<|im_end|>\\n' }}
+{%- endif %}
+{%- set ns = namespace(multi_step_tool=true, last_query_index=messages|length - 1) %}
+{%- for message in messages[::-1] %}
+    {%- set index = (messages|length - 1) - loop.index0 %}
+    {%- if ns.multi_step_tool and message.role == "user" and message.content is string %}
+        {%- set ns.multi_step_tool = false %}
+        {%- set ns.last_query_index = index %}
+    {%- endif %}
+{%- endfor %}
+{%- for message in messages %}
+    {%- set content = message.content %}
+    {%- if (message.role == "user") or (message.role == "system" and not loop.first) %}
+        {{- '<|im_start|>' + message.role + '\\n' + content + '<|im_end|>' + '\\n' }}
+    {%- elif message.role == "assistant" %}
+        {%- set reasoning_content = '' %}
+        {%- if '</think>' in content %}
+            {%- set reasoning_content = content.split('</think>')[0].rstrip('\\n').split('<think>')[-1].lstrip('\\n') %}
+            {%- set content = content.split('</think>')[-1].lstrip('\\n') %}
+        {%- endif %}
+        {%- if loop.index0 > ns.last_query_index %}
+            {%- if loop.last or (not loop.last and reasoning_content) %}
+                {{- '<|im_start|>' + message.role + '\\n<think>\\n' + reasoning_content.strip('\\n') + '\\n</think>\\n\\n' + content.lstrip('\\n') }}
+            {%- else %}
+                {{- '<|im_start|>' + message.role + '\\n' + content }}
+            {%- endif %}
+        {%- else %}
+            {{- '<|im_start|>' + message.role + '\\n' + content }}
+        {%- endif %}
+        {{- '<|im_end|>\\n' }}
+    {%- endif %}
+{%- endfor %}
+{%- if add_generation_prompt %}
+    {{- '<|im_start|>assistant\\n' }}
+    {%- if enable_thinking is defined and enable_thinking is false %}
+        {{- '<think>\\n\\n</think>\\n\\n' }}
+    {%- endif %}
+{%- endif %}
+"""
+
+# 渲染结果依赖消息位置的模板：片段无法独立缓存，校验应发现并回退
+POSITIONAL_TEMPLATE = (
+    "{%- for message in messages %}"
+    "{{- '<|im_start|>' + message.role + ' #' + loop.index|string + '\\n' + message.content + '<|im_end|>\\n' }}"
+    "{%- endfor %}"
+    "{%- if add_generation_prompt %}{{- '<|im_start|>assistant\\n' }}{%- endif %}"
+)
+
+ADDED_TOKENS = ["<|im_start|>", "<|im_end|>", "<think>", "</think>"]
+# 与 BPE 分词器的预切分类似：空白会并入后面的单词，单词内的合并依赖上下文
+PRETOKENIZE = re.compile(r" ?\w+| ?[^\s\w]+|\s+(?!\S)|\s+")
+
+
+class FakeTokenizer:
+    """先按特殊 token 切分、再预切分并查表的分词器，词表按需增长"""
+
+    def __init__(self, chat_template: str):
+        self.chat_template = chat_template
+        self.name_or_path = "fake-qwen3"
+        self.vocab = {token: i for i, token in enumerate(ADDED_TOKENS)}
+        self._split = re.compile("(" + "|".join(re.escape(t) for t in ADDED_TOKENS) + ")")
+        env = ImmutableSandboxedEnvironment(trim_blocks=True, lstrip_blocks=True)
+        self._template = env.from_string(chat_template)
+
+    def __len__(self):
+        return 151936
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=False, **kwargs):
+        return self._template.render(messages=messages, add_generation_prompt=add_generation_prompt, **kwargs)
+
+    def _encode(self, text):
+        ids = []
+        for part in self._split.split(text):
+            if part in ADDED_TOKENS:
+                ids.append(self.vocab[part])
+                continue
+            for piece in PRETOKENIZE.findall(part):
+                ids.append(self.vocab.setdefault(piece, len(self.vocab)))
+        return ids
+
+    def __call__(self, text, add_special_tokens=True):
+        input_ids = [self._encode(t) for t in text] if isinstance(text, list) else self._encode(text)
+
+        class Encoding:
+            pass
+
+        encoding = Encoding()
+        encoding.input_ids = input_ids
+        return encoding
+
+
+@pytest.fixture
+def encoder():
+    return PromptEncoder(FakeTokenizer(QWEN3_TEMPLATE), max_entries=1000)
+
+
+def assert_exact(encoder, messages, enable_thinking):
+    assert encoder.encode(messages, enable_thinking) == encoder.reference(messages, enable_thinking)
+
+
+@pytest.mark.parametrize("enable_thinking", [True, False])
+@pytest.mark.parametrize("messages", [
+    # 只有第一条消息
+    [{"role": "user", "content": "你好"}],
+    # 首条 system 与非首条 system
+    [{"role": "system", "content": "你是金融助手"}, {"role": "user", "content": "分析现金流"}],
+    [
+        {"role": "user", "content": "第一问"},
+        {"role": "system", "content": "参考资料：营业收入增长 12.5%"},
+        {"role": "user", "content": "第二问"},
+    ],
+    # 多轮对话
+    [
+        {"role": "user", "content": "ROE 怎么算？"},
+        {"role": "assistant", "content": "ROE = 净利润 / 净资产"},
+        {"role": "user", "content": "举个例子"},
+    ],
+    # 前后空白与换行
+    [
+        {"role": "user", "content": "  前后有空格  "},
+        {"role": "assistant", "content": "\n以换行开头和结尾\n"},
+        {"role": "user", "content": "\t制表符 "},
+    ],
+    # 内容中带 <think>：历史 assistant 消息的思考部分由模板去掉，user 消息原样保留
+    [
+        {"role": "user", "content": "<think>这不是思考</think>"},
+        {"role": "assistant", "content": "<think>\n思考内容\n</think>\n\n正式回答"},
+        {"role": "user", "content": "继续"},
+    ],
+])
+def test_concatenated_segments_match_full_encoding(encoder, messages, enable_thinking):
+    assert_exact(encoder, messages, enable_thinking)
+    # 第二次全部命中缓存，结果不变
+    assert_exact(encoder, messages, enable_thinking)
+
+
+def test_random_conversations_match_full_encoding(encoder):
+    rng = random.Random(0)
+    for _ in range(200):
+        assert_exact(encoder, _random_conversation(rng), rng.random() < 0.5)
+
+
+def test_system_segment_depends_on_position(encoder):
+    system = {"role": "system", "content": "规则"}
+    assert encoder.segment_text(system, True, True) == "<|im_start|>system\n规则<|im_end|>\n"
+    assert encoder.segment_text(system, False, True) == "<|im_start|>system\n规则<|im_end|>\n"
+    # 首条与非首条分别缓存
+    encoder.segment_ids(system, True, True)
+    encoder.segment_ids(system, False, True)
+    assert len(encoder._segments) == 2
+
+
+def test_persisted_segments_are_used(encoder):
+    message = {"role": "assistant", "content": "回答"}
+    fields = {"segment_key": encoder.segment_key(True), "segment_ids": list(encoder.segment_ids(message, False, True))}
+    messages = [{"role": "user", "content": "问题"}, {**message, **fields}, {"role": "user", "content": "追问"}]
+    before = metrics.get("prompt_cache_persisted_hits_total")
+    assert_exact(encoder, messages, True)
+    assert metrics.get("prompt_cache_persisted_hits_total") == before + 1
+    # 思考模式不同时不使用持久化的片段
+    assert encoder.segment_ids({**message, **fields}, False, False) == encoder.segment_ids(message, False, False)
+
+
+def test_verify_disables_cache_and_returns_reference():
+    encoder = PromptEncoder(FakeTokenizer(POSITIONAL_TEMPLATE), max_entries=100)
+    messages = [
+        {"role": "user", "content": "a"},
+        {"role": "assistant", "content": "b"},
+        {"role": "user", "content": "c"},
+    ]
+    before = metrics.get("prompt_cache_mismatches_total")
+    result = encoder.verify(messages, True)
+    assert result == encoder.reference(messages, True)
+    assert encoder.disabled
+    assert metrics.get("prompt_cache_mismatches_total") == before + 1
+    assert metrics.get("prompt_cache_disabled", tokenizer=encoder.fingerprint) == 1
+
+
+def test_verify_passes_for_exact_template(encoder):
+    messages = [{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"}, {"role": "user", "content": "c"}]
+    assert encoder.verify(messages, False) is None
+    assert not encoder.disabled
+
+
+def test_build_prompt_ids_falls_back_to_reference(monkeypatch):
+    tokenizer = FakeTokenizer(POSITIONAL_TEMPLATE)
+    encoder = PromptEncoder(tokenizer, max_entries=100)
+    monkeypatch.setattr(settings, "PROMPT_CACHE_ENABLED", True)
+    monkeypatch.setattr(ai_service, "get_prompt_encoder", lambda model_name=None: encoder)
+    monkeypatch.setattr(ai_service, "get_tokenizer", lambda model_name=None: tokenizer)
+    messages = [{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"}, {"role": "user", "content": "c"}]
+    expected = encoder.reference(messages, True)
+
+    # 第一次：校验发现不一致，返回完整编码的结果并停用缓存
+    assert ai_service.build_prompt_ids(messages, True) == expected
+    assert encoder.disabled
+    # 之后直接走完整编码
+    assert ai_service.build_prompt_ids(messages, True) == expected
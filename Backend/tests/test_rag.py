@@ -0,0 +1,105 @@
+"""
+资料检索：切块、top-k 检索与索引替换
+"""
+import os
+
+import numpy as np
+import pytest
+
+from app.core.config import settings
+from app.services import rag_service
+from app.services.rag_service import chunk_text
+from app.services.vector_index import VectorIndex, VectorIndexWriter, normalize
+
+
+def build(index_dir, vectors, texts, dtype="float32"):
+    writer = VectorIndexWriter(index_dir, vectors.shape[1], dtype)
+    # 分多批写入
+    for start in range(0, len(vectors), 7):
+        writer.add(vectors[start:start + 7], [{"text": t} for t in texts[start:start + 7]])
+    writer.close()
+
+
+def test_chunk_text_respects_size_and_overlap():
+    text = "".join(f"第{i}句话的内容比较长一些。" for i in range(200))
+    chunks = chunk_text(text, size=100, overlap=20)
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    # 块尽量在句末断开
+    assert all(chunk.endswith("。") for chunk in chunks[:-1])
+    # 相邻块有重叠，拼接后覆盖全文
+    positions = [text.index(chunk) for chunk in chunks]
+    for position, chunk, next_position in zip(positions, chunks, positions[1:]):
+        assert position < next_position < position + len(chunk)
+    assert chunks[0].startswith("第0句") and chunks[-1].endswith("第199句话的内容比较长一些。")
+
+
+def test_chunk_text_without_punctuation():
+    text = "a" * 250
+    chunks = chunk_text(text, size=100, overlap=10)
+    assert [len(chunk) for chunk in chunks] == [100, 100, 70]
+
+
+def test_chunk_text_empty():
+    assert chunk_text("   \n ", size=100, overlap=10) == []
+
+
+@pytest.mark.parametrize("block_rows", [5, 64, 10_000])
+def test_search_matches_brute_force(tmp_path, block_rows):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((300, 16), dtype=np.float32)
+    queries = rng.standard_normal((4, 16), dtype=np.float32)
+    build(str(tmp_path / "index"), vectors, [str(i) for i in range(300)])
+    index = VectorIndex(str(tmp_path / "index"))
+
+    scores, ids = index.search(queries, 10, block_rows=block_rows)
+
+    expected_scores = normalize(queries) @ normalize(vectors).T
+    expected_ids = np.argsort(-expected_scores, axis=1)[:, :10]
+    np.testing.assert_array_equal(ids, expected_ids)
+    np.testing.assert_allclose(scores, np.take_along_axis(expected_scores, expected_ids, axis=1), rtol=1e-5)
+    assert [chunk["text"] for chunk in index.get_chunks(ids[0].tolist())] == [str(i) for i in expected_ids[0]]
+
+
+def test_search_k_larger_than_index(tmp_path):
+    vectors = np.eye(3, dtype=np.float32)
+    build(str(tmp_path / "index"), vectors, ["a", "b", "c"])
+    scores, ids = VectorIndex(str(tmp_path / "index")).search(vectors[1], 10)
+    assert ids.shape == (1, 3)
+    assert ids[0, 0] == 1
+
+
+def test_rebuild_swaps_directory_and_keeps_open_generation(tmp_path):
+    index_dir = str(tmp_path / "index")
+    rng = np.random.default_rng(1)
+    old_vectors = rng.standard_normal((20, 8), dtype=np.float32)
+    build(index_dir, old_vectors, [f"old-{i}" for i in range(20)])
+    old_index = VectorIndex(index_dir)
+
+    # 新索引的文本长度不同，偏移完全不同
+    new_vectors = rng.standard_normal((30, 8), dtype=np.float32)
+    build(index_dir, new_vectors, [f"new-text-{i}" * 3 for i in range(30)])
+
+    # 只剩替换后的目录，没有残留的临时目录或旧目录
+    assert sorted(os.listdir(tmp_path)) == ["index"]
+    # 已打开的旧实例仍读取旧文件
+    _, ids = old_index.search(old_vectors[5], 1)
+    assert old_index.get_chunks(ids[0].tolist()) == [{"text": "old-5"}]
+    new_index = VectorIndex(index_dir)
+    assert new_index.count == 30
+    assert new_index.get_chunks([2]) == [{"text": "new-text-2" * 3}]
+    old_index.close()
+    new_index.close()
+
+
+def test_get_index_keeps_open_index_during_swap(tmp_path, monkeypatch):
+    index_dir = str(tmp_path / "index")
+    build(index_dir, np.eye(4, dtype=np.float32), list("abcd"))
+    monkeypatch.setattr(settings, "RAG_INDEX_DIR", index_dir)
+    monkeypatch.setattr(rag_service, "_index", None)
+    index = rag_service.get_index()
+    assert index is not None
+
+    # 模拟替换间隙：目录暂时不存在
+    os.rename(index_dir, index_dir + ".old")
+    assert rag_service.get_index() is index
+    assert index.get_chunks([3]) == [{"text": "d"}]
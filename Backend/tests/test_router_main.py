@@ -0,0 +1,181 @@
+"""
+会话亲和路由入口：路由键提取、连接失败切换与 WebSocket 转发
+"""
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+from starlette.websockets import WebSocketDisconnect
+from websockets.exceptions import InvalidStatus
+
+from app import router_main
+from app.core.config import settings
+from app.services.routing_service import NodePool
+
+NODES = ["http://node-a:8000", "http://node-b:8000"]
+CONVERSATION_ID = "65f0c0ffee0123456789abcd"
+
+
+def make_request(path: str, headers: dict = None) -> Request:
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": path,
+        "query_string": b"",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+    })
+
+
+def test_routing_key_from_path():
+    request = make_request(f"{settings.API_PREFIX}/conversations/{CONVERSATION_ID}/export")
+    assert router_main.routing_key(request, b"") == CONVERSATION_ID
+
+
+def test_routing_key_from_chat_body():
+    request = make_request(f"{settings.API_PREFIX}/chat", {"Authorization": "Bearer t", "Idempotency-Key": "k1"})
+    body = f'{{"message": "hi", "conversation_id": "{CONVERSATION_ID}"}}'.encode()
+    assert router_main.routing_key(request, body) == CONVERSATION_ID
+    # 新会话没有ID时使用幂等键，重试落在同一节点
+    assert router_main.routing_key(request, b'{"message": "hi"}') == "k1"
+    assert router_main.routing_key(request, b"not json") == "k1"
+
+
+def test_routing_key_falls_back_to_authorization():
+    chat = make_request(f"{settings.API_PREFIX}/chat", {"Authorization": "Bearer t"})
+    assert router_main.routing_key(chat, b'{"message": "hi"}') == "Bearer t"
+    listing = make_request(f"{settings.API_PREFIX}/conversations", {"Authorization": "Bearer t"})
+    assert router_main.routing_key(listing, b"") == "Bearer t"
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(settings, "ROUTER_UNHEALTHY_AFTER", 1)
+    pool = NodePool(NODES, virtual_nodes=32)
+    monkeypatch.setattr(router_main, "node_pool", pool)
+    return pool
+
+
+def key_with_primary(pool: NodePool, node: str, prefix: str = "Bearer ") -> str:
+    return next(key for key in (f"{prefix}{i}" for i in range(1000)) if pool.candidates(key)[0] == node)
+
+
+def use_transport(monkeypatch, handler):
+    monkeypatch.setattr(router_main, "client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    return TestClient(router_main.app)
+
+
+def test_proxy_fails_over_on_connect_error(pool, monkeypatch):
+    seen = []
+
+    def handler(request: httpx.Request):
+        seen.append(request.url.host)
+        if request.url.host == "node-a":
+            raise httpx.ConnectError("connection refused", request=request)
+        body = f'{{"path": "{request.url.path}", "body": {request.content.decode()}}}'.encode()
+        # 以流的形式返回，与真实节点一样由代理逐块转发
+        return httpx.Response(200, stream=httpx.ByteStream(body), headers={"Content-Type": "application/json"})
+
+    client = use_transport(monkeypatch, handler)
+    key = key_with_primary(pool, NODES[0])
+    response = client.post(f"{settings.API_PREFIX}/chat", content=b'{"message": "hi"}', headers={"Authorization": key})
+
+    assert response.status_code == 200
+    assert response.headers["X-Routed-Node"] == NODES[1]
+    assert response.json() == {"path": f"{settings.API_PREFIX}/chat", "body": {"message": "hi"}}
+    assert seen == ["node-a", "node-b"]
+    # 失败的节点被标记为不可用，之后直接发往下一个节点
+    assert pool.candidates(key) == [NODES[1]]
+
+
+def test_proxy_does_not_retry_sent_request(pool, monkeypatch):
+    seen = []
+
+    def handler(request: httpx.Request):
+        seen.append(request.url.host)
+        raise httpx.ReadTimeout("read timeout", request=request)
+
+    client = use_transport(monkeypatch, handler)
+    response = client.get(f"{settings.API_PREFIX}/conversations", headers={"Authorization": key_with_primary(pool, NODES[0])})
+
+    assert response.status_code == 502
+    assert seen == ["node-a"]
+
+
+def test_proxy_all_nodes_down(pool, monkeypatch):
+    def handler(request: httpx.Request):
+        raise httpx.ConnectError("connection refused", request=request)
+
+    client = use_transport(monkeypatch, handler)
+    assert client.get(f"{settings.API_PREFIX}/models").status_code == 503
+
+
+class FakeUpstream:
+    """回显消息的节点 WebSocket 连接"""
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.close_code = None
+
+    async def send(self, message):
+        await self.queue.put(message)
+
+    async def close(self):
+        self.close_code = 1000
+        await self.queue.put(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self.queue.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def test_websocket_is_relayed_to_node_by_token(pool, monkeypatch):
+    connected = []
+    upstreams = []
+    token = key_with_primary(pool, NODES[0], prefix="token-")
+
+    async def connect(url, **kwargs):
+        connected.append(url)
+        if url.startswith("ws://node-a"):
+            raise ConnectionRefusedError()
+        upstreams.append(FakeUpstream())
+        return upstreams[-1]
+
+    monkeypatch.setattr(router_main, "ws_connect", connect)
+    client = TestClient(router_main.app)
+    with client.websocket_connect(f"{settings.API_PREFIX}/ws/chat?token={token}") as websocket:
+        websocket.send_text('{"type": "chat"}')
+        assert websocket.receive_text() == '{"type": "chat"}'
+        websocket.send_bytes(b"\x01")
+        assert websocket.receive_bytes() == b"\x01"
+
+    assert connected == [
+        f"ws://node-a:8000{settings.API_PREFIX}/ws/chat?token={token}",
+        f"ws://node-b:8000{settings.API_PREFIX}/ws/chat?token={token}",
+    ]
+    # 客户端断开后关闭到节点的连接
+    assert upstreams[0].close_code == 1000
+
+
+def test_websocket_rejected_by_node_is_closed(pool, monkeypatch):
+    async def connect(url, **kwargs):
+        raise InvalidStatus(httpx.Response(403))
+
+    monkeypatch.setattr(router_main, "ws_connect", connect)
+    client = TestClient(router_main.app)
+    with pytest.raises(WebSocketDisconnect) as exc_info:
+        with client.websocket_connect(f"{settings.API_PREFIX}/ws/chat?token=bad"):
+            pass
+    assert exc_info.value.code == 1008
@@ -0,0 +1,80 @@
+"""
+会话亲和路由：一致性哈希环与节点健康状态
+"""
+import pytest
+
+from app.core.config import settings
+from app.services.routing_service import HashRing, NodePool
+
+KEYS = [f"conversation-{i}" for i in range(4000)]
+NODES = [f"http://10.0.0.{i}:8000" for i in range(1, 5)]
+
+
+def owners(ring: HashRing) -> dict:
+    return {key: ring.walk(key)[0] for key in KEYS}
+
+
+def moved(before: dict, after: dict) -> float:
+    return sum(before[key] != after[key] for key in KEYS) / len(KEYS)
+
+
+def test_join_moves_about_one_nth_of_keys():
+    ring = HashRing(NODES)
+    before = owners(ring)
+    ring.add("http://10.0.0.5:8000")
+    after = owners(ring)
+
+    assert moved(before, after) == pytest.approx(1 / 5, abs=0.05)
+    # 改变归属的会话全部迁移到新节点
+    assert {after[key] for key in KEYS if before[key] != after[key]} == {"http://10.0.0.5:8000"}
+
+
+def test_leave_moves_only_that_nodes_keys():
+    ring = HashRing(NODES)
+    before = owners(ring)
+    ring.remove(NODES[0])
+    after = owners(ring)
+
+    assert moved(before, after) == pytest.approx(1 / 4, abs=0.05)
+    assert all(before[key] == NODES[0] for key in KEYS if before[key] != after[key])
+    assert sum(ring.shares().values()) == pytest.approx(1.0, abs=1e-3)
+
+
+def test_walk_is_deterministic():
+    ring = HashRing(NODES)
+    other = HashRing(reversed(NODES))
+    for key in KEYS[:200]:
+        order = ring.walk(key)
+        assert sorted(order) == sorted(NODES)
+        # 与节点加入的顺序和调用次数无关
+        assert order == ring.walk(key) == other.walk(key)
+    assert HashRing().walk("x") == []
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(settings, "ROUTER_UNHEALTHY_AFTER", 2)
+    return NodePool([node + "/" for node in NODES[:3]], virtual_nodes=64)
+
+
+def test_candidates_skip_unhealthy_node_until_recovery(pool):
+    key = KEYS[0]
+    primary, *rest = pool.candidates(key)
+
+    pool.mark(primary, False)
+    # 连续失败次数未达到阈值，仍是主节点
+    assert pool.candidates(key)[0] == primary
+    pool.mark(primary, False)
+    assert pool.candidates(key) == rest
+
+    pool.mark(primary, True)
+    assert pool.candidates(key) == [primary, *rest]
+
+
+def test_candidates_fall_back_to_ring_order_when_all_unhealthy(pool):
+    order = pool.candidates(KEYS[0])
+    for node in order:
+        pool.mark(node, False)
+        pool.mark(node, False)
+    assert pool.candidates(KEYS[0]) == order
+    assert not any(node["healthy"] for node in pool.status())
@@ -0,0 +1,94 @@
+"""
+滚动摘要：节省的 prompt token 数按会话所用模型的分词器统计
+"""
+import pytest
+from bson import ObjectId
+
+from app.core.config import settings
+from app.services import ai_service, summary_service
+from app.services.ai_service import count_prompt_tokens
+
+from conftest import run
+from fakes import FakeDatabase
+
+transformers = pytest.importorskip("transformers")
+tokenizers = pytest.importorskip("tokenizers")
+
+CHAT_TEMPLATE = (
+    "{% for message in messages %}"
+    "<|im_start|>{{ message.role }}\n{{ message.content }}<|im_end|>\n"
+    "{% endfor %}"
+)
+
+
+def build_tokenizer(words):
+    """按空白切分、逐词查表的真实 transformers 快速分词器"""
+    vocab = {"[UNK]": 0, "<|im_start|>": 1, "<|im_end|>": 2}
+    for word in words:
+        vocab.setdefault(word, len(vocab))
+    backend = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="[UNK]"))
+    backend.pre_tokenizer = tokenizers.pre_tokenizers.WhitespaceSplit()
+    tokenizer = transformers.PreTrainedTokenizerFast(tokenizer_object=backend, unk_token="[UNK]")
+    tokenizer.add_special_tokens({"additional_special_tokens": ["<|im_start|>", "<|im_end|>"]})
+    tokenizer.chat_template = CHAT_TEMPLATE
+    return tokenizer
+
+
+@pytest.fixture
+def tokenizers_by_model(monkeypatch):
+    tokenizers_by_model = {
+        None: build_tokenizer(["user", "assistant", "system"]),
+        "big": build_tokenizer(["user", "assistant", "system", "a", "b"]),
+    }
+    monkeypatch.setattr(ai_service, "get_tokenizer", lambda model_name=None: tokenizers_by_model[model_name])
+    return tokenizers_by_model
+
+
+def test_count_prompt_tokens_counts_template_tokens(tokenizers_by_model):
+    messages = [{"role": "user", "content": "a b c d"}, {"role": "assistant", "content": "e f"}]
+    # 每条消息: <|im_start|> role 内容... <|im_end|>
+    assert count_prompt_tokens(messages) == (1 + 1 + 4 + 1) + (1 + 1 + 2 + 1)
+    assert count_prompt_tokens([]) == 0
+
+
+def test_count_prompt_tokens_uses_model_tokenizer(tokenizers_by_model):
+    messages = [{"role": "user", "content": "a b"}]
+    text = tokenizers_by_model["big"].apply_chat_template(messages, tokenize=False)
+    assert count_prompt_tokens(messages, "big") == len(tokenizers_by_model["big"](text).input_ids)
+    # 两个分词器的词表不同，但 token 数量与内容一致
+    assert count_prompt_tokens(messages, "big") == count_prompt_tokens(messages) == 5
+
+
+def test_summary_records_token_counts_for_conversation_model(tokenizers_by_model, monkeypatch):
+    monkeypatch.setattr(settings, "CONTEXT_MAX_MESSAGES", 2)
+    monkeypatch.setattr(summary_service, "summarize_messages", lambda previous, messages: "摘要 内容")
+    used = []
+    real_count = ai_service.count_prompt_tokens
+
+    def recording_count(messages, model_name=None):
+        used.append(model_name)
+        return real_count(messages, model_name)
+
+    monkeypatch.setattr(summary_service, "count_prompt_tokens", recording_count)
+    db = FakeDatabase()
+    conversation_id = ObjectId()
+    db.conversations.docs[conversation_id] = {
+        "_id": conversation_id,
+        "user_id": "u1",
+        "messages": [
+            {"role": "user", "content": "a b c"},
+            {"role": "assistant", "content": "d e"},
+            {"role": "user", "content": "f"},
+            {"role": "assistant", "content": "g"},
+        ],
+        "summary_until": 0,
+    }
+
+    run(summary_service.update_conversation_summary(db, str(conversation_id), "big"))
+
+    doc = db.conversations.docs[conversation_id]
+    assert used == ["big", "big"]
+    assert doc["summary_until"] == 2
+    assert doc["summary_source_tokens"] == (1 + 1 + 3 + 1) + (1 + 1 + 2 + 1)
+    # "以下是此前对话的摘要：\n摘要 内容" 按空白切为 3 个词
+    assert doc["summary_tokens"] == 1 + 1 + 3 + 1
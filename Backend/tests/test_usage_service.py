@@ -0,0 +1,176 @@
+"""
+用量汇总：按 用户 / 天 / 模型 重新计算并整行替换，水位线认领与失败重试不会重复计数
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+
+from app.api.usage import get_usage
+from app.core.config import settings
+from app.services.usage_service import ROLLUP_KEY, _claim_window, rollup_pipeline, rollup_usage
+
+from conftest import run
+from fakes import FakeDatabase
+
+DAY1 = datetime(2026, 3, 1)
+DAY2 = datetime(2026, 3, 2)
+
+
+@pytest.fixture(autouse=True)
+def no_lag(monkeypatch):
+    monkeypatch.setattr(settings, "USAGE_ROLLUP_LAG_SECONDS", 0)
+
+
+def usage(model="qwen3", prompt=10, completion=20, thinking=5):
+    return {
+        "model": model, "prompt_tokens": prompt, "completion_tokens": completion,
+        "thinking_tokens": thinking, "queue_wait_ms": 1.5, "generation_ms": 100.0,
+    }
+
+
+def add_reply(db, user_id, created_at, **kwargs):
+    """在用户的会话中追加一问一答，回复带用量"""
+    conversation = next((c for c in db.conversations.docs.values() if c["user_id"] == user_id), None)
+    if conversation is None:
+        conversation = {"_id": ObjectId(), "user_id": user_id, "messages": []}
+        db.conversations.docs[conversation["_id"]] = conversation
+    conversation["messages"] += [
+        {"role": "user", "content": "问题", "created_at": created_at},
+        {"role": "assistant", "content": "回答", "created_at": created_at, "usage": usage(**kwargs)},
+    ]
+    conversation["updated_at"] = created_at
+
+
+def rows(db):
+    return {
+        key: {field: row[field] for field in ("messages", "prompt_tokens", "completion_tokens")}
+        for key, row in sorted(db.usage_daily.docs.items())
+    }
+
+
+def watermark(db):
+    return db.usage_rollup_state.docs[ROLLUP_KEY]["watermark"]
+
+
+def test_rollup_groups_by_user_day_model():
+    db = FakeDatabase()
+    add_reply(db, "u1", DAY1 + timedelta(hours=1))
+    add_reply(db, "u1", DAY1 + timedelta(hours=2), prompt=30)
+    add_reply(db, "u1", DAY1 + timedelta(hours=3), model="qwen3-lora")
+    add_reply(db, "u2", DAY2 + timedelta(hours=1))
+    # 没有用量的助手消息不计入
+    db.conversations.docs[next(iter(db.conversations.docs))]["messages"].append(
+        {"role": "assistant", "content": "取消", "created_at": DAY1 + timedelta(hours=4)}
+    )
+
+    window = run(rollup_usage(db, now=DAY2 + timedelta(hours=2)))
+
+    assert window == {"start": datetime(1970, 1, 1), "end": DAY2 + timedelta(hours=2)}
+    assert rows(db) == {
+        "u1:2026-03-01:qwen3": {"messages": 2, "prompt_tokens": 40, "completion_tokens": 40},
+        "u1:2026-03-01:qwen3-lora": {"messages": 1, "prompt_tokens": 10, "completion_tokens": 20},
+        "u2:2026-03-02:qwen3": {"messages": 1, "prompt_tokens": 10, "completion_tokens": 20},
+    }
+    assert db.usage_daily.docs["u2:2026-03-02:qwen3"]["user_id"] == "u2"
+
+
+def test_incremental_rollups_match_full_recompute():
+    db = FakeDatabase()
+    add_reply(db, "u1", DAY1 + timedelta(hours=1))
+    run(rollup_usage(db, now=DAY1 + timedelta(hours=2)))
+    add_reply(db, "u1", DAY1 + timedelta(hours=3))
+    run(rollup_usage(db, now=DAY1 + timedelta(hours=4)))
+    add_reply(db, "u1", DAY2 + timedelta(hours=1))
+    run(rollup_usage(db, now=DAY2 + timedelta(hours=2)))
+
+    assert watermark(db) == DAY2 + timedelta(hours=2)
+    assert rows(db) == {
+        "u1:2026-03-01:qwen3": {"messages": 2, "prompt_tokens": 20, "completion_tokens": 40},
+        "u1:2026-03-02:qwen3": {"messages": 1, "prompt_tokens": 10, "completion_tokens": 20},
+    }
+
+
+def test_messages_inside_lag_wait_for_next_rollup(monkeypatch):
+    monkeypatch.setattr(settings, "USAGE_ROLLUP_LAG_SECONDS", 60)
+    db = FakeDatabase()
+    add_reply(db, "u1", DAY1 + timedelta(hours=1))
+    add_reply(db, "u1", DAY1 + timedelta(hours=1, seconds=30))
+    run(rollup_usage(db, now=DAY1 + timedelta(hours=1, seconds=70)))
+    assert rows(db)["u1:2026-03-01:qwen3"]["messages"] == 1
+    run(rollup_usage(db, now=DAY1 + timedelta(hours=2)))
+    assert rows(db)["u1:2026-03-01:qwen3"]["messages"] == 2
+
+
+def test_partial_merge_failure_is_retried_without_double_counting():
+    db = FakeDatabase()
+    add_reply(db, "u1", DAY1 + timedelta(hours=1))
+    add_reply(db, "u2", DAY1 + timedelta(hours=1))
+    run(rollup_usage(db, now=DAY1 + timedelta(hours=2)))
+    add_reply(db, "u1", DAY1 + timedelta(hours=3))
+    add_reply(db, "u2", DAY1 + timedelta(hours=3))
+
+    # $merge 写入一行后中断：水位线退回
+    db.conversations.fail_merge_after = 1
+    with pytest.raises(RuntimeError):
+        run(rollup_usage(db, now=DAY1 + timedelta(hours=4)))
+    assert watermark(db) == DAY1 + timedelta(hours=2)
+
+    db.conversations.fail_merge_after = None
+    window = run(rollup_usage(db, now=DAY1 + timedelta(hours=5)))
+    assert window["start"] == DAY1 + timedelta(hours=2)
+    assert rows(db) == {
+        "u1:2026-03-01:qwen3": {"messages": 2, "prompt_tokens": 20, "completion_tokens": 40},
+        "u2:2026-03-01:qwen3": {"messages": 2, "prompt_tokens": 20, "completion_tokens": 40},
+    }
+
+
+def test_reprocessing_a_window_is_idempotent():
+    db = FakeDatabase()
+    add_reply(db, "u1", DAY1 + timedelta(hours=1))
+    end = DAY1 + timedelta(hours=2)
+    for _ in range(3):
+        run(db.conversations.aggregate(rollup_pipeline(DAY1 + timedelta(hours=1), end)))
+    assert rows(db) == {"u1:2026-03-01:qwen3": {"messages": 1, "prompt_tokens": 10, "completion_tokens": 20}}
+
+
+def test_older_result_does_not_replace_newer():
+    db = FakeDatabase()
+    add_reply(db, "u1", DAY1 + timedelta(hours=1))
+    add_reply(db, "u1", DAY1 + timedelta(hours=3))
+    # 两个进程认领相邻窗口，后一个窗口先完成
+    run(db.conversations.aggregate(rollup_pipeline(DAY1 + timedelta(hours=2), DAY1 + timedelta(hours=4))))
+    run(db.conversations.aggregate(rollup_pipeline(DAY1, DAY1 + timedelta(hours=2))))
+    assert rows(db)["u1:2026-03-01:qwen3"]["messages"] == 2
+    assert db.usage_daily.docs["u1:2026-03-01:qwen3"]["computed_until"] == DAY1 + timedelta(hours=4)
+
+
+def test_rollup_reads_only_conversations_updated_since_window_day():
+    pipeline = rollup_pipeline(DAY1 + timedelta(hours=5), DAY1 + timedelta(hours=6))
+    assert pipeline[0] == {"$match": {"updated_at": {"$gte": DAY1}}}
+    assert "$merge" in pipeline[-1]
+
+
+def test_claim_window_is_exclusive():
+    db = FakeDatabase()
+    end = DAY1 + timedelta(hours=1)
+    assert run(_claim_window(db, end)) == datetime(1970, 1, 1)
+    # 同一水位线只能被认领一次
+    assert run(_claim_window(db, end)) is None
+    assert run(_claim_window(db, end - timedelta(minutes=1))) is None
+    assert run(_claim_window(db, end + timedelta(hours=1))) == end
+    assert watermark(db) == end + timedelta(hours=1)
+
+
+def test_usage_endpoint_is_read_only():
+    db = FakeDatabase()
+    add_reply(db, "u1", DAY1 + timedelta(hours=1))
+    run(rollup_usage(db, now=DAY1 + timedelta(hours=2)))
+    add_reply(db, "u1", DAY1 + timedelta(hours=3))
+    calls = len(db.conversations.calls)
+
+    response = run(get_usage(None, None, {"id": "u1"}, db))
+
+    assert len(db.conversations.calls) == calls
+    assert watermark(db) == DAY1 + timedelta(hours=2)
+    assert [(day.day, day.messages) for day in response.days] == [("2026-03-01", 1)]
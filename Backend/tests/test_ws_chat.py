@@ -0,0 +1,103 @@
+"""
+WebSocket 会话状态：上下文缓存校验、会话锁回收与错误消息
+"""
+import asyncio
+import threading
+
+import pytest
+
+from app.api import ws_chat
+from app.api.ws_chat import ChatSession
+from app.schemas.chat import WsChatRequest
+
+from conftest import run
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+
+@pytest.fixture
+def session():
+    return ChatSession(FakeWebSocket(), db=None, user={"id": "u1"})
+
+
+def conversation(count):
+    messages = [{"role": "user", "content": f"m{i}"} for i in range(count)]
+    return {"id": "c1", "messages": messages, "message_count": count}
+
+
+def patch_db(monkeypatch, version, loaded):
+    calls = {"loads": 0}
+
+    async def get_version(db, conversation_id, user_id):
+        return version
+
+    async def get_by_id(db, conversation_id, user_id, projection=None):
+        calls["loads"] += 1
+        return loaded
+
+    monkeypatch.setattr(ws_chat, "get_conversation_version", get_version)
+    monkeypatch.setattr(ws_chat, "get_conversation_by_id", get_by_id)
+    return calls
+
+
+def test_cached_context_reused_when_version_matches(session, monkeypatch):
+    calls = patch_db(monkeypatch, (1, 2), conversation(2))
+    session._cache("c1", conversation(2))
+    state = run(session._load_state("c1"))
+    assert state["message_count"] == 2
+    assert calls["loads"] == 0
+
+
+def test_cached_context_reloaded_after_external_write(session, monkeypatch):
+    # 其他连接或 HTTP 接口又写入了两条消息
+    calls = patch_db(monkeypatch, (1, 4), conversation(4))
+    session._cache("c1", conversation(2))
+    state = run(session._load_state("c1"))
+    assert calls["loads"] == 1
+    assert state["message_count"] == 4
+    assert [m["content"] for m in state["messages"]][-1] == "m3"
+
+
+def test_cached_context_dropped_when_deleted(session, monkeypatch):
+    calls = patch_db(monkeypatch, None, None)
+    session._cache("c1", conversation(2))
+    assert run(session._load_state("c1")) is None
+    assert "c1" not in session.conversations
+    assert calls["loads"] == 0
+
+
+def test_conversation_locks_are_released(session):
+    async def scenario():
+        order = []
+
+        async def worker(name):
+            async with session._conversation_lock("c1"):
+                order.append(f"{name}-in")
+                await asyncio.sleep(0.01)
+                order.append(f"{name}-out")
+
+        await asyncio.gather(worker("a"), worker("b"))
+        return order
+
+    order = run(scenario())
+    # 同一会话串行执行，结束后不保留锁
+    assert order in (["a-in", "a-out", "b-in", "b-out"], ["b-in", "b-out", "a-in", "a-out"])
+    assert session.locks == {}
+
+
+def test_database_error_sends_error_frame(session, monkeypatch):
+    async def failing_create(db, user_id, title):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(ws_chat, "create_conversation", failing_create)
+    monkeypatch.setattr(ws_chat, "resolve_model_name", lambda name: "m")
+    request = WsChatRequest(type="chat", request_id="r1", message="hello")
+    run(session.handle_chat(request, threading.Event()))
+    assert session.websocket.sent[-1]["type"] == "error"
+    assert session.websocket.sent[-1]["request_id"] == "r1"
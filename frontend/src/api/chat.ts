@@ -2,7 +2,7 @@
  * 聊天相关 API
  */
 
-import request from './request'
+import request, { API_BASE_URL } from './request'
 
 // ==================== 类型定义 ====================
 
@@ -15,6 +15,7 @@ export interface ChatMessage {
 export interface ChatRequest {
   message: string
   conversation_id?: string | null
+  model?: string | null
 }
 
 export interface ChatResponse {
@@ -44,13 +45,34 @@ export interface MessageResponse {
   message: string
 }
 
+export interface BulkItemResult {
+  id: string
+  success: boolean
+  detail?: string | null
+}
+
+export interface BulkOperationResponse {
+  results: BulkItemResult[]
+  succeeded: number
+  failed: number
+}
+
+export interface DeleteAllResponse {
+  message: string
+  deleted_count: number
+}
+
 // ==================== API 函数 ====================
 
 /**
  * 发送聊天消息
+ *
+ * 重试同一条消息时传入相同的 idempotencyKey，后端不会重复生成
  */
-export function sendMessageAPI(data: ChatRequest): Promise<ChatResponse> {
-  return request.post('/aifs/chat', data) as unknown as Promise<ChatResponse>
+export function sendMessageAPI(data: ChatRequest, idempotencyKey: string = crypto.randomUUID()): Promise<ChatResponse> {
+  return request.post('/aifs/chat', data, {
+    headers: { 'Idempotency-Key': idempotencyKey },
+  }) as unknown as Promise<ChatResponse>
 }
 
 /**
@@ -82,3 +104,68 @@ export function updateConversationTitleAPI(conversationId: string, title: string
 export function deleteConversationAPI(conversationId: string): Promise<MessageResponse> {
   return request.delete(`/aifs/conversations/${conversationId}`) as unknown as Promise<MessageResponse>
 }
+
+
+/**
+ * 批量删除会话
+ */
+export function bulkDeleteConversationsAPI(ids: string[]): Promise<BulkOperationResponse> {
+  return request.post('/aifs/conversations/bulk/delete', { ids }) as unknown as Promise<BulkOperationResponse>
+}
+
+/**
+ * 批量重命名会话
+ */
+export function bulkRenameConversationsAPI(items: { id: string; title: string }[]): Promise<BulkOperationResponse> {
+  return request.post('/aifs/conversations/bulk/rename', { items }) as unknown as Promise<BulkOperationResponse>
+}
+
+/**
+ * 批量归档会话
+ */
+export function bulkArchiveConversationsAPI(ids: string[]): Promise<BulkOperationResponse> {
+  return request.post('/aifs/conversations/bulk/archive', { ids }) as unknown as Promise<BulkOperationResponse>
+}
+
+/**
+ * 删除全部会话
+ */
+export function deleteAllConversationsAPI(): Promise<DeleteAllResponse> {
+  return request.delete('/aifs/conversations') as unknown as Promise<DeleteAllResponse>
+}
+
+/**
+ * 导出聊天记录（流式下载，返回文件 Blob）
+ */
+export function exportConversationsAPI(
+  format: 'jsonl' | 'markdown' = 'jsonl',
+  ids?: string[],
+  gzip = false
+): Promise<Blob> {
+  return request.get('/aifs/conversations/export', {
+    params: { format, ids, gzip },
+    paramsSerializer: { indexes: null },  // ids=a&ids=b
+    responseType: 'blob',
+  }) as unknown as Promise<Blob>
+}
+
+// ==================== WebSocket 聊天 ====================
+
+export type ChatSocketMessage =
+  | { type: 'start'; request_id: string; conversation_id: string }
+  | { type: 'delta'; request_id: string; conversation_id: string; content: string }
+  | { type: 'done'; request_id: string; conversation_id: string; message: string; cancelled: boolean; degraded: number }
+  | { type: 'error'; request_id: string | null; detail: string }
+
+/**
+ * 建立 WebSocket 聊天连接（每个连接只认证一次，可同时进行多个会话）
+ *
+ * 发送: { type: 'chat', request_id, message, conversation_id?, model? } 或 { type: 'cancel', request_id }
+ */
+export function openChatSocket(onMessage: (message: ChatSocketMessage) => void): WebSocket {
+  const token = localStorage.getItem('token') || ''
+  const url = `${API_BASE_URL.replace(/^http/, 'ws')}/aifs/ws/chat?token=${encodeURIComponent(token)}`
+  const socket = new WebSocket(url)
+  socket.onmessage = (event) => onMessage(JSON.parse(event.data) as ChatSocketMessage)
+  return socket
+}